@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+"""Benchmark loading, saving and discovering environments.
+
+Synthetic env files are generated on a temporary directory, with a tunable
+number of files, variables and value sizes, and the results are printed as
+JSON so they can be compared between releases:
+
+    python benchmarks/run.py --files 10 --variables 200 --output before.json
+    python benchmarks/run.py --files 10 --variables 200 --compare before.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from envcrypto.artifact import compile_state  # noqa: E402
+from envcrypto.crypto import Encrypter  # noqa: E402
+from envcrypto.state import State, StateList  # noqa: E402
+
+LEVEL_PREFIX = 'bench-'
+
+SETTINGS = '''from enum import Enum
+
+from envcrypto import DeployLevel
+
+Levels = Enum('Levels', {names!r})
+SECRET_KEY = 'DJANGO-ENVCRYPTO'
+DEPLOY = DeployLevel(levels=Levels, lazy={lazy!r})
+'''
+
+IMPORT_SCRIPT = '''import os, sys, time
+sys.path.insert(0, {root!r})
+sys.path.insert(0, os.getcwd())
+os.environ['DJANGO_SETTINGS_MODULE'] = 'bench_settings'
+import django
+start = time.perf_counter()
+django.setup()
+print(time.perf_counter() - start)
+'''
+
+PACKAGE_IMPORT_SCRIPT = '''import sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+from envcrypto import DeployLevel
+print(time.perf_counter() - start, int('cryptography' in sys.modules))
+'''
+
+
+def measure(function, repeat):
+    """Run a function several times and return the timings in seconds."""
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+        'repeat': repeat,
+    }
+
+
+def create_files(options):
+    """Create the env files and return the key of the first one."""
+    keys = []
+    value = 'x' * options.value_size
+    for i in range(options.files):
+        state = State.new(
+            '{}{}'.format(LEVEL_PREFIX, i),
+            crypto_algorithm=options.algorithm)
+        for j in range(options.variables):
+            state.add('VARIABLE_{}'.format(j), value)
+        state.save()
+        keys.append(state.key)
+
+    return keys
+
+
+def bench_encrypter(options, key):
+    """Measure the encryption and decryption of single values."""
+    encrypter = Encrypter(
+        key=key, algorithm=State.cipher_algorithm(options.algorithm))
+    value = 'x' * options.value_size
+    count = max(options.variables, 1)
+    tokens = [encrypter.encrypt_token(value) for i in range(count)]
+
+    encrypt = measure(
+        lambda: [encrypter.encrypt_token(value) for i in range(count)],
+        options.repeat)
+    decrypt = measure(lambda: [encrypter.decrypt_token(t) for t in tokens],
+                      options.repeat)
+    encrypt_many = measure(lambda: encrypter.encrypt_many([value] * count),
+                           options.repeat)
+    decrypt_many = measure(lambda: encrypter.decrypt_many(tokens),
+                           options.repeat)
+
+    results = {
+        'encrypt': encrypt,
+        'decrypt': decrypt,
+        'encrypt_many': encrypt_many,
+        'decrypt_many': decrypt_many,
+    }
+    for result in results.values():
+        result['ops_per_second'] = count / result['median']
+        result['bytes_per_second'] = count * options.value_size / result[
+            'median']
+
+    return results
+
+
+def bench_state(options, key):
+    """Measure loading and saving the active state."""
+    filename = '{}0.{}'.format(LEVEL_PREFIX, State.FILE_EXTENSION)
+    state = State(filename, key=key, cache=False)
+    saves = itertools.count()
+
+    def save():
+        """Change a variable, so it is encrypted again, and save."""
+        state.add(
+            'VARIABLE_0',
+            str(next(saves)).rjust(options.value_size, 'x'),
+            force=True)
+        state.save()
+
+    return {
+        'state_load':
+        measure(lambda: State(filename, key=key, cache=False), options.repeat),
+        'state_load_lazy':
+        measure(lambda: State(filename, key=key, cache=False, lazy=True),
+                options.repeat),
+        'state_save':
+        measure(save, options.repeat),
+        'file_size':
+        os.path.getsize(filename),
+    }
+
+
+def bench_state_list(options, key):
+    """Measure the discovery of the active state and the variable check."""
+    load_filter = '{}*'.format(LEVEL_PREFIX)
+    state_list = StateList(key=key, load_filter=load_filter, cache=False)
+
+    return {
+        'discovery':
+        measure(
+            lambda: StateList(key=key, load_filter=load_filter, cache=False),
+            options.repeat),
+        'discovery_cached':
+        measure(lambda: StateList(key=key, load_filter=load_filter),
+                options.repeat),
+        'check_variables':
+        measure(state_list.check_variables, options.repeat),
+    }
+
+
+def bench_deploy_level(options, key, lazy=False, artifact=None):
+    """Measure setting Django up with settings that create a DeployLevel.
+
+    Django copies the settings when it is set up, so this includes the
+    decryption of every variable that isn't lazy. With an artifact the
+    settings load the compiled file instead.
+    """
+    names = {
+        'LEVEL_{}'.format(i): '{}{}'.format(LEVEL_PREFIX, i)
+        for i in range(options.files)
+    }
+    with open('bench_settings.py', 'w') as settings:
+        settings.write(SETTINGS.format(names=names, lazy=lazy))
+
+    environment = dict(os.environ)
+    environment['KEY'] = key.decode()
+    if artifact is not None:
+        load_filter = '{}*'.format(LEVEL_PREFIX)
+        compile_state(
+            StateList(key=key, load_filter=load_filter).get(), artifact)
+        environment['ENVCRYPTO_ARTIFACT'] = artifact
+    script = IMPORT_SCRIPT.format(root=ROOT)
+
+    timings = []
+    for i in range(options.repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-c', script], env=environment)
+        timings.append(float(output.decode().strip().splitlines()[-1]))
+
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+        'repeat': options.repeat,
+    }
+
+
+def bench_import(options):
+    """Measure importing the package, as a settings module does."""
+    script = PACKAGE_IMPORT_SCRIPT.format(root=ROOT)
+
+    timings = []
+    crypto_imported = False
+    for i in range(options.repeat):
+        output = subprocess.check_output([sys.executable, '-c', script])
+        timing, imported = output.decode().strip().splitlines()[-1].split()
+        timings.append(float(timing))
+        crypto_imported = crypto_imported or bool(int(imported))
+
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+        'repeat': options.repeat,
+        'crypto_imported': crypto_imported,
+    }
+
+
+def flatten(results, prefix=''):
+    """Return the median of each benchmark by its dotted name."""
+    medians = {}
+    for name, result in results.items():
+        if not isinstance(result, dict):
+            continue
+        if 'median' in result:
+            medians[prefix + name] = result['median']
+        else:
+            medians.update(flatten(result, prefix + name + '.'))
+    return medians
+
+
+def compare(results, filename):
+    """Print the ratio of each benchmark against a previous run."""
+    with open(filename) as previous_file:
+        previous = flatten(json.load(previous_file)['results'])
+
+    current = flatten(results)
+    for name in sorted(current):
+        if name in previous and previous[name]:
+            print('{:40} {:8.3f}x'.format(name, current[name] / previous[name]),
+                  file=sys.stderr)
+
+
+def run(options):
+    """Run all the benchmarks on a temporary directory."""
+    directory = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        key = create_files(options)[0]
+        return {
+            'import': bench_import(options),
+            'encrypter': bench_encrypter(options, key),
+            'state': bench_state(options, key),
+            'state_list': bench_state_list(options, key),
+            'deploy_level': bench_deploy_level(options, key),
+            'deploy_level_lazy': bench_deploy_level(options, key, lazy=True),
+            'deploy_level_compiled': bench_deploy_level(
+                options, key, artifact='bench.compiled'),
+        }
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+
+
+def main():
+    """Parse the arguments and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=5)
+    parser.add_argument('--variables', type=int, default=100)
+    parser.add_argument('--value-size', type=int, default=64)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument(
+        '--algorithm', choices=State.ALGORITHMS, default=State.FERNET)
+    parser.add_argument('--output', type=str)
+    parser.add_argument('--compare', type=str)
+    options = parser.parse_args()
+
+    results = run(options)
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'files': options.files,
+            'variables': options.variables,
+            'value_size': options.value_size,
+            'algorithm': options.algorithm,
+        },
+        'results': results,
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+    if options.compare:
+        compare(results, options.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,55 @@
-"""Initiates the available classes."""
-from .crypto import Encrypter
+"""Initiates the available classes.
+
+The classes are only imported when they are first used, so importing the
+package from the settings doesn't import the crypto modules.
+"""
+import sys
+from importlib import import_module
+from types import ModuleType
+
+from . import exceptions
 from .exceptions import *
-from .levels import DeployLevel, Deployment
-from .state import State, StateList
+
+# the app config is only needed by Django, the package can be used without it
+try:
+    import django
+except ImportError:
+    pass
+else:
+    if django.VERSION < (3, 2):
+        default_app_config = 'envcrypto.apps.EnvcryptoConfig'
+
+LAZY_NAMES = {
+    'Encrypter': 'crypto',
+    'DeployLevel': 'levels',
+    'Deployment': 'levels',
+    'Keyring': 'keyring',
+    'State': 'state',
+    'StateList': 'state',
+}
+
+__all__ = sorted(LAZY_NAMES) + [
+    name for name in dir(exceptions) if not name.startswith('_')
+]
+
+
+class LazyPackage(ModuleType):
+    """A package that imports its classes when they are accessed."""
+
+    def __getattr__(self, name):
+        """Import the module of a class."""
+        if name not in LAZY_NAMES:
+            raise AttributeError("module '{}' has no attribute '{}'".format(
+                self.__name__, name))
+
+        value = getattr(
+            import_module('.' + LAZY_NAMES[name], self.__name__), name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        """List the lazy classes together with the module attributes."""
+        return sorted(set(super().__dir__()) | set(LAZY_NAMES))
+
+
+sys.modules[__name__].__class__ = LazyPackage
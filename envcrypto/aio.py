@@ -0,0 +1,144 @@
+"""Load the states from asyncio code without blocking the event loop."""
+import asyncio
+import functools
+
+from .exceptions import VariableNotFound
+from .state import StateList
+
+
+async def run_in_executor(executor, function, *args, **kwargs):
+    """Run a blocking function on an executor, the default one if None."""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        executor, functools.partial(function, *args, **kwargs))
+
+
+class AsyncState(object):
+    """A State that reads and saves its variables off the event loop."""
+
+    def __init__(self, state, executor=None):
+        """Wrap a loaded State."""
+        self.state = state
+        self.executor = executor
+
+    @property
+    def name(self):
+        """Return the name of the state."""
+        return self.state.name
+
+    @property
+    def django_secret(self):
+        """Return the Django SECRET_KEY of the state."""
+        return self.state.django_secret
+
+    def keys(self):
+        """Return each of the variable names, without decrypting them."""
+        return self.state.keys()
+
+    def __contains__(self, key):
+        """Check if a variable exists, without decrypting it."""
+        return key in self.state
+
+    async def aget(self, name):
+        """Return the value of a variable, decrypting it if needed."""
+        name = name.upper()
+        if name == self.state.SECRET_KEY:
+            return self.state.django_secret
+        if name not in self.state.data:
+            raise VariableNotFound
+        if self.state.data.is_decrypted(name):
+            return self.state.data[name]
+
+        return await run_in_executor(self.executor, self.state.data.__getitem__,
+                                     name)
+
+    async def aget_many(self, names=None):
+        """Return a dictionary of variables, decrypted in a single batch.
+
+        All the variables are returned when names is None.
+        """
+        if names is None:
+            names = list(self.state.data)
+        names = [name.upper() for name in names]
+        for name in names:
+            if name not in self.state.data:
+                raise VariableNotFound
+
+        def get_many():
+            data = self.state.data
+            data.decrypt_all(names)
+            return {name: data[name] for name in names}
+
+        return await run_in_executor(self.executor, get_many)
+
+    async def aadd(self, key, value, force=False):
+        """Add a variable, reading the file again under its lock, and save."""
+
+        def add():
+            with self.state.locked():
+                self.state.add(key, value, force=force)
+                self.state.save()
+
+        await run_in_executor(self.executor, add)
+
+    async def asave(self):
+        """Save the state to disk."""
+        await run_in_executor(self.executor, self.state.save)
+
+    async def areload(self):
+        """Read the state from the file again."""
+        await run_in_executor(self.executor, self.state.reload)
+
+
+class AsyncStateList(object):
+    """A StateList loaded off the event loop.
+
+    Several lists, for instance with different keys or filters, can be
+    loaded concurrently with asyncio.gather.
+    """
+
+    def __init__(self, state_list, executor=None):
+        """Wrap a loaded StateList."""
+        self.state_list = state_list
+        self.executor = executor
+
+    @classmethod
+    async def load(cls, *args, executor=None, **kwargs):
+        """Read and decrypt the states on an executor.
+
+        The arguments are the same as the ones of StateList, and lazy=True
+        leaves the variables to be decrypted by AsyncState.aget.
+        """
+        state_list = await run_in_executor(executor, StateList, *args,
+                                           **kwargs)
+        return cls(state_list, executor=executor)
+
+    @classmethod
+    async def find_variable(cls, name, key=None, load_filter='*',
+                            executor=None):
+        """Return the name of the active state and the value of a variable."""
+        return await run_in_executor(
+            executor,
+            StateList.find_variable,
+            name,
+            key=key,
+            load_filter=load_filter)
+
+    @property
+    def profile(self):
+        """Return the LoadProfile of the states."""
+        return self.state_list.profile
+
+    def get(self):
+        """Return the active state."""
+        state = self.state_list.get()
+        if state is None:
+            return None
+        return AsyncState(state, executor=self.executor)
+
+    async def check_variables(self, raise_on_warning=False):
+        """Check that all files have the same variables."""
+        await run_in_executor(
+            self.executor,
+            self.state_list.check_variables,
+            raise_on_warning=raise_on_warning)
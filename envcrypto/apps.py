@@ -0,0 +1,13 @@
+"""The configuration of the envcrypto app."""
+from django.apps import AppConfig
+from django.core import checks
+
+
+class EnvcryptoConfig(AppConfig):
+    name = 'envcrypto'
+    verbose_name = 'Django Envcrypto'
+
+    def ready(self):
+        """Register the system checks."""
+        from .checks import TAG, check_variables
+        checks.register(check_variables, TAG)
@@ -0,0 +1,228 @@
+"""Compile the active state into a single encrypted file.
+
+The compiled file holds the name, the Django SECRET_KEY and the variables of
+the active state, encrypted as a single token after the name of its cipher.
+Loading it needs one read and one decryption, without looking for the .env
+files, parsing them or checking their variables, which makes the startup of
+containers faster.
+
+The path and a sha256 of the content of the .env file are written in plain
+text after the name of the cipher, so a compiled file isn't decrypted once
+its .env file changed, and the blobs are read from the directory of the .env
+file. The .env file is looked for next to the compiled file first, so a
+compiled file deployed with a new checkout, or moved with its .env file, is
+still checked.
+"""
+import hashlib
+import os
+
+from . import serializers
+from .crypto import Encrypter
+from .exceptions import InvalidEnvFile, InvalidKey, StaleArtifact
+from .files import atomic_write
+from .profiling import BYTES_READ, DECRYPT, FILES_SCANNED, READ, LoadProfile
+from .state import State, read_env
+
+ARTIFACT_ENV = 'ENVCRYPTO_ARTIFACT'
+DEFAULT_FILENAME = 'envcrypto.compiled'
+
+NAME = 'name'
+VERSION = 'version'
+DATA = 'data'
+SOURCE = 'source'
+
+
+def source_signature(filename):
+    """Return the sha256 of the content of a file, or None.
+
+    The content is compared, rather than the modification time, which
+    changes on every checkout of the same file.
+    """
+    try:
+        with open(filename, 'rb') as source_file:
+            return [hashlib.sha256(source_file.read()).hexdigest()]
+    except OSError:
+        return None
+
+
+def compile_state(state, filename=DEFAULT_FILENAME):
+    """Write the variables of a decrypted state to a compiled file."""
+    state.check_decrypted()
+    payload = {
+        NAME: state.name,
+        VERSION: State.CURRENT_VERSION,
+        State.SECRET_KEY: state.django_secret,
+        State.TYPES: state.types,
+        DATA: state.dump_values(state.data),
+    }
+    header = state.encrypter.algorithm
+    signature = source_signature(state.filename)
+    if signature is not None:
+        header = '{} {}'.format(
+            header,
+            serializers.dumps([os.path.abspath(state.filename)] + signature,
+                              compact=True))
+    atomic_write(
+        filename, '{}\n{}'.format(
+            header,
+            state.encrypter.encrypt_token(
+                serializers.dumps(payload, compact=True))))
+
+
+def read_header(header):
+    """Return the cipher and the source of the header of a compiled file.
+
+    The source is None for a compiled file without a .env file, or for one
+    written before the source was on its header.
+    """
+    algorithm, _, source = header.partition(' ')
+    if not source:
+        return algorithm, None
+    return algorithm, serializers.loads(source)
+
+
+class CompiledState(object):
+    """The variables of a compiled state, which can't be changed."""
+
+    SECRET_KEY = State.SECRET_KEY
+
+    def __init__(self, filename, name, django_secret, data):
+        """Keep the variables."""
+        self.filename = filename
+        self.name = name
+        self.django_secret = django_secret
+        self.data = data
+        self.decrypted = True
+
+    def __iter__(self):
+        """Return each of the data values."""
+        yield (self.SECRET_KEY, self.django_secret)
+        for k in self.data:
+            yield (k, self.data[k])
+
+    def keys(self):
+        """Return each of the variable names."""
+        yield self.SECRET_KEY
+        yield from self.data
+
+    def __contains__(self, key):
+        """Check if a variable exists."""
+        return key == self.SECRET_KEY or key in self.data
+
+    def variable_names(self):
+        """Return the set of variable names."""
+        return set(self.data)
+
+
+class CompiledStateList(object):
+    """A StateList with the single state of a compiled file.
+
+    The variables were checked when the file was compiled, so they are not
+    checked again. StaleArtifact is raised before decrypting if the .env file
+    changed since it was compiled, and a compiled file deployed without its
+    .env file reads the blobs from its own directory.
+    """
+
+    def __init__(self, filename=DEFAULT_FILENAME, key=None,
+                 profile_hook=None):
+        """Read and decrypt the compiled file."""
+        self.profile = LoadProfile(hook=profile_hook)
+        self.filename = filename
+
+        if key is None:
+            key = read_env(State.KEY)
+        try:
+            encrypter = Encrypter(key=key)
+        except:
+            raise InvalidKey("The supplied key is not a valid key")
+        encrypter.profile = self.profile
+
+        with self.profile.phase(READ):
+            try:
+                with open(filename, 'rb') as compiled_file:
+                    content = compiled_file.read()
+            except OSError:
+                raise InvalidEnvFile
+        self.profile.count(FILES_SCANNED)
+        self.profile.count(BYTES_READ, len(content))
+
+        try:
+            header, token = content.decode('utf-8').split('\n', 1)
+            algorithm, source = read_header(header)
+        except ValueError:
+            raise InvalidEnvFile("{} is not a compiled file".format(filename))
+
+        # the source is checked first, as a changed .env file may have a new key
+        directory = os.path.dirname(filename)
+        if source is not None:
+            directory = self.check_source(source[0], source[1:]) or directory
+
+        with self.profile.phase(DECRYPT):
+            try:
+                payload = serializers.loads(
+                    encrypter.for_algorithm(algorithm).decrypt_token(
+                        token.strip()))
+            except:
+                raise InvalidKey
+
+        # files compiled before the source was on the header
+        if source is None and SOURCE in payload:
+            directory = self.check_source(
+                payload[SOURCE][0], payload[SOURCE][1:]) or directory
+
+        data = payload[DATA]
+        for k, variable_type in payload.get(State.TYPES, {}).items():
+            data[k] = State.parse_value(variable_type, data[k], directory)
+
+        self.state = CompiledState(filename, payload[NAME],
+                                   payload[State.SECRET_KEY], data)
+        self.list_of_states = [self.state]
+
+    def check_source(self, source, signature):
+        """Return the directory of the .env file, if there is one.
+
+        The .env file is the one with the same name next to the compiled
+        file, or else the one it was compiled from. StaleArtifact is raised
+        if its content changed since it was compiled.
+        """
+        for filename in (os.path.join(
+                os.path.dirname(os.path.abspath(self.filename)),
+                os.path.basename(source)), source):
+            current = source_signature(filename)
+            if current is None:
+                continue
+            if current != signature:
+                raise StaleArtifact("{} changed since {} was compiled".format(
+                    filename, self.filename))
+            return os.path.dirname(filename)
+        return None
+
+    @classmethod
+    def find(cls, filename=None):
+        """Return the compiled file to use, or None if there isn't one.
+
+        The file is the one passed, or the one set on the ENVCRYPTO_ARTIFACT
+        environment variable, and it is only used if it exists.
+        """
+        if filename is None:
+            filename = os.environ.get(ARTIFACT_ENV)
+        if filename is None or not os.path.exists(filename):
+            return None
+        return filename
+
+    def get(self):
+        """Return the compiled state."""
+        return self.state
+
+    def check_variables(self, raise_on_warning=False):
+        """Do nothing, the variables were checked when compiling."""
+        pass
+
+    def release(self):
+        """Do nothing, there are no other states."""
+        pass
+
+    @property
+    def name(self):
+        """Return the name of the compiled state."""
+        return self.state.name
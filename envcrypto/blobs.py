@@ -0,0 +1,227 @@
+"""Store large values encrypted on sidecar files, read as streams.
+
+A blob is encrypted with its own random key on a file next to the .env file,
+in chunks of AES-GCM, so it is encrypted and decrypted with a bounded amount
+of memory. Each chunk nonce has its position and a flag on the last chunk,
+so chunks can't be reordered or the file truncated. The .env file only
+keeps the name of the blob file, its key and its size, encrypted as the
+value of the variable.
+"""
+import io
+import os
+import struct
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import hexlify
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from . import serializers
+from .exceptions import InvalidEnvFile, InvalidKey
+from .files import atomic_open
+
+FILE_EXTENSION = 'blob'
+MAGIC = b'ENVCBLOB'
+FORMAT_VERSION = 1
+CHUNK_SIZE = 64 * 1024
+KEY_SIZE = 32
+NONCE_PREFIX_SIZE = 7
+TAG_SIZE = 16
+# the magic, the format version, the chunk size and the nonce prefix
+HEADER = struct.Struct('>8sBI{}s'.format(NONCE_PREFIX_SIZE))
+
+
+def chunk_nonce(prefix, counter, last):
+    """Return the nonce of a chunk."""
+    return prefix + struct.pack('>I?', counter, last)
+
+
+def read_full(source, size):
+    """Read up to size bytes, unless the end of the source is reached."""
+    data = b''
+    while len(data) < size:
+        chunk = source.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def encrypt_stream(source, target, key, chunk_size=CHUNK_SIZE):
+    """Encrypt a binary source into a target, returning the size read."""
+    aead = AESGCM(key)
+    prefix = os.urandom(NONCE_PREFIX_SIZE)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, chunk_size, prefix)
+    target.write(header)
+
+    size = 0
+    counter = 0
+    chunk = read_full(source, chunk_size)
+    while True:
+        # the next chunk is read ahead to know if this is the last one
+        next_chunk = read_full(source, chunk_size) if len(
+            chunk) == chunk_size else b''
+        last = not next_chunk
+        target.write(
+            aead.encrypt(chunk_nonce(prefix, counter, last), chunk, header))
+        size += len(chunk)
+        if last:
+            return size
+        chunk = next_chunk
+        counter += 1
+
+
+def decrypt_stream(source, key):
+    """Yield the decrypted chunks of a binary source."""
+    header = read_full(source, HEADER.size)
+    try:
+        magic, version, chunk_size, prefix = HEADER.unpack(header)
+    except struct.error:
+        raise InvalidEnvFile
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise InvalidEnvFile
+
+    aead = AESGCM(key)
+    block_size = chunk_size + TAG_SIZE
+    counter = 0
+    block = read_full(source, block_size)
+    while True:
+        next_block = read_full(source, block_size) if len(
+            block) == block_size else b''
+        last = not next_block
+        try:
+            yield aead.decrypt(
+                chunk_nonce(prefix, counter, last), block, header)
+        except InvalidTag:
+            raise InvalidKey
+        if last:
+            return
+        block = next_block
+        counter += 1
+
+
+class BlobReader(io.RawIOBase):
+    """A binary file object of the decrypted content of a blob."""
+
+    def __init__(self, blob):
+        """Open the blob file."""
+        self.blob_file = open(blob.filename, 'rb')
+        self.chunks = decrypt_stream(self.blob_file, blob.key)
+        self.buffer = b''
+
+    def readable(self):
+        """The blob can be read."""
+        return True
+
+    def readinto(self, target):
+        """Read the next decrypted bytes into a buffer."""
+        while not self.buffer:
+            try:
+                self.buffer = next(self.chunks)
+            except StopIteration:
+                return 0
+            if not self.buffer:
+                return 0
+
+        size = min(len(target), len(self.buffer))
+        target[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+    def close(self):
+        """Close the blob file."""
+        if not self.closed:
+            self.blob_file.close()
+        super().close()
+
+
+class Blob(object):
+    """A large value, encrypted on a sidecar file.
+
+    The content is only read when it is accessed, with chunks(), open() or
+    read().
+    """
+
+    TYPE = 'blob'
+
+    FILE = 'file'
+    KEY = 'key'
+    SIZE = 'size'
+
+    def __init__(self, filename, key, size):
+        """Keep the file, the key and the size of the blob."""
+        self.filename = filename
+        self.key = key
+        self.size = size
+
+    @classmethod
+    def create(cls, directory, prefix, source):
+        """Encrypt a file name or a binary file object into a new blob."""
+        if isinstance(source, str):
+            with open(source, 'rb') as source_file:
+                return cls.create(directory, prefix, source_file)
+
+        key = os.urandom(KEY_SIZE)
+        filename = os.path.join(directory, '{}.{}.{}'.format(
+            prefix,
+            hexlify(os.urandom(8)).decode('utf-8'), FILE_EXTENSION))
+        with atomic_open(filename, 'wb') as blob_file:
+            size = encrypt_stream(source, blob_file, key)
+
+        return cls(filename, key, size)
+
+    @classmethod
+    def loads(cls, directory, metadata):
+        """Return the blob of the metadata saved on the .env file."""
+        metadata = serializers.loads(metadata)
+        return cls(
+            os.path.join(directory, metadata[cls.FILE]),
+            urlsafe_b64decode(metadata[cls.KEY]), metadata[cls.SIZE])
+
+    def dumps(self):
+        """Return the metadata to save on the .env file."""
+        metadata = {
+            self.FILE: os.path.basename(self.filename),
+            self.KEY: urlsafe_b64encode(self.key).decode('utf-8'),
+            self.SIZE: self.size,
+        }
+        return serializers.dumps(metadata, compact=True)
+
+    def chunks(self):
+        """Yield the decrypted content, one chunk at a time."""
+        with open(self.filename, 'rb') as blob_file:
+            yield from decrypt_stream(blob_file, self.key)
+
+    def open(self):
+        """Return a binary file object of the decrypted content."""
+        return io.BufferedReader(BlobReader(self))
+
+    def read(self):
+        """Return the whole decrypted content as bytes."""
+        return b''.join(self.chunks())
+
+    def remove(self):
+        """Remove the blob file."""
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+    def __eq__(self, other):
+        """Blobs are the same if they have the same file and key."""
+        if not isinstance(other, Blob):
+            return NotImplemented
+        return (self.filename, self.key) == (other.filename, other.key)
+
+    def __hash__(self):
+        """Hash the file and the key."""
+        return hash((self.filename, self.key))
+
+    def __str__(self):
+        """Return the whole decrypted content as text."""
+        return self.read().decode('utf-8')
+
+    def __repr__(self):
+        """Describe the blob without reading it."""
+        return '<Blob {} ({} bytes)>'.format(
+            os.path.basename(self.filename), self.size)
@@ -0,0 +1,150 @@
+"""Cache of decrypted states, so unchanged files are not decrypted again."""
+import glob
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from . import serializers
+from .files import atomic_write
+
+
+class StateCache(object):
+    """A bounded cache of decrypted states keyed by the file identity.
+
+    The identity of a file is its path, modification time, size, content hash
+    and the fingerprint of the key, so any change to the file or to the key
+    misses the cache. The least recently used states are evicted once the
+    cache holds max_size states.
+
+    When a cache_dir is given the states are also saved to disk, encrypted
+    with the key of the state, so they can be shared between processes.
+    """
+
+    MAX_SIZE = 16
+    CACHE_DIR_ENV = 'ENVCRYPTO_CACHE_DIR'
+    FILE_EXTENSION = 'cache'
+
+    _default = None
+
+    @classmethod
+    def default(cls):
+        """Return the process-wide cache."""
+        if cls._default is None:
+            cls._default = cls(cache_dir=os.environ.get(cls.CACHE_DIR_ENV))
+        return cls._default
+
+    @classmethod
+    def identity(cls, filename, content, fingerprint):
+        """Return the identity of the file with the given content."""
+        stat = os.stat(filename)
+        return (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size,
+                hashlib.sha256(content).hexdigest(), fingerprint)
+
+    def __init__(self, max_size=None, cache_dir=None):
+        """Create an empty cache."""
+        self.max_size = self.MAX_SIZE if max_size is None else max_size
+        self.cache_dir = cache_dir
+        self.states = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        """Return the number of states in memory."""
+        return len(self.states)
+
+    def get(self, identity, encrypter=None):
+        """Return the snapshot of a state, or None if it isn't cached."""
+        with self.lock:
+            snapshot = self.states.get(identity)
+            if snapshot is not None:
+                self.states.move_to_end(identity)
+                return snapshot
+
+        if self.cache_dir is None or encrypter is None:
+            return None
+
+        snapshot = self.read(identity, encrypter)
+        if snapshot is not None:
+            self.store(identity, snapshot)
+        return snapshot
+
+    def set(self, identity, snapshot, encrypter=None):
+        """Add the snapshot of a state to the cache."""
+        self.store(identity, snapshot)
+
+        if self.cache_dir is not None and encrypter is not None:
+            self.write(identity, snapshot, encrypter)
+
+    def store(self, identity, snapshot):
+        """Keep a snapshot in memory, evicting the oldest ones."""
+        with self.lock:
+            self.states[identity] = snapshot
+            self.states.move_to_end(identity)
+            while len(self.states) > self.max_size:
+                self.states.popitem(last=False)
+
+    def invalidate(self, filename):
+        """Remove every cached state of a file."""
+        path = os.path.abspath(filename)
+        with self.lock:
+            for identity in list(self.states):
+                if identity[0] == path:
+                    del self.states[identity]
+
+        if self.cache_dir is not None:
+            for cache_file in glob.glob(self.cache_filename(path, '*')):
+                self.remove(cache_file)
+
+    def clear(self):
+        """Remove every cached state."""
+        with self.lock:
+            self.states.clear()
+
+        if self.cache_dir is not None:
+            for cache_file in glob.glob(
+                    os.path.join(self.cache_dir, '*.{}'.format(
+                        self.FILE_EXTENSION))):
+                self.remove(cache_file)
+
+    def cache_filename(self, path, fingerprint):
+        """Return the name of the file that caches a path and a key."""
+        return os.path.join(
+            self.cache_dir, '{}-{}.{}'.format(
+                hashlib.sha256(path.encode('utf-8')).hexdigest(), fingerprint,
+                self.FILE_EXTENSION))
+
+    def read(self, identity, encrypter):
+        """Read a snapshot from disk."""
+        try:
+            with open(self.cache_filename(identity[0], identity[4])) as f_file:
+                cached = serializers.loads(
+                    encrypter.decrypt_token(f_file.read()))
+        except:
+            return None
+
+        # the file is only valid for the same identity
+        if cached.get('identity') != list(identity):
+            return None
+        return cached.get('state')
+
+    def write(self, identity, snapshot, encrypter):
+        """Save a snapshot to disk."""
+        cached = serializers.dumps({
+            'identity': list(identity),
+            'state': snapshot
+        })
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            atomic_write(
+                self.cache_filename(identity[0], identity[4]),
+                encrypter.encrypt_token(cached))
+        except OSError:
+            # the disk cache is only an optimization
+            pass
+
+    def remove(self, cache_file):
+        """Remove a cache file if it still exists."""
+        try:
+            os.remove(cache_file)
+        except OSError:
+            pass
@@ -0,0 +1,31 @@
+"""Django system checks of the environment files."""
+from django.core.checks import Warning
+
+from .exceptions import InvalidEnvFile
+
+TAG = 'envcrypto'
+
+
+def check_variables(app_configs=None, **kwargs):
+    """Warn about the variables that are missing from some environments.
+
+    Only the variable names are compared, so no key is needed.
+    """
+    from .state import StateList
+
+    try:
+        manifests = StateList.read_manifests()
+    except InvalidEnvFile:
+        return [
+            Warning(
+                'An environment file could not be read.',
+                id='envcrypto.W002')
+        ]
+
+    missing = StateList.find_missing_variables(manifests)
+    return [
+        Warning(
+            'Variable {} missing in states {}'.format(key, missing[key]),
+            hint='Add the variable to these environments with env-add.',
+            id='envcrypto.W001') for key in missing
+    ]
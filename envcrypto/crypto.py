@@ -1,28 +1,369 @@
 """Cryptography module implement all supported crypto."""
 
+import functools
+import hashlib
+import hmac
+import os
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from binascii import a2b_base64, b2a_base64
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 
-from cryptography.fernet import Fernet
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives.ciphers.aead import (AESGCM,
+                                                         ChaCha20Poly1305)
+
+from .exceptions import InvalidKey
+from .profiling import DECRYPT_CALLS
+
+
+class FernetCipher(object):
+    """AES-128-CBC with a HMAC-SHA256, as Fernet tokens."""
+
+    def __init__(self, key):
+        """Create the cipher of a key."""
+        self.fernet = Fernet(key)
+
+    def encrypt(self, data):
+        """Encrypt bytes into a token."""
+        return self.fernet.encrypt(data)
+
+    def decrypt(self, token):
+        """Decrypt a token into bytes."""
+        return self.fernet.decrypt(token)
+
+
+class AEADCipher(object):
+    """An AEAD cipher, with url-safe base64 tokens of a version byte, the
+    nonce and the ciphertext.
+
+    The version byte names the cipher, like the one of Fernet tokens, and
+    keeps the tokens from starting with a dash. Tokens written without it
+    are still decrypted. The cipher key is derived from the key, so the same
+    key can be used with every algorithm.
+    """
+
+    AEAD = None
+    LABEL = None
+    VERSION = None
+    NONCE_SIZE = 12
+
+    KEY_SIZE = 32
+
+    def __init__(self, key):
+        """Create the cipher of a key."""
+        key = urlsafe_b64decode(key)
+        if len(key) != self.KEY_SIZE:
+            raise ValueError("The key must be 32 url-safe base64 bytes.")
+        self.aead = self.AEAD(hmac.new(key, self.LABEL, hashlib.sha256).digest())
+
+    def encrypt(self, data):
+        """Encrypt bytes into a token."""
+        nonce = os.urandom(self.NONCE_SIZE)
+        return urlsafe_b64encode(self.VERSION + nonce +
+                                 self.aead.encrypt(nonce, data, None))
+
+    def decrypt(self, token):
+        """Decrypt a token into bytes."""
+        try:
+            data = urlsafe_b64decode(token)
+        except (ValueError, TypeError):
+            raise InvalidToken
+
+        # a token without the version byte may start with the same byte
+        if data[:1] == self.VERSION:
+            try:
+                return self.decrypt_data(data[1:])
+            except InvalidToken:
+                pass
+        return self.decrypt_data(data)
+
+    def decrypt_data(self, data):
+        """Decrypt the nonce and the ciphertext into bytes."""
+        try:
+            return self.aead.decrypt(data[:self.NONCE_SIZE],
+                                     data[self.NONCE_SIZE:], None)
+        except (InvalidTag, ValueError, TypeError):
+            raise InvalidToken
+
+
+class AESGCMCipher(AEADCipher):
+    """AES-256-GCM."""
+
+    AEAD = AESGCM
+    LABEL = b'django-envcrypto aes-gcm'
+    VERSION = b'\x81'
+
+
+class ChaCha20Poly1305Cipher(AEADCipher):
+    """ChaCha20-Poly1305."""
+
+    AEAD = ChaCha20Poly1305
+    LABEL = b'django-envcrypto chacha20-poly1305'
+    VERSION = b'\x82'
+
+
+def crypt_values(function, start, values):
+    """Run a function on each value.
+
+    A value that can't be processed raises InvalidKey with its position.
+    """
+    results = []
+    for i in range(len(values)):
+        try:
+            results.append(function(values[i]))
+        except (InvalidToken, UnicodeDecodeError, ValueError):
+            raise InvalidKey(start + i)
+    return results
+
+
+@functools.lru_cache(maxsize=16)
+def worker_encrypter(keys, algorithm, cipher):
+    """Return the Encrypter of a process pool worker, created only once.
+
+    The ciphers added with register_cipher on the parent are not on the
+    workers of a spawned process pool, so the cipher class is added here.
+    """
+    if algorithm not in Encrypter.CIPHERS:
+        Encrypter.register_cipher(algorithm, cipher)
+    return Encrypter(list(keys), algorithm)
+
+
+def crypt_chunk(keys, algorithm, cipher, method, start, values):
+    """Run an Encrypter method on a chunk of values.
+
+    This is a module function, so it can also run on a process pool, with
+    the cipher class sent along, which has to be importable by the workers.
+    """
+    encrypter = worker_encrypter(tuple(keys), algorithm, cipher)
+    return crypt_values(getattr(encrypter, method), start, values)
 
 
 class Encrypter(object):
-    """Generate symetric keys and encrypt / decrypts them."""
+    """Generate symetric keys and encrypt / decrypts them.
+
+    The key can also be a list of keys, or a string of keys separated by
+    commas. Messages are encrypted with the first key and decrypted with any
+    of them, which allows a transition window while a key is rotated.
+
+    The cipher is chosen by its algorithm name from CIPHERS, and more
+    ciphers can be added with register_cipher.
+    """
+
+    KEY_SEPARATOR = ','
+    # the batches are split in chunks, which run on a pool once there are
+    # enough of them and more than one CPU
+    CHUNK_SIZE = 256
+    PARALLEL_SIZE = 1024
+    MAX_WORKERS = 8
+    FINGERPRINT_LABEL = b'django-envcrypto key fingerprint'
+    FINGERPRINT_SIZE = 16
+
+    FERNET = 'fernet'
+    AES_GCM = 'aes-gcm'
+    CHACHA20_POLY1305 = 'chacha20-poly1305'
+    CIPHERS = {
+        FERNET: FernetCipher,
+        AES_GCM: AESGCMCipher,
+        CHACHA20_POLY1305: ChaCha20Poly1305Cipher,
+    }
+
+    @classmethod
+    def register_cipher(cls, algorithm, cipher):
+        """Add a cipher class, created with a key, with encrypt and decrypt."""
+        cls.CIPHERS[algorithm] = cipher
 
     @classmethod
     def generate_key(cls):
         """Generate a random key."""
         return Fernet.generate_key()
 
-    def __init__(self, key=None):
-        """Initialize a Fernet Symmetric encryption."""
-        self.fernet = Fernet(key)
+    @classmethod
+    def split_keys(cls, key):
+        """Return the list of keys in a key."""
+        if isinstance(key, (list, tuple)):
+            return list(key)
+        if isinstance(key, bytes):
+            key = key.decode("utf-8")
+        if isinstance(key, str):
+            return [k.strip() for k in key.split(cls.KEY_SEPARATOR)]
+        return [key]
+
+    def __init__(self, key=None, algorithm=None):
+        """Initialize the symmetric encryption of an algorithm, Fernet if None."""
+        if algorithm is None:
+            algorithm = self.FERNET
+        if algorithm not in self.CIPHERS:
+            raise ValueError("Unknown algorithm {}".format(algorithm))
+
+        self.keys = self.split_keys(key)
+        self.algorithm = algorithm
+        self.ciphers = [self.CIPHERS[algorithm](k) for k in self.keys]
+        self.fingerprints = [self.create_fingerprint(k) for k in self.keys]
+        self.fingerprint = self.fingerprints[0]
+        # the encrypters of the same keys with other algorithms
+        self.algorithms = {algorithm: self}
+        # a LoadProfile that counts the decryptions
+        self.profile = None
+
+    def for_algorithm(self, algorithm):
+        """Return an encrypter of the same keys with another algorithm."""
+        if algorithm is None:
+            algorithm = self.FERNET
+        if algorithm not in self.algorithms:
+            self.algorithms[algorithm] = Encrypter(self.keys, algorithm)
+            self.algorithms[algorithm].algorithms = self.algorithms
+        encrypter = self.algorithms[algorithm]
+        encrypter.profile = self.profile
+        return encrypter
+
+    def encrypt_bytes(self, data):
+        """Encrypt bytes with the first key."""
+        return self.ciphers[0].encrypt(data)
+
+    def decrypt_bytes(self, token):
+        """Decrypt a token with any of the keys."""
+        for cipher in self.ciphers:
+            try:
+                return cipher.decrypt(token)
+            except InvalidToken:
+                continue
+        raise InvalidToken
+
+    @classmethod
+    def create_fingerprint(cls, key):
+        """Create a non secret identifier of the key.
+
+        This is a truncated HMAC of a fixed label using the key, so it can be
+        stored in the clear to find the files that use the key.
+        """
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        digest = hmac.new(
+            urlsafe_b64decode(key), cls.FINGERPRINT_LABEL,
+            hashlib.sha256).hexdigest()
+        return digest[:cls.FINGERPRINT_SIZE]
+
+    @classmethod
+    def unwrap(cls, digest):
+        """Return the token inside a base64 digest."""
+        return a2b_base64(digest.encode("utf-8")).decode("utf-8")
 
     def encrypt(self, message):
         """Encrypt a message."""
-        ciphertext = self.fernet.encrypt(message.encode("utf-8"))
+        ciphertext = self.encrypt_bytes(message.encode("utf-8"))
         return b2a_base64(ciphertext).decode("utf-8").strip('\n')
 
     def decrypt(self, digest):
         """Decrypt a digest."""
+        if self.profile is not None:
+            self.profile.count(DECRYPT_CALLS)
         ciphertext = a2b_base64(digest.encode("utf-8"))
-        return self.fernet.decrypt(ciphertext).decode("utf-8")
+        return self.decrypt_bytes(ciphertext).decode("utf-8")
+
+    def encrypt_token(self, message):
+        """Encrypt a message into a token, which is already url-safe base64."""
+        return self.encrypt_bytes(message.encode("utf-8")).decode("utf-8")
+
+    def decrypt_token(self, token):
+        """Decrypt a token."""
+        if self.profile is not None:
+            self.profile.count(DECRYPT_CALLS)
+        return self.decrypt_bytes(token.encode("utf-8")).decode("utf-8")
+
+    def find_fingerprint(self, token):
+        """Return the fingerprint of the key that decrypts a token."""
+        for i in range(len(self.ciphers)):
+            try:
+                self.ciphers[i].decrypt(token.encode("utf-8"))
+            except:
+                continue
+            return self.fingerprints[i]
+        return None
+
+    def rotate_token(self, token):
+        """Encrypt a token again with the first key."""
+        return self.encrypt_bytes(self.decrypt_bytes(
+            token.encode("utf-8"))).decode("utf-8")
+
+    def map_many(self, method, values, executor=None):
+        """Run a method on many values, keeping their order.
+
+        The values can be a list, returning a list, or a mapping, returning a
+        dictionary with the same keys. The values are split in chunks that
+        run on the executor, or on a new thread pool for big batches when
+        there is more than one CPU. A value that can't be processed raises
+        InvalidKey with its key or position on the key attribute.
+
+        The chunks on the executor, which may be a process pool, create the
+        Encrypter once on each worker, while the others use this one.
+        """
+        names = None
+        if isinstance(values, Mapping):
+            names = list(values)
+            values = [values[name] for name in names]
+        else:
+            values = list(values)
+
+        if not values:
+            return [] if names is None else {}
+
+        workers = min(self.MAX_WORKERS, os.cpu_count() or 1)
+        chunks = [(i, values[i:i + self.CHUNK_SIZE])
+                  for i in range(0, len(values), self.CHUNK_SIZE)]
+        try:
+            if executor is None and (workers < 2 or
+                                     len(values) < self.PARALLEL_SIZE):
+                results = crypt_values(getattr(self, method), 0, values)
+            elif executor is None:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    results = self.run_chunks(
+                        pool,
+                        functools.partial(crypt_values, getattr(self, method)),
+                        chunks)
+            else:
+                results = self.run_chunks(
+                    executor,
+                    functools.partial(crypt_chunk, self.keys, self.algorithm,
+                                      self.CIPHERS[self.algorithm], method),
+                    chunks)
+        except InvalidKey as error:
+            index = error.args[0]
+            key = index if names is None else names[index]
+            error = InvalidKey("Could not process the value of {}".format(key))
+            error.key = key
+            raise error
+
+        if names is None:
+            return results
+        return dict(zip(names, results))
+
+    def run_chunks(self, executor, function, chunks):
+        """Run a function on the chunks on an executor and join the results."""
+        futures = [
+            executor.submit(function, start, chunk) for start, chunk in chunks
+        ]
+        results = []
+        for future in futures:
+            results.extend(future.result())
+        return results
+
+    def encrypt_many(self, messages, executor=None):
+        """Encrypt many messages into tokens."""
+        return self.map_many('encrypt_token', messages, executor=executor)
+
+    def decrypt_many(self, tokens, executor=None):
+        """Decrypt many tokens.
+
+        The decryptions on an executor are counted here, as the workers
+        don't have the profile.
+        """
+        tokens = tokens if isinstance(tokens, Mapping) else list(tokens)
+        if self.profile is not None and executor is not None:
+            self.profile.count(DECRYPT_CALLS, len(tokens))
+        return self.map_many('decrypt_token', tokens, executor=executor)
+
+    def rotate_many(self, tokens, executor=None):
+        """Encrypt many tokens again with the first key."""
+        return self.map_many('rotate_token', tokens, executor=executor)
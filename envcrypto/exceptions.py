@@ -31,6 +31,12 @@ class InvalidEnvFile(DjangoEnvcryptException):
     pass
 
 
+class StaleArtifact(InvalidEnvFile):
+    """The .env file changed since the compiled file was compiled."""
+
+    pass
+
+
 class FileWriteError(DjangoEnvcryptException):
     """Could not save the file"""
 
@@ -75,3 +81,9 @@ class InvalidKey(DjangoEnvcryptException):
     """The supplied key is not a valid key."""
 
     pass
+
+
+class InvalidVariableValue(DjangoEnvcryptException):
+    """The value of a variable doesn't match its type."""
+
+    pass
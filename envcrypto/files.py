@@ -0,0 +1,187 @@
+"""Write files atomically and lock them between processes."""
+import os
+import secrets
+import stat
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+LOCK_EXTENSION = 'lock'
+
+
+def fsync_directory(directory):
+    """Flush a directory, so a rename in it is durable."""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+
+    try:
+        fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def create_temporary(filename):
+    """Create a temporary file next to a file, returning its fd and name.
+
+    The file gets the mode of a file created with open(), from the umask,
+    instead of the mode of tempfile.mkstemp, which only the owner can read.
+    """
+    prefix = os.path.join(
+        os.path.dirname(os.path.abspath(filename)),
+        '.{}.'.format(os.path.basename(filename)))
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    while True:
+        temp_filename = '{}{}.tmp'.format(prefix, secrets.token_hex(8))
+        try:
+            return os.open(temp_filename, flags, 0o666), temp_filename
+        except FileExistsError:
+            continue
+
+
+@contextmanager
+def atomic_open(filename, mode='w'):
+    """Open a file that is either fully written or not changed at all.
+
+    The content is written to a temporary file on the same directory, and
+    once the block ends it is flushed to disk and renamed over the file. A
+    file that is replaced keeps its permissions, and a new file gets the
+    permissions of the umask.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_filename = create_temporary(filename)
+    try:
+        with os.fdopen(fd, mode) as temp_file:
+            yield temp_file
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+
+        try:
+            os.chmod(temp_filename, stat.S_IMODE(os.stat(filename).st_mode))
+        except OSError:
+            pass
+
+        os.replace(temp_filename, filename)
+    except:
+        try:
+            os.remove(temp_filename)
+        except OSError:
+            pass
+        raise
+
+    fsync_directory(directory)
+
+
+def atomic_write(filename, content):
+    """Write a file so it is either fully written or not changed at all."""
+    with atomic_open(filename) as atomic_file:
+        atomic_file.write(content)
+
+
+class FileLock(object):
+    """An advisory lock on a file, shared by processes and threads.
+
+    The lock is held on a separate .lock file, since the file itself is
+    replaced on every write, which is removed when the lock is released. It
+    can be acquired again by the thread that holds it.
+    """
+
+    def __init__(self, filename):
+        """Create the lock for a file."""
+        self.filename = '{}.{}'.format(
+            os.path.abspath(filename), LOCK_EXTENSION)
+        self.lock = threading.RLock()
+        self.count = 0
+        self.lock_file = None
+
+    def acquire(self):
+        """Wait for the lock."""
+        self.lock.acquire()
+        if self.count == 0:
+            try:
+                # the file may be removed by the process that held the lock,
+                # once it is acquired, and then it is opened again
+                while True:
+                    self.lock_file = open(self.filename, 'a')
+                    if fcntl is not None:
+                        fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX)
+                    elif msvcrt is not None:
+                        msvcrt.locking(self.lock_file.fileno(),
+                                       msvcrt.LK_LOCK, 1)
+                    if self.is_current():
+                        break
+                    self.lock_file.close()
+                    self.lock_file = None
+            except:
+                if self.lock_file is not None:
+                    self.lock_file.close()
+                    self.lock_file = None
+                self.lock.release()
+                raise
+        self.count += 1
+
+    def is_current(self):
+        """Check if the open lock file is still the one on the directory."""
+        try:
+            current = os.stat(self.filename)
+        except OSError:
+            return False
+        opened = os.fstat(self.lock_file.fileno())
+        return (current.st_dev, current.st_ino) == (opened.st_dev,
+                                                    opened.st_ino)
+
+    def release(self):
+        """Release the lock, removing the lock file."""
+        self.count -= 1
+        if self.count == 0:
+            try:
+                # removed while it is still locked, so nobody else holds it
+                try:
+                    os.remove(self.filename)
+                except OSError:
+                    pass
+                if fcntl is not None:
+                    fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+                elif msvcrt is not None:
+                    self.lock_file.seek(0)
+                    msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+            finally:
+                self.lock_file.close()
+                self.lock_file = None
+        self.lock.release()
+
+    def __enter__(self):
+        """Acquire the lock."""
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        """Release the lock."""
+        self.release()
+
+
+LOCKS = {}
+LOCKS_LOCK = threading.Lock()
+
+
+def file_lock(filename):
+    """Return the lock of a file."""
+    path = os.path.abspath(filename)
+    with LOCKS_LOCK:
+        if path not in LOCKS:
+            LOCKS[path] = FileLock(path)
+        return LOCKS[path]
@@ -0,0 +1,112 @@
+"""Read variables from dotenv and JSON documents."""
+import json
+import re
+
+from .exceptions import InvalidEnvFile
+
+DOTENV = 'dotenv'
+JSON = 'json'
+FORMATS = [DOTENV, JSON]
+
+NAME_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_.]*$')
+ESCAPES = {'n': '\n', 'r': '\r', 't': '\t', '"': '"', '\\': '\\'}
+
+
+def read_quoted(value):
+    """Return a quoted dotenv value and the text after it, or None.
+
+    Only double quoted values have escapes.
+    """
+    quote = value[0]
+    result = []
+    i = 1
+    while i < len(value):
+        if value[i] == quote:
+            return ''.join(result), value[i + 1:]
+        if quote == '"' and value[i] == '\\' and i + 1 < len(value):
+            result.append(ESCAPES.get(value[i + 1], value[i:i + 2]))
+            i += 2
+        else:
+            result.append(value[i])
+            i += 1
+    return None
+
+
+def unquote(value):
+    """Remove the quotes and the inline comment of a dotenv value.
+
+    A quoted value is read up to its closing quote, and only a comment can
+    follow it, otherwise the quotes are kept as part of the value.
+    """
+    if value[:1] in ('\'', '"'):
+        quoted = read_quoted(value)
+        if quoted is not None:
+            unquoted, rest = quoted[0], quoted[1].strip()
+            if not rest or rest.startswith('#'):
+                return unquoted
+
+    # remove inline comments from values without quotes
+    if ' #' in value:
+        value = value[:value.index(' #')]
+    return value.strip()
+
+
+def parse_dotenv(text):
+    """Read the variables of a dotenv document."""
+    variables = {}
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        if line.startswith('export '):
+            line = line[len('export '):].lstrip()
+
+        if '=' not in line:
+            raise InvalidEnvFile(
+                "Line {} is not a NAME=value assignment.".format(number))
+
+        name, value = line.split('=', 1)
+        name = name.strip()
+        if NAME_PATTERN.match(name) is None:
+            raise InvalidEnvFile(
+                "Line {} doesn't have a valid variable name.".format(number))
+        variables[name] = unquote(value.strip())
+
+    return variables
+
+
+def parse_json(text):
+    """Read the variables of a JSON object."""
+    try:
+        document = json.loads(text)
+    except ValueError:
+        raise InvalidEnvFile("The document is not valid JSON.")
+
+    if not isinstance(document, dict):
+        raise InvalidEnvFile("The JSON document should be an object.")
+
+    # values that aren't strings are kept as JSON
+    return {
+        name: value if isinstance(value, str) else json.dumps(value)
+        for name, value in document.items()
+    }
+
+
+def guess_format(text, filename=None):
+    """Guess the format of a document from its name or its content."""
+    if filename is not None and filename.lower().endswith('.json'):
+        return JSON
+    if text.lstrip().startswith('{'):
+        return JSON
+    return DOTENV
+
+
+def read_variables(text, file_format=None, filename=None):
+    """Read the variables of a document in any of the formats."""
+    if file_format is None:
+        file_format = guess_format(text, filename=filename)
+
+    if file_format == JSON:
+        return parse_json(text)
+    return parse_dotenv(text)
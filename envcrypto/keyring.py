@@ -0,0 +1,254 @@
+"""Open the states of several keys in the same process.
+
+A Keyring holds any number of keys and decrypts the state of a name on
+demand, with the key whose fingerprint is on the file. The decrypted states
+are kept in a bounded cache, the least recently used ones are evicted first
+and, with a ttl, states are read again once they are older than it, so a
+lookup of a cached state doesn't read or decrypt the file again.
+"""
+import glob
+import threading
+import time
+from collections import OrderedDict
+
+from .crypto import Encrypter
+from .exceptions import DeploymentLevelNotFound, InvalidEnvFile, InvalidKey
+from .profiling import LoadProfile
+from .state import State
+
+
+class Entry(object):
+    """A decrypted state and when it expires."""
+
+    __slots__ = ('state', 'fingerprint', 'expires')
+
+    def __init__(self, state, fingerprint, expires):
+        """Keep the state."""
+        self.state = state
+        self.fingerprint = fingerprint
+        self.expires = expires
+
+
+class Keyring(object):
+    """A set of keys, and a cache of the states they decrypt."""
+
+    MAX_SIZE = 32
+
+    def __init__(self,
+                 keys=None,
+                 load_filter='*',
+                 max_size=None,
+                 ttl=None,
+                 lazy=False,
+                 cache=True,
+                 profile_hook=None):
+        """Add the keys.
+
+        At most max_size states are kept decrypted, for at most ttl seconds
+        if it is given. lazy and cache are passed to each State.
+        """
+        self.load_filter = load_filter
+        self.max_size = self.MAX_SIZE if max_size is None else max_size
+        self.ttl = ttl
+        self.lazy = lazy
+        self.cache = cache
+        self.profile = LoadProfile(hook=profile_hook)
+
+        # the encrypter of each key fingerprint
+        self.encrypters = {}
+        # the file and key fingerprint of each state name
+        self.index = {}
+        self.states = OrderedDict()
+        self.lock = threading.RLock()
+
+        for key in keys or []:
+            self.add_key(key)
+
+    def add_key(self, key):
+        """Add a key, or keys separated by commas, returning its fingerprint."""
+        try:
+            encrypter = Encrypter(key=key)
+        except:
+            raise InvalidKey("The supplied key is not a valid key")
+        encrypter.profile = self.profile
+
+        with self.lock:
+            for fingerprint in encrypter.fingerprints:
+                self.encrypters[fingerprint] = encrypter
+        return encrypter.fingerprint
+
+    def remove_key(self, key):
+        """Remove a key and evict the states it decrypted."""
+        fingerprints = set(Encrypter(key=key).fingerprints)
+        with self.lock:
+            for fingerprint in fingerprints:
+                self.encrypters.pop(fingerprint, None)
+            evicted = [
+                self.states.pop(name) for name in list(self.states)
+                if self.states[name].fingerprint in fingerprints
+            ]
+        self.forget(evicted)
+
+    def forget(self, entries):
+        """Remove the evicted states from the StateCache they were read with.
+
+        Otherwise their decrypted snapshots would outlive the keyring bounds.
+        """
+        for entry in entries:
+            if entry.state.cache is not None:
+                entry.state.cache.invalidate(entry.state.filename)
+
+    def scan(self):
+        """Index the name and key fingerprint of every file.
+
+        Only the headers are searched, and the files that weren't written by
+        this version, with another layout, are parsed.
+        """
+        index = {}
+        for filename in sorted(
+                glob.glob('{}.{}'.format(self.load_filter,
+                                         State.FILE_EXTENSION))):
+            try:
+                fields = State.read_fields(filename,
+                                           [State.NAME, State.KEY_ID])
+                if State.NAME not in fields:
+                    fields = State.parse_file(filename)
+            except InvalidEnvFile:
+                continue
+            if State.NAME in fields:
+                index[fields[State.NAME]] = (filename,
+                                             fields.get(State.KEY_ID))
+
+        with self.lock:
+            self.index = index
+
+    def candidates(self, key_id):
+        """Return the encrypters to try on a file with a key fingerprint.
+
+        Files without the key fingerprint are tried with every key.
+        """
+        with self.lock:
+            if key_id is not None:
+                encrypter = self.encrypters.get(key_id)
+                return [] if encrypter is None else [encrypter]
+            return list({id(e): e for e in self.encrypters.values()}.values())
+
+    def names(self):
+        """Return the names of the states that the keys can decrypt."""
+        self.scan()
+        with self.lock:
+            index = dict(self.index)
+
+        names = []
+        for name in sorted(index):
+            filename, key_id = index[name]
+            candidates = self.candidates(key_id)
+            if key_id is None and candidates:
+                try:
+                    env_object = State.parse_file(filename)
+                except InvalidEnvFile:
+                    continue
+                candidates = [
+                    e for e in candidates if State.verify(e, env_object)
+                ]
+            if candidates:
+                names.append(name)
+        return names
+
+    def get(self, name):
+        """Return the decrypted state of a name.
+
+        The state is read and decrypted the first time, and then returned
+        from the cache until it is evicted or expires.
+        """
+        now = time.monotonic()
+        evicted = []
+        with self.lock:
+            entry = self.states.get(name)
+            if entry is not None:
+                if entry.expires is None or entry.expires > now:
+                    self.states.move_to_end(name)
+                    return entry.state
+                evicted.append(self.states.pop(name))
+        self.forget(evicted)
+
+        # the file is read without the lock, so other lookups don't wait
+        state, fingerprint = self.read(name)
+        entry = Entry(state, fingerprint, None)
+
+        evicted = []
+        with self.lock:
+            if fingerprint not in self.encrypters:
+                # the key was removed in the meantime
+                evicted = [entry]
+            else:
+                if self.ttl is not None:
+                    entry.expires = now + self.ttl
+                self.states[name] = entry
+                self.states.move_to_end(name)
+                while len(self.states) > self.max_size:
+                    evicted.append(self.states.popitem(last=False)[1])
+        self.forget(evicted)
+        return state
+
+    def read(self, name):
+        """Read and decrypt the state of a name, with its key fingerprint.
+
+        The files are indexed again if the name isn't found, or if its file
+        can't be decrypted, as it may have been saved with another key.
+        """
+        with self.lock:
+            if name not in self.index:
+                self.scan()
+            entry = self.index.get(name)
+
+        rescanned = False
+        while True:
+            if entry is None:
+                raise DeploymentLevelNotFound
+            filename, key_id = entry
+            for encrypter in self.candidates(key_id):
+                try:
+                    state = State(
+                        filename,
+                        key=encrypter.keys,
+                        read_from_env=False,
+                        lazy=self.lazy,
+                        encrypter=encrypter,
+                        cache=self.cache,
+                        profile=self.profile)
+                except InvalidKey:
+                    continue
+                except InvalidEnvFile:
+                    # the file was removed or renamed
+                    with self.lock:
+                        self.index.pop(name, None)
+                    raise
+                return state, encrypter.fingerprint
+
+            if rescanned:
+                raise InvalidKey
+            self.scan()
+            rescanned = True
+            with self.lock:
+                entry = self.index.get(name)
+            if entry == (filename, key_id):
+                raise InvalidKey
+
+    def evict(self, name=None):
+        """Remove a state from the cache, or every state without a name."""
+        with self.lock:
+            if name is None:
+                evicted = list(self.states.values())
+                self.states.clear()
+            else:
+                evicted = [self.states.pop(name)] if name in self.states else []
+        self.forget(evicted)
+
+    def __contains__(self, name):
+        """Check if a state is cached."""
+        return name in self.states
+
+    def __len__(self):
+        """Return the number of cached states."""
+        return len(self.states)
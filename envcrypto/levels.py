@@ -1,10 +1,18 @@
 """LevelConfig to describe levels."""
+import copy
+import logging
 import os
 import sys
+import threading
+import weakref
 from enum import Enum
+from types import ModuleType
 
 from .exceptions import DeploymentIsNotAClass, DeploymentIsNotAEnum
-from .state import StateList
+from .profiling import LOAD_GLOBALS, LoadProfile
+
+# the DeployLevels, whose locks are created again in forked processes
+DEPLOY_LEVELS = weakref.WeakSet()
 
 
 class Deployment(Enum):
@@ -18,11 +26,72 @@ class Deployment(Enum):
     PRODUCTION = 'production'
 
 
+class LazySettingsModule(ModuleType):
+    """A settings module that reads the State variables when they are accessed.
+
+    The variables are not listed by dir(), so Django doesn't copy, and
+    decrypt, each of them when it configures its settings. The value is set
+    on the module the first time it is read, so any later access is a
+    regular attribute lookup. It is only set while the state read is still
+    the one on the module, holding the reload lock, so a value of a reloaded
+    state is never kept.
+    """
+
+    STATE_ATTRIBUTE = '__envcrypto_state__'
+    LOCK_ATTRIBUTE = '__envcrypto_lock__'
+
+    def __getattr__(self, name):
+        """Read a variable from the State."""
+        while True:
+            state = self.__dict__.get(self.STATE_ATTRIBUTE)
+            if state is None or name not in state.data:
+                raise AttributeError(
+                    "module '{}' has no attribute '{}'".format(
+                        self.__name__, name))
+
+            value = state.data[name]
+            lock = self.__dict__.get(self.LOCK_ATTRIBUTE)
+            if lock is None:
+                setattr(self, name, value)
+                return value
+            with lock:
+                # the state was reloaded while the value was decrypted
+                if self.__dict__.get(self.STATE_ATTRIBUTE) is state:
+                    setattr(self, name, value)
+                    return value
+
+
 class DeployLevel(object):
     """Configuration for the several run levels."""
 
-    def __init__(self, levels=None, key=None):
-        """Set the level using the environment variable."""
+    def __init__(self,
+                 levels=None,
+                 key=None,
+                 lazy=False,
+                 profile_hook=None,
+                 check_variables=True,
+                 artifact=None,
+                 watch=None):
+        """Set the level using the environment variable.
+
+        With lazy=True the variables are only decrypted when they are read
+        from the settings module or with get(). They are not copied to the
+        Django settings, except those already defined on the settings
+        module. profile_hook is called with the time spent
+        on each phase of the loading. With check_variables=False the missing
+        variables are not checked on startup, which the envcrypto system
+        check also does.
+
+        The states preloaded with envcrypto.registry.preload are used instead
+        of reading the files again, decrypted with the lazy option they were
+        preloaded with. Otherwise the file compiled by env-compile,
+        passed as artifact or set on the ENVCRYPTO_ARTIFACT variable, is used
+        if it exists, can be read and its .env file didn't change since.
+
+        With watch set to a number of seconds, the file of the state is
+        checked on a thread that often, and the variables that changed are
+        updated on the settings module.
+        """
         if levels is None:
             levels = Deployment
         else:
@@ -35,9 +104,22 @@ class DeployLevel(object):
 
         self.levels = levels
         self.current_level = None
+        self.lazy = lazy
+        self.key = key
 
         self.parent = sys.modules[os.environ.get("DJANGO_SETTINGS_MODULE")]
-        self.state_list = StateList(key=key)
+        self.state_list = None
+        self.state = None
+        self.watcher = None
+        self.reload_lock = threading.Lock()
+        DEPLOY_LEVELS.add(self)
+
+        # without a key nothing is loaded, nor are the crypto modules imported
+        if key is None and "KEY" not in os.environ:
+            return
+
+        self.state_list = self.load_state_list(
+            key=key, lazy=lazy, profile_hook=profile_hook, artifact=artifact)
         self.state = self.state_list.get()
 
         # use the name of the state to get the current level
@@ -45,17 +127,194 @@ class DeployLevel(object):
             return
 
         self.current_level = levels(self.state.name)
-        self.state_list.check_variables()
-        self.load_globals()
+        if check_variables:
+            self.state_list.check_variables()
+        # only the active state is used from now on
+        self.state_list.release()
+        with self.profile.phase(LOAD_GLOBALS):
+            self.load_globals()
+
+        if watch is not None:
+            self.watch(watch)
+
+    @classmethod
+    def load_state_list(cls, key=None, lazy=False, profile_hook=None,
+                        artifact=None):
+        """Return the preloaded, compiled or read StateList.
+
+        The modules are imported here, so importing the settings doesn't
+        import the crypto modules until they are needed.
+        """
+        from . import registry
+        from .artifact import CompiledStateList
+        from .exceptions import InvalidEnvFile, InvalidKey, StaleArtifact
+        from .state import StateList
+
+        state_list = registry.get(key=key)
+        if state_list is not None:
+            # the preloaded StateList is shared, so a copy is released, and
+            # this startup is measured on its own profile
+            state_list = copy.copy(state_list)
+            state_list.profile = LoadProfile(hook=profile_hook)
+            return state_list
+
+        artifact = CompiledStateList.find(artifact)
+        if artifact is not None:
+            try:
+                return CompiledStateList(
+                    artifact, key=key, profile_hook=profile_hook)
+            except StaleArtifact as e:
+                logging.warning("{}, reading the .env files".format(e))
+            except InvalidEnvFile:
+                logging.warning("Could not read {}, reading the .env files".
+                                format(artifact))
+            except InvalidKey:
+                logging.warning(
+                    "Could not decrypt {}, reading the .env files".format(
+                        artifact))
+
+        return StateList(key=key, lazy=lazy, profile_hook=profile_hook)
+
+    @property
+    def profile(self):
+        """Return the LoadProfile of the startup, or None without a key."""
+        if self.state_list is None:
+            return None
+        return self.state_list.profile
 
     def load_globals(self):
         """Load all environment variables into globals."""
+        if self.lazy and self.load_lazy_globals():
+            return
+
         for key, value in self.state:
             setattr(self.parent, key, value)
 
+    def load_lazy_globals(self):
+        """Resolve the variables from the settings module when they are read."""
+        if type(self.parent) is ModuleType:
+            self.parent.__class__ = LazySettingsModule
+        elif not isinstance(self.parent, LazySettingsModule):
+            return False
+
+        setattr(self.parent, LazySettingsModule.LOCK_ATTRIBUTE,
+                self.reload_lock)
+        setattr(self.parent, LazySettingsModule.STATE_ATTRIBUTE, self.state)
+        setattr(self.parent, self.state.SECRET_KEY, self.state.django_secret)
+
+        # variables already defined on the settings are overwritten right away
+        for key in self.state.data:
+            if key in self.parent.__dict__:
+                setattr(self.parent, key, self.state.data[key])
+
+        return True
+
+    def watch(self, interval):
+        """Reload the state on a thread whenever its file changes."""
+        from .watcher import StateWatcher
+
+        if self.watcher is not None:
+            self.watcher.stop()
+        self.watcher = StateWatcher(
+            self.state.filename, self.reload, interval=interval)
+        self.watcher.start()
+
+    def read_state(self):
+        """Read the file of the state again."""
+        from .artifact import CompiledState, CompiledStateList
+        from .state import State
+
+        if isinstance(self.state, CompiledState):
+            return CompiledStateList(
+                self.state.filename, key=self.key).get()
+
+        state = State(
+            self.state.filename,
+            key=self.state.key,
+            read_from_env=False,
+            lazy=self.lazy,
+            encrypter=self.state.encrypter)
+        state.check_decrypted()
+        return state
+
+    def reload(self):
+        """Read the state again and update the variables that changed.
+
+        The file is read, and the variables that changed are decrypted, before
+        anything is changed, so the settings keep their values if it can't be
+        read. Returns the names of
+        the variables changed or removed.
+        """
+        from .watcher import diff_states
+
+        with self.reload_lock:
+            state = self.read_state()
+            changed, removed = diff_states(self.state, state)
+            self.update_globals(state, changed, removed)
+            self.state = state
+        return set(changed) | removed
+
+    def update_globals(self, state, changed, removed):
+        """Set the variables that changed on the settings module."""
+        lazy = isinstance(self.parent, LazySettingsModule)
+        if lazy:
+            setattr(self.parent, LazySettingsModule.STATE_ATTRIBUTE, state)
+
+        settings = self.django_settings()
+        for key in removed:
+            self.parent.__dict__.pop(key, None)
+            if settings is not None and hasattr(settings, key):
+                delattr(settings, key)
+        for key, value in changed.items():
+            # the lazy variables that weren't read yet are read from the state
+            if not lazy or key in self.parent.__dict__:
+                setattr(self.parent, key, value)
+            # and only the ones Django copied are on its settings
+            if settings is not None and (not lazy or hasattr(settings, key)):
+                setattr(settings, key, value)
+
+    def django_settings(self):
+        """Return the Django settings, if they were read from this module."""
+        from django.conf import settings
+
+        if not settings.configured or getattr(
+                settings, 'SETTINGS_MODULE', None) != self.parent.__name__:
+            return None
+        return settings
+
+    def get(self, name, default=None):
+        """Return the value of a variable, parsed once with its type."""
+        if self.state is None or name not in self.state:
+            return default
+        if name == self.state.SECRET_KEY:
+            return self.state.django_secret
+        return self.state.data[name]
+
+    def after_fork_in_child(self):
+        """Create a new reload lock, as the copy may be held."""
+        self.reload_lock = threading.Lock()
+        if isinstance(self.parent, LazySettingsModule) and \
+                LazySettingsModule.LOCK_ATTRIBUTE in self.parent.__dict__:
+            setattr(self.parent, LazySettingsModule.LOCK_ATTRIBUTE,
+                    self.reload_lock)
+
     @property
     def LEVEL(self):
         return self.current_level
 
     def __str__(self):
         return "Deployment: {}".format(self.current_level)
+
+
+def after_fork_in_child():
+    """Create new locks on a forked process.
+
+    This is registered before the watchers are imported, so the locks are
+    new when the watchers start again.
+    """
+    for deploy_level in list(DEPLOY_LEVELS):
+        deploy_level.after_fork_in_child()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=after_fork_in_child)
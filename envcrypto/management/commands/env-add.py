@@ -1,8 +1,9 @@
 """Creates a new environment stage."""
 from django.core.management.base import BaseCommand
 
-from ...exceptions import VariableExists
+from ...exceptions import InvalidVariableValue, VariableExists
 from ...state import StateList
+from ...variable_types import TYPES
 
 
 class Command(BaseCommand):
@@ -14,6 +15,18 @@ class Command(BaseCommand):
         parser.add_argument('-k', '--key', type=str)
         parser.add_argument(
             '-f', '--force', action='store_true', default=False)
+        parser.add_argument(
+            '-b',
+            '--blob',
+            action='store_true',
+            default=False,
+            help="The value is a file, stored encrypted next to the .env file")
+        parser.add_argument(
+            '-t',
+            '--type',
+            dest='variable_type',
+            choices=sorted(TYPES),
+            help="The value is parsed as this type when it is loaded")
 
     def handle(self,
                *args,
@@ -21,13 +34,22 @@ class Command(BaseCommand):
                value=None,
                key=None,
                force=False,
+               blob=False,
+               variable_type=None,
                **options):
         """Create a new environment file with the name and a new KEY."""
         state = StateList(key=key, raise_error_on_key=True).get()
         print("Adding to variable to environment", state.name)
         try:
-            state.add(name, value, force=force)
-            state.save()
+            with state.locked():
+                if blob:
+                    state.add_blob(name, value, force=force)
+                else:
+                    state.add(
+                        name, value, force=force, variable_type=variable_type)
+                state.save()
+        except InvalidVariableValue as e:
+            print(e)
         except VariableExists:
             print(
                 "{} variable is already defined.\nIn order to force overwriting the value use the -f parameter.".
@@ -0,0 +1,26 @@
+"""Compile the active environment into a single encrypted file."""
+from django.core.management.base import BaseCommand
+
+from ...artifact import DEFAULT_FILENAME, compile_state
+from ...state import StateList
+
+
+class Command(BaseCommand):
+    help = 'Compile the active environment into a file that loads faster'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-k', '--key', type=str)
+        parser.add_argument(
+            '-o', '--output', type=str, default=DEFAULT_FILENAME)
+
+    def handle(self, *args, key=None, output=DEFAULT_FILENAME, **options):
+        """Write the variables of the active environment to the output."""
+        state_list = StateList(key=key, raise_error_on_key=True)
+        state_list.check_variables()
+
+        state = state_list.get()
+        compile_state(state, output)
+        print("Compiled environment", state.name, "to", output)
+        print()
+        print("You can load it on startup using:")
+        print("export ENVCRYPTO_ARTIFACT='{}'".format(output))
@@ -9,11 +9,21 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('environment_name', type=str)
+        parser.add_argument(
+            '-a',
+            '--algorithm',
+            type=str,
+            choices=State.ALGORITHMS,
+            default=State.FERNET)
 
-    def handle(self, *args, environment_name=None, **options):
+    def handle(self,
+               *args,
+               environment_name=None,
+               algorithm=State.FERNET,
+               **options):
         """Create a new environment file with the name and a new KEY."""
         print("Creating a new environment file", environment_name)
-        state = State.new(environment_name)
+        state = State.new(environment_name, crypto_algorithm=algorithm)
 
         print()
         print(
@@ -15,5 +15,6 @@ class Command(BaseCommand):
         """Create a new environment file with the name and a new KEY."""
         state = StateList(key=key, raise_error_on_key=True).get()
         print("Deleting variable from environment", state.name)
-        state.remove(name)
-        state.save()
+        with state.locked():
+            state.remove(name)
+            state.save()
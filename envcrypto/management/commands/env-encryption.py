@@ -2,7 +2,7 @@
 from django.core.management.base import BaseCommand
 
 from ...crypto import Encrypter
-from ...exceptions import VariableExists
+from ...exceptions import InvalidKey
 from ...state import read_env
 
 
@@ -16,6 +16,13 @@ class Command(BaseCommand):
             '-e', '--encrypt', action='store_true', default=False)
         parser.add_argument(
             '-d', '--decrypt', action='store_true', default=False)
+        parser.add_argument(
+            '-a',
+            '--algorithm',
+            type=str,
+            choices=sorted(Encrypter.CIPHERS),
+            default=Encrypter.FERNET,
+            help="The cipher of the tokens, the one of the .env file")
 
     def handle(self,
                *args,
@@ -23,19 +30,31 @@ class Command(BaseCommand):
                key=None,
                encrypt=False,
                decrypt=False,
+               algorithm=Encrypter.FERNET,
                **options):
         """Encrypt or Decrypts a value from the command line using the supplied key."""
         if key is None:
             key = read_env("KEY")
-        encrypter = Encrypter(key=key)
+        encrypter = Encrypter(key=key, algorithm=algorithm)
 
         if encrypt:
-            # encrypt the digest
+            # encrypt the token, as it is stored on the .env files
             print("Encrypting message:", value)
-            print("Digest")
-            print(encrypter.encrypt(value))
+            print("Token")
+            print(encrypter.encrypt_token(value))
 
         if decrypt:
-            print("Decrypting digest:", value)
+            print("Decrypting token:", value)
             print("Message")
-            print(encrypter.decrypt(value))
+            print(self.decrypt(encrypter, value))
+
+    def decrypt(self, encrypter, value):
+        """Decrypt a token, or a digest of the files before 0.9.0."""
+        try:
+            return encrypter.decrypt_token(value)
+        except:
+            pass
+        try:
+            return encrypter.decrypt(value)
+        except:
+            raise InvalidKey("The value can't be decrypted with the key")
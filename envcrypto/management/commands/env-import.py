@@ -0,0 +1,50 @@
+"""Import many variables into an environment at once."""
+import sys
+
+from django.core.management.base import BaseCommand
+
+from ...exceptions import VariableExists
+from ...importers import FORMATS, read_variables
+from ...state import StateList
+
+
+class Command(BaseCommand):
+    help = 'Import the variables of a dotenv or JSON file using a key'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'filename', type=str, help="The file to import, or - for stdin")
+        parser.add_argument('-k', '--key', type=str)
+        parser.add_argument('--format', type=str, choices=FORMATS)
+        parser.add_argument(
+            '-f', '--force', action='store_true', default=False)
+
+    def handle(self,
+               *args,
+               filename=None,
+               key=None,
+               format=None,
+               force=False,
+               **options):
+        """Add all the variables of the file and save the environment once."""
+        if filename == '-':
+            text = sys.stdin.read()
+        else:
+            with open(filename) as import_file:
+                text = import_file.read()
+        variables = read_variables(text, file_format=format, filename=filename)
+
+        state = StateList(key=key, raise_error_on_key=True).get()
+        print("Importing {} variables to environment".format(len(variables)),
+              state.name)
+
+        with state.locked():
+            for name, value in variables.items():
+                try:
+                    state.add(name, value, force=force)
+                except VariableExists:
+                    print(
+                        "{} variable is already defined.\nIn order to force overwriting the value use the -f parameter.".
+                        format(name))
+
+            state.save()
@@ -0,0 +1,41 @@
+"""Show where the time is spent while loading the environment."""
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ...state import StateList
+
+
+class Command(BaseCommand):
+    help = 'Print the time spent on each phase of loading the environment'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-k', '--key', type=str)
+        parser.add_argument(
+            '--json', dest='as_json', action='store_true', default=False)
+
+    def handle(self, *args, key=None, as_json=False, **options):
+        """Print the profile of the startup and of a load without cache."""
+        profiles = []
+
+        # the profile of the DeployLevel created by the settings module
+        deploy = getattr(settings, 'DEPLOY', None)
+        if getattr(deploy, 'state', None) is not None:
+            profiles.append(('startup', deploy.profile))
+
+        state_list = StateList(key=key, raise_error_on_key=True, cache=False)
+        state_list.check_variables()
+        profiles.append(('cold', state_list.profile))
+
+        if as_json:
+            print(
+                json.dumps({name: p.as_dict()
+                            for name, p in profiles}))
+            return
+
+        print("Active environment:", state_list.get().name)
+        for name, profile in profiles:
+            print()
+            print("{} profile".format(name.capitalize()))
+            print(profile.report())
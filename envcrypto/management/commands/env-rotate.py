@@ -2,7 +2,6 @@
 from django.core.management.base import BaseCommand
 
 from ...crypto import Encrypter
-from ...exceptions import VariableExists
 from ...state import StateList
 
 
@@ -11,18 +10,30 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('-k', '--key', type=str)
+        parser.add_argument(
+            '-n',
+            '--new-key',
+            type=str,
+            help="Use this key instead of creating a new one")
+        parser.add_argument(
+            '--keep-secret',
+            action='store_true',
+            default=False,
+            help="Keep the Django SECRET_KEY")
 
     def handle(self,
                *args,
                key=None,
-               transcode_key=None,
-               force=False,
+               new_key=None,
+               keep_secret=False,
                **options):
         """Create a new environment file with the name and a new KEY."""
         state = StateList(key=key, raise_error_on_key=True).get()
 
         # create new key
-        new_key = Encrypter.generate_key()
-        print("New KEY", new_key)
-        state.set_key(new_key)
-        state.save()
+        if new_key is None:
+            new_key = Encrypter.generate_key()
+            print("New KEY", new_key)
+        with state.locked():
+            state.set_key(new_key, regenerate_secret=not keep_secret)
+            state.save()
@@ -1,6 +1,8 @@
 """Creates a new environment stage."""
 from django.core.management.base import BaseCommand
 
+from ...blobs import Blob
+from ...exceptions import VariableNotFound
 from ...state import StateList
 
 
@@ -13,10 +15,22 @@ class Command(BaseCommand):
 
     def handle(self, *args, name=None, key=None, **options):
         """Create a new environment file with the name and a new KEY."""
-        state = StateList(key=key, raise_error_on_key=True).get()
-
         # we are going to either show a variable or all of the variables from
         # the environment
+        if name is not None:
+            try:
+                state_name, value = StateList.find_variable(name, key=key)
+            except VariableNotFound:
+                print("{} variable is not defined.".format(name))
+                return
+
+            print("Active environment:", state_name)
+            print(name.upper(),
+                  repr(value) if isinstance(value, Blob) else value)
+            return
+
+        state = StateList(key=key, raise_error_on_key=True).get()
         print("Active environment:", state.name)
         for key, value in state:
-            print(key, value)
+            # blobs are described instead of read
+            print(key, repr(value) if isinstance(value, Blob) else value)
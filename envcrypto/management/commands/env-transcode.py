@@ -25,12 +25,17 @@ class Command(BaseCommand):
         new_state = StateList(key=transcode_key, raise_error_on_key=True).get()
 
         # we iterate the list of states on the current one to the new
-        for key_var, value in old_state.get():
-            try:
-                new_state.add(key_var, value, force=force)
-            except VariableExists:
-                print(
-                    "{} variable is already defined.\nIn order to force overwriting the value use the -f parameter.".
-                    format(key_var))
+        with new_state.locked():
+            for key_var, value in old_state.get():
+                try:
+                    new_state.add(
+                        key_var,
+                        value,
+                        force=force,
+                        variable_type=old_state.types.get(key_var))
+                except VariableExists:
+                    print(
+                        "{} variable is already defined.\nIn order to force overwriting the value use the -f parameter.".
+                        format(key_var))
 
-        new_state.save()
+            new_state.save()
@@ -0,0 +1,20 @@
+"""Updates an environment file to the current format."""
+from django.core.management.base import BaseCommand
+
+from ...state import StateList
+
+
+class Command(BaseCommand):
+    help = 'Update the environment file of a key to the current format'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-k', '--key', type=str)
+
+    def handle(self, *args, key=None, **options):
+        """Save the environment again if it has an older format."""
+        state = StateList(key=key, raise_error_on_key=True).get()
+        with state.locked():
+            if state.update():
+                print("Updated environment", state.name)
+            else:
+                print("Environment", state.name, "is already up to date")
@@ -0,0 +1,85 @@
+"""Measure where the time is spent while loading the states."""
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+GLOB = 'glob'
+READ = 'read'
+PARSE = 'parse'
+VERIFY = 'verify'
+DECRYPT = 'decrypt'
+CHECK_VARIABLES = 'check_variables'
+LOAD_GLOBALS = 'load_globals'
+PHASES = [GLOB, READ, PARSE, VERIFY, DECRYPT, CHECK_VARIABLES, LOAD_GLOBALS]
+
+FILES_SCANNED = 'files_scanned'
+BYTES_READ = 'bytes_read'
+DECRYPT_CALLS = 'decrypt_calls'
+COUNTERS = [FILES_SCANNED, BYTES_READ, DECRYPT_CALLS]
+
+_hook = None
+
+
+def set_profile_hook(hook):
+    """Set a function called with (phase, seconds, profile) after each phase.
+
+    The hook is used by every profile that doesn't have its own hook, pass None
+    to remove it.
+    """
+    global _hook
+    _hook = hook
+
+
+class LoadProfile(object):
+    """The time spent on each phase of loading the states, and counters."""
+
+    def __init__(self, hook=None):
+        """Create an empty profile."""
+        self.hook = hook
+        self.timings = OrderedDict((phase, 0.0) for phase in PHASES)
+        self.counters = OrderedDict((counter, 0) for counter in COUNTERS)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """Measure the time spent on a phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+            hook = self.hook if self.hook is not None else _hook
+            if hook is not None:
+                hook(name, elapsed, self)
+
+    def count(self, name, value=1):
+        """Increment a counter."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @property
+    def total(self):
+        """Return the time spent on all the phases."""
+        return sum(self.timings.values())
+
+    def as_dict(self):
+        """Return the timings and the counters as a dictionary."""
+        return {
+            'timings': dict(self.timings),
+            'counters': dict(self.counters),
+            'total': self.total,
+        }
+
+    def report(self):
+        """Return a readable report of the profile."""
+        lines = []
+        for phase, seconds in self.timings.items():
+            lines.append('{:20} {:10.3f} ms'.format(phase, seconds * 1000))
+        lines.append('{:20} {:10.3f} ms'.format('total', self.total * 1000))
+        for counter, value in self.counters.items():
+            lines.append('{:20} {:10}'.format(counter, value))
+        return '\n'.join(lines)
@@ -0,0 +1,128 @@
+"""Share the decrypted states with the processes forked after loading them.
+
+A master process, for instance gunicorn with --preload, calls preload()
+before forking the workers. The DeployLevel of the workers then reuses the
+preloaded StateList, which they inherit copy-on-write, instead of reading
+and decrypting the files again. The files are only read again when they
+changed since they were preloaded.
+"""
+import glob
+import os
+import threading
+
+from . import files
+from .cache import StateCache
+from .crypto import Encrypter
+from .state import State, StateList
+
+REGISTRY = {}
+REGISTRY_LOCK = threading.RLock()
+
+
+class Entry(object):
+    """A preloaded StateList and the files it was read from."""
+
+    __slots__ = ('state_list', 'signature', 'kwargs')
+
+    def __init__(self, state_list, signature, kwargs):
+        """Keep the StateList."""
+        self.state_list = state_list
+        self.signature = signature
+        self.kwargs = kwargs
+
+
+def files_signature(load_filter='*'):
+    """Return the path, modification time and size of each file.
+
+    The files are only listed and stat'ed, which is much faster than reading
+    them.
+    """
+    signature = []
+    for env_file in sorted(
+            glob.glob('{}.{}'.format(load_filter, State.FILE_EXTENSION))):
+        try:
+            stat = os.stat(env_file)
+        except OSError:
+            continue
+        signature.append((env_file, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def registry_key(key=None, load_filter='*'):
+    """Return the registry key of a StateList, or None without a key."""
+    if key is None:
+        key = os.environ.get(State.KEY)
+        if key is None:
+            return None
+    try:
+        fingerprints = tuple(Encrypter(key=key).fingerprints)
+    except:
+        return None
+    return (os.getcwd(), load_filter, fingerprints)
+
+
+def preload(key=None, load_filter='*', **kwargs):
+    """Read the states and keep them for this process and its children."""
+    with REGISTRY_LOCK:
+        signature = files_signature(load_filter)
+        state_list = StateList(
+            key=key, load_filter=load_filter, raise_error_on_key=True,
+            **kwargs)
+        REGISTRY[registry_key(key, load_filter)] = Entry(
+            state_list, signature, kwargs)
+        return state_list
+
+
+def get(key=None, load_filter='*'):
+    """Return a preloaded StateList, or None if nothing was preloaded.
+
+    The states are read again if the files changed since they were loaded.
+    """
+    if not REGISTRY:
+        return None
+
+    with REGISTRY_LOCK:
+        entry = REGISTRY.get(registry_key(key, load_filter))
+        if entry is None:
+            return None
+        if entry.signature != files_signature(load_filter):
+            return preload(key=key, load_filter=load_filter, **entry.kwargs)
+        return entry.state_list
+
+
+def clear():
+    """Remove all the preloaded states."""
+    with REGISTRY_LOCK:
+        REGISTRY.clear()
+
+
+def before_fork():
+    """Hold the registry lock, so it isn't copied while being changed."""
+    REGISTRY_LOCK.acquire()
+
+
+def after_fork_in_parent():
+    """Release the registry lock."""
+    REGISTRY_LOCK.release()
+
+
+def after_fork_in_child():
+    """Create new locks in the child, as the copies may be held.
+
+    The file locks are also forgotten, since their flock is shared with the
+    parent through the inherited file descriptors.
+    """
+    global REGISTRY_LOCK
+    REGISTRY_LOCK = threading.RLock()
+    files.LOCKS_LOCK = threading.Lock()
+    files.LOCKS = {}
+    StateCache.default().lock = threading.Lock()
+    for entry in REGISTRY.values():
+        entry.state_list.profile.lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(
+        before=before_fork,
+        after_in_parent=after_fork_in_parent,
+        after_in_child=after_fork_in_child)
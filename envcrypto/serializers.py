@@ -0,0 +1,38 @@
+"""Serialize the env files, using orjson when it is installed."""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(content):
+    """Parse a JSON document from bytes or a string."""
+    if orjson is not None:
+        return orjson.loads(content)
+
+    if isinstance(content, bytes):
+        content = content.decode('utf-8')
+    return json.loads(content)
+
+
+def dumps(obj, compact=False):
+    """Return a JSON document as a string.
+
+    Both backends write the same output, so the files don't change when
+    orjson is installed. A compact document has no whitespace, which is
+    useful for documents that are encrypted.
+    """
+    if compact:
+        if orjson is not None:
+            return orjson.dumps(obj).decode('utf-8')
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+    if orjson is not None:
+        return orjson.dumps(
+            obj,
+            option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS
+            | orjson.OPT_APPEND_NEWLINE).decode('utf-8')
+
+    return json.dumps(obj, indent=2, sort_keys=True, ensure_ascii=False) + '\n'
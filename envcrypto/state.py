@@ -1,14 +1,25 @@
 """LevelConfig to describe levels."""
 import glob
-import json
 import logging
+import mmap
 import os
 import random
-
+import re
+import sys
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from . import serializers, variable_types
+from .blobs import Blob
+from .cache import StateCache
 from .crypto import Encrypter
 from .exceptions import (DeploymentLevelNotFound, EnvKeyNotFound,
                          FileWriteError, InvalidEnvFile, InvalidKey,
                          VariableExists, VariableMissing, VariableNotFound)
+from .files import atomic_write, file_lock
+from .profiling import (BYTES_READ, CHECK_VARIABLES, DECRYPT, FILES_SCANNED,
+                        GLOB, PARSE, READ, VERIFY, LoadProfile)
 
 
 def read_env(name):
@@ -21,9 +32,120 @@ def read_env(name):
     return result
 
 
+class Encrypted(object):
+    """A ciphertext that wasn't decrypted yet."""
+
+    __slots__ = ('token', )
+
+    def __init__(self, token):
+        """Keep the token."""
+        self.token = token
+
+
+class LazyData(MutableMapping):
+    """A dictionary of variables that are only decrypted when first read.
+
+    Each value is decrypted once, the first time it is read, and the plaintext
+    replaces the ciphertext. The tokens of the variables that were not changed
+    are kept, so they don't need to be encrypted again when saving.
+    """
+
+    def __init__(self, decrypt, tokens=None, decrypt_many=None, loads=None):
+        """Keep the tokens and the functions used to decrypt them.
+
+        decrypt_many, if given, decrypts a mapping of tokens in a single
+        batch when every variable is decrypted. loads, if given, is called
+        with the name and the decrypted text to return the value.
+        """
+        self.decrypt = decrypt
+        self.decrypt_many = decrypt_many
+        self.loads = loads
+        self.tokens = {}
+        self.changed = False
+        self._data = {}
+        if tokens is not None:
+            for k in tokens:
+                self._data[k] = Encrypted(tokens[k])
+                self.tokens[k] = tokens[k]
+
+    def __getitem__(self, key):
+        """Return the variable, decrypting it if needed."""
+        value = self._data[key]
+        if isinstance(value, Encrypted):
+            try:
+                value = self.decrypt(value.token)
+            except:
+                raise InvalidKey
+            if self.loads is not None:
+                value = self.loads(key, value)
+            self._data[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        """Set a plaintext value."""
+        self._data[key] = value
+        self.tokens.pop(key, None)
+        self.changed = True
+
+    def __delitem__(self, key):
+        """Remove a variable."""
+        del self._data[key]
+        self.tokens.pop(key, None)
+        self.changed = True
+
+    def __iter__(self):
+        """Iterate the variable names without decrypting them."""
+        return iter(self._data)
+
+    def __len__(self):
+        """Return the number of variables."""
+        return len(self._data)
+
+    def __contains__(self, key):
+        """Check the variable name without decrypting it."""
+        return key in self._data
+
+    def is_decrypted(self, key):
+        """Check if a variable was already decrypted."""
+        return not isinstance(self._data[key], Encrypted)
+
+    def restore(self, values):
+        """Set already decrypted values, keeping their tokens."""
+        for k in values:
+            self._data[k] = values[k]
+
+    def decrypt_all(self, keys=None):
+        """Decrypt every variable, or the given ones, in a single batch."""
+        if keys is None:
+            keys = list(self._data)
+        if self.decrypt_many is None:
+            for k in keys:
+                self[k]
+            return
+
+        values = self.decrypt_many({
+            k: self._data[k].token
+            for k in keys if isinstance(self._data[k], Encrypted)
+        })
+        if self.loads is not None:
+            values = {k: self.loads(k, values[k]) for k in values}
+        self.restore(values)
+
+    def saved(self, tokens):
+        """Keep the tokens of the values that were just saved."""
+        self.tokens = dict(tokens)
+        self.changed = False
+
+
 class State(object):
     """A State object."""
 
+    __slots__ = ('filename', 'name', 'crypto_type', 'crypto_algorithm',
+                 'version', 'key_id', 'django_secret', 'data', 'types',
+                 'orphans', 'manifest', 'tokens', 'key', 'lazy', 'decrypted',
+                 'outdated', 'env_object', 'content', 'identity', 'cache',
+                 'profile', 'encrypter')
+
     FILE_EXTENSION = "env"
     DJANGO_SECRET_SIZE = 50
     CHAR_LIST = 'abcdefghijklmnopqrstuvwxyz0123456789!@#$%^&*(-_=+)'
@@ -36,14 +158,45 @@ class State(object):
     CRYPTO_TYPE = 'cryto_family'
     CRYPTO_ALGORITHM = 'crypto_algorithm'
 
+    KEY_ID = 'key_id'
+    PAYLOAD = 'payload'
+    # the types of the variables that are not plain strings
+    TYPES = 'types'
+    # the sorted names of the variables, to compare files without their keys
+    VARIABLES = 'variables'
+
+    FERNET = Encrypter.FERNET
+    FERNET_ENVELOPE = 'fernet-envelope'
+    AES_GCM = Encrypter.AES_GCM
+    AES_GCM_ENVELOPE = 'aes-gcm-envelope'
+    CHACHA20_POLY1305 = Encrypter.CHACHA20_POLY1305
+    CHACHA20_POLY1305_ENVELOPE = 'chacha20-poly1305-envelope'
+    ALGORITHMS = [
+        FERNET, FERNET_ENVELOPE, AES_GCM, AES_GCM_ENVELOPE, CHACHA20_POLY1305,
+        CHACHA20_POLY1305_ENVELOPE
+    ]
+    # these algorithms encrypt all the variables as a single payload
+    ENVELOPE_SUFFIX = '-envelope'
+
     VERSION = 'version'
 
-    CURRENT_VERSION = '0.8.6'
+    CURRENT_VERSION = '0.9.0'
+    # files since this version store the tokens without another base64
+    COMPACT_VERSION = '0.9.0'
 
     CONTROLED_VOCABULARY = [
-        NAME, SIGNED_NAME, SECRET_KEY, CRYPTO_ALGORITHM, CRYPTO_TYPE, VERSION
+        NAME, SIGNED_NAME, SECRET_KEY, CRYPTO_ALGORITHM, CRYPTO_TYPE, VERSION,
+        KEY_ID, PAYLOAD, VARIABLES, TYPES
     ]
     REQUIRED_VOCABULARY = [NAME, SIGNED_NAME, SECRET_KEY]
+    ENVELOPE_REQUIRED_VOCABULARY = [NAME, SIGNED_NAME, PAYLOAD]
+
+    # a field on the top level of the files written by save(), with its
+    # value if it is a string, or the start of an object, and the string
+    # entries of those objects
+    FIELD_PATTERN = re.compile(
+        rb'^  "([^"\\]*)": (?:"([^"\\]*)",?\r?$|(\{)\r?$|)'
+        rb'|^    "([^"\\]*)": "([^"\\]*)",?\r?$', re.MULTILINE)
 
     @classmethod
     def create_django_secret_key(cls):
@@ -53,23 +206,57 @@ class State(object):
                        for i in range(cls.DJANGO_SECRET_SIZE))
 
     @classmethod
-    def new(cls, name):
+    def is_envelope_algorithm(cls, crypto_algorithm):
+        """Check if the algorithm encrypts all variables as one payload."""
+        return (crypto_algorithm or '').endswith(cls.ENVELOPE_SUFFIX)
+
+    @classmethod
+    def cipher_algorithm(cls, crypto_algorithm):
+        """Return the name of the cipher used by an algorithm."""
+        if not crypto_algorithm:
+            return cls.FERNET
+        if cls.is_envelope_algorithm(crypto_algorithm):
+            return crypto_algorithm[:-len(cls.ENVELOPE_SUFFIX)]
+        return crypto_algorithm
+
+    @classmethod
+    def encrypt_payload(cls, encrypter, django_secret, data, types=None):
+        """Encrypt the secret key and all the variables as a single token."""
+        payload = dict(data)
+        payload[cls.SECRET_KEY] = django_secret
+        if types:
+            payload[cls.TYPES] = types
+        return encrypter.encrypt_token(
+            serializers.dumps(payload, compact=True))
+
+    @classmethod
+    def new(cls, name, crypto_algorithm=FERNET):
         """Read a State from a file."""
         key = Encrypter.generate_key()
-        encrypter = Encrypter(key)
+        encrypter = Encrypter(
+            key, algorithm=cls.cipher_algorithm(crypto_algorithm))
         result = {}
         result[cls.NAME] = name
         result[cls.CRYPTO_TYPE] = 'symmetric'
-        result[cls.CRYPTO_ALGORITHM] = 'fernet'
+        result[cls.CRYPTO_ALGORITHM] = crypto_algorithm
         result[cls.VERSION] = cls.CURRENT_VERSION
-        result[cls.SIGNED_NAME] = encrypter.encrypt(name)
+        result[cls.KEY_ID] = encrypter.fingerprint
+        result[cls.SIGNED_NAME] = encrypter.encrypt_token(name)
 
-        result['SECRET_KEY'] = encrypter.encrypt(
-            State.create_django_secret_key())
+        if cls.is_envelope_algorithm(crypto_algorithm):
+            result[cls.PAYLOAD] = cls.encrypt_payload(
+                encrypter, State.create_django_secret_key(), {})
+        else:
+            result[cls.VARIABLES] = []
+            result['SECRET_KEY'] = encrypter.encrypt_token(
+                State.create_django_secret_key())
 
         final_filename = '{}.{}'.format(name, cls.FILE_EXTENSION)
-        with open(final_filename, 'w') as env_file:
-            env_file.write(json.dumps(result, indent=4, sort_keys=True))
+        try:
+            with file_lock(final_filename):
+                atomic_write(final_filename, serializers.dumps(result))
+        except OSError:
+            raise FileWriteError
 
         # we read a new state object
         state = State(final_filename, key=key)
@@ -82,40 +269,286 @@ class State(object):
                  key=None,
                  read_from_env=True,
                  read_empty=False,
+                 lazy=False,
+                 encrypter=None,
+                 env_object=None,
+                 content=None,
+                 cache=True,
+                 profile=None,
+                 verified=False,
                  **kwargs):
-        """Set the variables."""
+        """Set the variables.
+
+        With lazy=True the variables are kept encrypted and each one is only
+        decrypted when it is first read. An already created encrypter and an
+        already read content and env_object can be passed to avoid doing it
+        again, with verified=True if the encrypter was already checked on the
+        signed name of that env_object.
+
+        Decrypted states are kept in the process-wide StateCache, pass another
+        cache or cache=False to change it.
+
+        The time spent loading the state is measured on a LoadProfile.
+        """
         self.filename = filename
         self.name = None
         self.crypto_type = None
         self.crypto_algorithm = None
         self.version = None
+        self.key_id = None
         self.django_secret = None
         self.data = {}
+        self.types = {}
+        # the blobs that are no longer used once the state is saved
+        self.orphans = []
+        self.manifest = None
+        # the tokens of the header, kept to save them again
+        self.tokens = {}
         self.key = key
+        self.lazy = lazy
         self.decrypted = False
+        # an older file format, only written again when the state is saved
+        self.outdated = False
+
+        self.env_object = env_object
+        self.content = content
+        self.identity = None
+
+        if cache is True:
+            cache = StateCache.default()
+        elif cache is False:
+            cache = None
+        self.cache = cache
+        self.profile = LoadProfile() if profile is None else profile
 
         if key is None and read_from_env:
             self.key = read_env(self.KEY)
 
-        self.create_encrypter()
+        if encrypter is None:
+            self.create_encrypter()
+            self.encrypter.profile = self.profile
+        else:
+            self.encrypter = encrypter
 
-        self.load(read_empty=read_empty)
+        self.load(read_empty=read_empty, verified=verified)
+
+    @classmethod
+    def read_content(cls, filename):
+        """Read the content of a file."""
+        try:
+            with open(filename, 'rb') as env_file:
+                return env_file.read()
+        except:
+            raise InvalidEnvFile
+
+    @classmethod
+    def parse_file(cls, filename, content=None):
+        """Read a file and check that it is valid."""
+        if content is None:
+            content = cls.read_content(filename)
 
-    def read_file(self):
-        """Read the file and check that it is valid."""
         # read the json file
         try:
-            env_object = json.loads(open(self.filename).read())
+            env_object = serializers.loads(content)
         except:
             raise InvalidEnvFile
 
         # Check that the required vocabulary is available
-        for vocabulary in self.REQUIRED_VOCABULARY:
+        required_vocabulary = cls.REQUIRED_VOCABULARY
+        if cls.is_envelope_algorithm(env_object.get(cls.CRYPTO_ALGORITHM)):
+            required_vocabulary = cls.ENVELOPE_REQUIRED_VOCABULARY
+        for vocabulary in required_vocabulary:
             if vocabulary not in env_object:
                 raise InvalidEnvFile
 
         return env_object
 
+    @classmethod
+    def parse_version(cls, version):
+        """Return a version as a tuple that can be compared."""
+        try:
+            return tuple(int(part) for part in version.split('.'))
+        except:
+            return ()
+
+    @classmethod
+    def is_compact(cls, env_object):
+        """Check if the file stores the tokens directly."""
+        return cls.parse_version(env_object.get(
+            cls.VERSION, '')) >= cls.parse_version(cls.COMPACT_VERSION)
+
+    @classmethod
+    def read_token(cls, env_object, key):
+        """Read a token from the file, whatever its version."""
+        if cls.is_compact(env_object):
+            return env_object[key]
+        return Encrypter.unwrap(env_object[key])
+
+    @classmethod
+    def verify(cls, encrypter, env_object):
+        """Check if the encrypter can decrypt the signed name."""
+        try:
+            encrypter = encrypter.for_algorithm(
+                cls.cipher_algorithm(env_object.get(cls.CRYPTO_ALGORITHM)))
+            encrypter.decrypt_token(cls.read_token(env_object, cls.SIGNED_NAME))
+        except:
+            return False
+        return True
+
+    @classmethod
+    def read_manifest(cls, env_object):
+        """Return the set of variable names of a file, without decrypting it.
+
+        Older files without a manifest have the names as their fields. The
+        names of an envelope can't be read without its key, so None is
+        returned.
+        """
+        if cls.VARIABLES in env_object:
+            return set(env_object[cls.VARIABLES])
+        if cls.is_envelope_algorithm(env_object.get(cls.CRYPTO_ALGORITHM)):
+            return None
+        return {k for k in env_object if k not in cls.CONTROLED_VOCABULARY}
+
+    @classmethod
+    def read_fields(cls, filename, fields):
+        """Read top level string fields of a file without parsing it.
+
+        The file is memory mapped and searched once for all the fields, which
+        only works for the files written by save(). A field can also be an
+        (object, name) tuple, for an entry of an object field. Fields that
+        can't be found are left out of the result.
+        """
+        fields = set(fields)
+        result = {}
+        try:
+            with open(filename, 'rb') as env_file, mmap.mmap(
+                    env_file.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                current = None
+                for match in cls.FIELD_PATTERN.finditer(content):
+                    field, value, start, entry, entry_value = match.groups()
+                    if field is not None:
+                        field = field.decode('utf-8')
+                        current = field if start is not None else None
+                        if value is not None and field in fields:
+                            result[field] = value.decode('utf-8')
+                    elif current is not None:
+                        entry = (current, entry.decode('utf-8'))
+                        if entry in fields:
+                            result[entry] = entry_value.decode('utf-8')
+                    if len(result) == len(fields):
+                        break
+        except (OSError, ValueError):
+            raise InvalidEnvFile
+
+        return result
+
+    @classmethod
+    def read_type(cls, filename, name):
+        """Read the type of a variable of a file written by save(), or None."""
+        return cls.read_fields(filename, [(cls.TYPES, name)]).get(
+            (cls.TYPES, name))
+
+    @classmethod
+    def variable_fields(cls, name):
+        """Return the fields read to decrypt a single variable."""
+        return [
+            cls.NAME, cls.VERSION, cls.CRYPTO_ALGORITHM, cls.SIGNED_NAME,
+            cls.KEY_ID, name, (cls.TYPES, name)
+        ]
+
+    @classmethod
+    def read_variable(cls, filename, name, encrypter, fields=None):
+        """Decrypt a single variable, without decrypting the whole state.
+
+        The fields are read with a single search of the file, unless they
+        were already read with variable_fields. Only the signed name, to
+        verify the key, and the variable itself are decrypted. Files that
+        can't be searched, and typed variables, are fully read instead.
+        """
+        name = name.upper()
+        if fields is None:
+            fields = cls.read_fields(filename, cls.variable_fields(name))
+
+        indexed = (cls.SIGNED_NAME in fields and cls.VERSION in fields
+                   and not cls.is_envelope_algorithm(
+                       fields.get(cls.CRYPTO_ALGORITHM))
+                   and (cls.TYPES, name) not in fields)
+        if not indexed:
+            state = State(
+                filename,
+                encrypter=encrypter,
+                read_from_env=False,
+                lazy=True)
+            if name not in state:
+                raise VariableNotFound
+            if name == cls.SECRET_KEY:
+                return state.django_secret
+            return state.data[name]
+
+        if not cls.verify(encrypter, fields):
+            raise InvalidKey
+        if name not in fields:
+            raise VariableNotFound
+
+        encrypter = encrypter.for_algorithm(
+            cls.cipher_algorithm(fields.get(cls.CRYPTO_ALGORITHM)))
+        try:
+            return encrypter.decrypt_token(cls.read_token(fields, name))
+        except:
+            raise InvalidKey
+
+    def read_file(self):
+        """Read the file and check that it is valid."""
+        content, self.content = self.content, None
+        env_object, self.env_object = self.env_object, None
+
+        # the content is only needed to parse it or to find it on the cache
+        if content is None and (env_object is None or self.cache is not None):
+            with self.profile.phase(READ):
+                content = self.read_content(self.filename)
+            self.profile.count(FILES_SCANNED)
+            self.profile.count(BYTES_READ, len(content))
+        if env_object is None:
+            with self.profile.phase(PARSE):
+                env_object = self.parse_file(self.filename, content=content)
+
+        if self.cache is not None:
+            self.identity = self.cache.identity(self.filename, content,
+                                                self.encrypter.fingerprint)
+
+        return env_object
+
+    def snapshot(self):
+        """Return the decrypted state as a dictionary."""
+        return {
+            self.NAME: self.name,
+            self.CRYPTO_TYPE: self.crypto_type,
+            self.CRYPTO_ALGORITHM: self.crypto_algorithm,
+            self.VERSION: self.version,
+            self.KEY_ID: self.key_id,
+            self.SECRET_KEY: self.django_secret,
+            self.TYPES: dict(self.types),
+            'outdated': self.outdated,
+            'data': self.dump_values(self.data),
+            'tokens': dict(self.tokens),
+            'data_tokens': dict(self.data.tokens),
+        }
+
+    def restore(self, snapshot):
+        """Set the decrypted state from a snapshot."""
+        self.name = snapshot[self.NAME]
+        self.crypto_type = snapshot[self.CRYPTO_TYPE]
+        self.crypto_algorithm = snapshot[self.CRYPTO_ALGORITHM]
+        self.version = snapshot[self.VERSION]
+        self.key_id = snapshot[self.KEY_ID]
+        self.django_secret = snapshot[self.SECRET_KEY]
+        self.types = dict(snapshot.get(self.TYPES, {}))
+        self.outdated = snapshot.get('outdated', False)
+        self.tokens = dict(snapshot.get('tokens', {}))
+        self.data = LazyData(self.encrypter.decrypt_token, loads=self.load_value)
+        self.data.restore(self.load_values(snapshot['data']))
+        self.data.saved(snapshot.get('data_tokens', {}))
+
     def process_file_update(self, env_object):
         """Process any required update to the file format."""
         # read the self properties
@@ -128,7 +561,7 @@ class State(object):
         try:
             self.crypto_algorithm = env_object[self.CRYPTO_ALGORITHM]
         except:
-            self.crypto_algorithm = 'fernet'
+            self.crypto_algorithm = self.FERNET
             do_version_update = True
 
         try:
@@ -137,20 +570,56 @@ class State(object):
             self.version = self.CURRENT_VERSION
             do_version_update = True
 
+        if self.parse_version(self.version) < self.parse_version(
+                self.CURRENT_VERSION):
+            self.version = self.CURRENT_VERSION
+            do_version_update = True
+
+        # files without the key fingerprint can only be found by trying the key
+        if self.key_id not in self.encrypter.fingerprints:
+            self.key_id = self.encrypter.find_fingerprint(
+                self.tokens[self.SIGNED_NAME])
+            do_version_update = True
+
         return do_version_update
 
+    def load_and_decrypt_payload(self, env_object):
+        """We decrypt all the data from a single payload."""
+        self.tokens[self.PAYLOAD] = env_object[self.PAYLOAD]
+        try:
+            payload = serializers.loads(
+                self.encrypter.decrypt_token(self.tokens[self.PAYLOAD]))
+        except:
+            raise InvalidKey
+
+        self.django_secret = payload.pop(self.SECRET_KEY)
+        self.types = payload.pop(self.TYPES, {})
+        self.data = LazyData(self.encrypter.decrypt_token, loads=self.load_value)
+        self.data.restore(self.load_values(payload))
+
     def load_and_decrypt_data(self, env_object):
         """We decrypt the data."""
-        self.django_secret = self.encrypter.decrypt(
-            env_object[self.SECRET_KEY])
+        if self.is_envelope_algorithm(env_object.get(self.CRYPTO_ALGORITHM)):
+            self.load_and_decrypt_payload(env_object)
+            return
+
+        self.tokens[self.SECRET_KEY] = self.read_token(
+            env_object, self.SECRET_KEY)
+        self.django_secret = self.encrypter.decrypt_token(
+            self.tokens[self.SECRET_KEY])
+
+        self.types = dict(env_object.get(self.TYPES, {}))
+        self.data = LazyData(
+            self.encrypter.decrypt_token, {
+                k: self.read_token(env_object, k)
+                for k in env_object if k not in self.CONTROLED_VOCABULARY
+            },
+            decrypt_many=self.encrypter.decrypt_many,
+            loads=self.load_value)
 
         # read the remaing variables
-        for k in env_object:
-            if k not in self.CONTROLED_VOCABULARY:
-                try:
-                    self.data[k] = self.encrypter.decrypt(env_object[k])
-                except:
-                    raise InvalidKey
+        if not self.lazy:
+            self.data.decrypt_all()
 
     def load_data(self, env_object):
         """We only load the data."""
@@ -158,30 +627,110 @@ class State(object):
             if k not in self.CONTROLED_VOCABULARY:
                 self.data[k] = None
 
-    def load(self, read_empty=False):
-        """Load a file and process it."""
+    def load(self, read_empty=False, verified=False):
+        """Load a file and process it.
+
+        With verified=True the signed name is not decrypted again.
+        """
         env_object = self.read_file()
         self.name = env_object[self.NAME]
+        self.key_id = env_object.get(self.KEY_ID)
+        self.crypto_algorithm = env_object.get(self.CRYPTO_ALGORITHM)
+        self.manifest = self.read_manifest(env_object)
 
         # can we decrypt the state?
         if read_empty:
             self.load_data(env_object)
             return
 
-        try:
-            self.encrypter.decrypt(env_object[self.SIGNED_NAME])
-
-        except:
+        if not verified:
+            with self.profile.phase(VERIFY):
+                verified = self.verify(self.encrypter, env_object)
+        if not verified:
             # we do nothing if the can decrypt the state
             raise InvalidKey
 
+        self.encrypter = self.encrypter.for_algorithm(
+            self.cipher_algorithm(self.crypto_algorithm))
         self.decrypted = True
-        self.load_and_decrypt_data(env_object)
-        do_version_update = self.process_file_update(env_object)
+        self.tokens[self.SIGNED_NAME] = self.read_token(
+            env_object, self.SIGNED_NAME)
+
+        with self.profile.phase(DECRYPT):
+            snapshot = None
+            if self.identity is not None:
+                snapshot = self.cache.get(self.identity, self.encrypter)
+            if snapshot is not None:
+                self.restore(snapshot)
+            else:
+                self.load_and_decrypt_data(env_object)
+        if snapshot is not None:
+            return
 
-        # only decrypt the objects if we have the right key
-        if self.decrypted and do_version_update:
-            self.update()
+        # older files are only read, so they can be loaded from read-only
+        # file systems, and they are written in the current format on save
+        self.outdated = self.process_file_update(env_object)
+        if self.VARIABLES not in env_object and not self.is_envelope:
+            self.outdated = True
+
+        # a lazy state would have to decrypt everything to be cached
+        if self.identity is not None and not self.lazy:
+            self.cache.set(self.identity, self.snapshot(), self.encrypter)
+
+    def reload(self):
+        """Read the state from the file again.
+
+        The file is loaded into a new state, under the file lock, and its
+        fields then replace these ones, so a concurrent reader never sees a
+        half loaded state. The blob files of the changes that weren't saved
+        are removed, unless the file uses them.
+        """
+        with file_lock(self.filename):
+            state = State(
+                self.filename,
+                key=self.key,
+                read_from_env=False,
+                lazy=self.lazy,
+                encrypter=self.encrypter,
+                cache=self.cache,
+                profile=self.profile)
+            unsaved = self.unsaved_blobs()
+            for name in self.__slots__:
+                if name != 'data':
+                    setattr(self, name, getattr(state, name))
+            # the values are loaded with the types of this state
+            state.data.loads = self.load_value
+            self.data = state.data
+
+            if unsaved:
+                used = {
+                    self.data[k].filename
+                    for k, variable_type in self.types.items()
+                    if variable_type == Blob.TYPE and k in self.data
+                }
+                for blob in unsaved:
+                    if blob.filename not in used:
+                        blob.remove()
+
+    def unsaved_blobs(self):
+        """Return the blobs added or released since the state was saved."""
+        tokens = getattr(self.data, 'tokens', {})
+        return self.orphans + [
+            self.data[k] for k, variable_type in self.types.items()
+            if variable_type == Blob.TYPE and k in self.data
+            and k not in tokens
+        ]
+
+    @contextmanager
+    def locked(self):
+        """Lock the file while the state is changed and saved.
+
+        The state is read again once the lock is acquired, so changes saved by
+        other processes in the meantime are not lost.
+        """
+        with file_lock(self.filename):
+            self.reload()
+            yield self
 
     def check_decrypted(self):
         """Check that the state is decrypted and raise an exception otherwise."""
@@ -190,64 +739,236 @@ class State(object):
             raise InvalidKey
 
     def update(self):
-        """Update the file to the current version."""
+        """Update the file to the current version, if it is outdated."""
+        if not self.outdated:
+            return False
         logging.warning("Updating your environment file")
         self.save()
+        return True
+
+    def set_key(self, key, regenerate_secret=True):
+        """Set a new key for this state.
+
+        Every variable is encrypted again with the new key when the state is
+        saved. The Django SECRET_KEY is also replaced, unless regenerate_secret
+        is False.
+        """
+        # everything has to be encrypted again with the new key
+        self.data.decrypt_all()
+        self.data.saved({})
+        self.tokens = {}
 
-    def set_key(self, key):
-        """Set a new key for this state."""
         self.key = key
         self.create_encrypter()
-        self.django_secret = State.create_django_secret_key()
+        self.data.decrypt = self.encrypter.decrypt_token
+        self.data.decrypt_many = self.encrypter.decrypt_many
+        self.key_id = self.encrypter.fingerprint
+        if regenerate_secret:
+            self.django_secret = State.create_django_secret_key()
+
+    def rotate_tokens(self):
+        """Encrypt the saved tokens again with the first key.
+
+        The variables that changed are kept as changed, and the payload of an
+        envelope is left out, as save() encrypts it again from the variables.
+        """
+        self.tokens.pop(self.PAYLOAD, None)
+        self.tokens = self.encrypter.rotate_many(self.tokens)
+        self.data.tokens = self.encrypter.rotate_many(self.data.tokens)
+        self.key_id = self.encrypter.fingerprint
 
     def create_encrypter(self):
-        """Create the encrypter with the current key."""
+        """Create the encrypter with the current key.
+
+        An algorithm that is not known raises a ValueError.
+        """
+        algorithm = self.cipher_algorithm(self.crypto_algorithm)
+        if algorithm not in Encrypter.CIPHERS:
+            raise ValueError("Unknown algorithm {}".format(algorithm))
         try:
-            self.encrypter = Encrypter(key=self.key)
+            self.encrypter = Encrypter(key=self.key, algorithm=algorithm)
         except:
-            raise InvalidKey(
-                "The supplied key is not a valid key {}".format(key))
+            raise InvalidKey("The supplied key is not a valid key")
+
+    def encrypt_token(self, key, message):
+        """Return the saved token of a header, or encrypt the message."""
+        if key not in self.tokens:
+            self.tokens[key] = self.encrypter.encrypt_token(message)
+        return self.tokens[key]
 
     def save(self):
-        """Save the State to disk."""
+        """Save the State to disk.
+
+        Only the variables that changed since the state was read are
+        encrypted, the others keep their tokens. The tokens of a file that was
+        read with another of the keys are encrypted again with the first one.
+        """
         self.check_decrypted()
+        if self.key_id != self.encrypter.fingerprint:
+            self.rotate_tokens()
+
         result = {}
         result[self.NAME] = self.name
-        result[self.SIGNED_NAME] = self.encrypter.encrypt(self.name)
+        result[self.SIGNED_NAME] = self.encrypt_token(self.SIGNED_NAME,
+                                                      self.name)
         result[self.CRYPTO_TYPE] = self.crypto_type
         result[self.CRYPTO_ALGORITHM] = self.crypto_algorithm
         result[self.VERSION] = self.version
-
-        result[self.SECRET_KEY] = self.encrypter.encrypt(self.django_secret)
-
-        for k in self.data:
-            result[k] = self.encrypter.encrypt(self.data[k])
+        result[self.KEY_ID] = self.encrypter.fingerprint
+
+        tokens = {}
+        if self.is_envelope:
+            if self.data.changed or self.PAYLOAD not in self.tokens:
+                self.tokens[self.PAYLOAD] = self.encrypt_payload(
+                    self.encrypter, self.django_secret,
+                    self.dump_values(self.data), self.types)
+            result[self.PAYLOAD] = self.tokens[self.PAYLOAD]
+        else:
+            result[self.SECRET_KEY] = self.encrypt_token(
+                self.SECRET_KEY, self.django_secret)
+            result[self.VARIABLES] = sorted(self.data)
+            if self.types:
+                result[self.TYPES] = self.types
+
+            encrypted = self.encrypter.encrypt_many({
+                k: self.dump_value(k, self.data[k])
+                for k in self.data if k not in self.data.tokens
+            })
+            for k in self.data:
+                if k in encrypted:
+                    tokens[k] = encrypted[k]
+                else:
+                    tokens[k] = self.data.tokens[k]
+            result.update(tokens)
 
         try:
-            with open(self.filename, 'w') as f_file:
-                f_file.write(json.dumps(result, indent=4, sort_keys=True))
+            with file_lock(self.filename):
+                atomic_write(self.filename, serializers.dumps(result))
         except:
             raise FileWriteError
+        finally:
+            if self.cache is not None:
+                self.cache.invalidate(self.filename)
+
+        self.data.saved(tokens)
+        self.manifest = None if self.is_envelope else set(self.data)
+        self.outdated = False
+
+        for blob in self.orphans:
+            blob.remove()
+        self.orphans = []
+
+    def add(self, key, value, force=False, variable_type=None):
+        """Add a variable to the data.
+
+        With a variable_type, one of variable_types.TYPES, the value is
+        checked and kept parsed, and its type is saved on the file. Values
+        that aren't text get the type of their python type, and text keeps
+        the type the variable already has.
+
+        A Blob of another state is copied to a blob of this state.
+        """
+        if isinstance(value, Blob):
+            with value.open() as source:
+                return self.add_blob(key, source, force=force)
 
-    def add(self, key, value, force=False):
-        """Add a variable to the data."""
         # should we prevent rewriting?
         key = key.upper()
-        if force:
-            self.data[key] = value
-            return
-
-        if key in self.data:
+        if key in self.data and not force:
             raise VariableExists
 
+        if variable_type is None:
+            variable_type = variable_types.infer_type(value)
+        if variable_type is None and self.types.get(
+                key) in variable_types.TYPES:
+            variable_type = self.types[key]
+        if variable_type is not None:
+            value = variable_types.convert(variable_type, value)
+
+        self.release(key)
+        if variable_type is not None:
+            self.types[key] = variable_type
         self.data[key] = value
 
+    def add_blob(self, key, source, force=False):
+        """Add a large variable, encrypted on a sidecar file.
+
+        The source is a file name or a binary file object, which is encrypted
+        as a stream. The value of the variable is a Blob, which only reads the
+        file when it is accessed.
+        """
+        key = key.upper()
+        if key in self.data and not force:
+            raise VariableExists
+
+        blob = Blob.create(self.directory, self.name, source)
+        self.release(key)
+        self.types[key] = Blob.TYPE
+        self.data[key] = blob
+
+    def release(self, key):
+        """Forget the type of a variable, and its blob once saved."""
+        if self.types.pop(key, None) == Blob.TYPE and key in self.data:
+            self.orphans.append(self.data[key])
+
+    @property
+    def directory(self):
+        """Return the directory of the file."""
+        return os.path.dirname(self.filename)
+
+    @classmethod
+    def parse_value(cls, variable_type, text, directory):
+        """Return the value of a type from its text."""
+        if variable_type == Blob.TYPE:
+            return Blob.loads(directory, text)
+        return variable_types.loads(variable_type, text)
+
+    def load_value(self, key, text):
+        """Return the value of a variable from its decrypted text."""
+        return self.parse_value(self.types.get(key), text, self.directory)
+
+    def dump_value(self, key, value):
+        """Return the text to encrypt of a variable."""
+        if isinstance(value, Blob):
+            return value.dumps()
+        return variable_types.dumps(self.types.get(key), value)
+
+    def load_values(self, texts):
+        """Return the values of a dictionary of decrypted texts."""
+        return {k: self.load_value(k, texts[k]) for k in texts}
+
+    def dump_values(self, values):
+        """Return the texts to encrypt of a dictionary of values."""
+        return {k: self.dump_value(k, values[k]) for k in values}
+
+    @property
+    def is_envelope(self):
+        """Check if all variables are encrypted as a single payload."""
+        return self.is_envelope_algorithm(self.crypto_algorithm)
+
+    @property
+    def names_known(self):
+        """Check if the variable names can be read."""
+        return self.decrypted or not self.is_envelope
+
+    def variable_names(self):
+        """Return the set of variable names, or None if they can't be read."""
+        if self.decrypted:
+            return set(self.data)
+        return self.manifest
+
     def __iter__(self):
         """Return each of the data values."""
         yield (self.SECRET_KEY, self.django_secret)
         for k in self.data:
             yield (k, self.data[k])
 
+    def keys(self):
+        """Return each of the variable names, without decrypting them."""
+        yield self.SECRET_KEY
+        for k in self.data:
+            yield k
+
     def __contains__(self, key):
         """Check if the state contains a variable."""
         return key == self.SECRET_KEY or key in self.data
@@ -263,21 +984,89 @@ class State(object):
         if key not in self.data:
             raise VariableNotFound
 
+        self.release(key)
         del self.data[key]
 
 
+class StateSummary(object):
+    """A state that the key can't decrypt.
+
+    Only the names of the file, of the state and of its variables are kept,
+    without any data or encrypter, and the states with the same variables
+    share the same manifest.
+    """
+
+    __slots__ = ('filename', 'name', 'key_id', 'crypto_algorithm', 'manifest')
+
+    decrypted = False
+
+    def __init__(self, filename, env_object, manifests=None):
+        """Keep the names of a parsed file."""
+        self.filename = filename
+        self.name = sys.intern(env_object[State.NAME])
+        self.key_id = env_object.get(State.KEY_ID)
+        self.crypto_algorithm = env_object.get(State.CRYPTO_ALGORITHM)
+        self.manifest = self.intern_manifest(
+            State.read_manifest(env_object), manifests)
+
+    @classmethod
+    def intern_manifest(cls, names, manifests=None):
+        """Return a frozenset of the names, shared with the same manifests."""
+        if names is None:
+            return None
+        names = frozenset(sys.intern(name) for name in names)
+        if manifests is None:
+            return names
+        return manifests.setdefault(names, names)
+
+    @property
+    def is_envelope(self):
+        """Check if all variables are encrypted as a single payload."""
+        return State.is_envelope_algorithm(self.crypto_algorithm)
+
+    @property
+    def names_known(self):
+        """Check if the variable names can be read."""
+        return self.manifest is not None
+
+    def variable_names(self):
+        """Return the set of variable names, or None if they can't be read."""
+        return self.manifest
+
+    def __repr__(self):
+        """Describe the state."""
+        return '<StateSummary {}>'.format(self.name)
+
+
 class StateList(object):
-    """Read a list of states."""
+    """Read a list of states.
+
+    The states that the key can't decrypt are kept as a StateSummary, which
+    is only used to check the variables, and they can be released once the
+    variables are checked.
+    """
+
+    MAX_WORKERS = 8
 
     def __init__(self,
                  *args,
                  key=None,
                  raise_error_on_key=False,
                  load_filter='*',
+                 lazy=False,
+                 cache=True,
+                 profile_hook=None,
                  **kwargs):
-        """Read the list of states."""
+        """Read the list of states.
+
+        The time spent on each phase is measured on the profile attribute,
+        and profile_hook is called after each phase.
+        """
+        self.profile = LoadProfile(hook=profile_hook)
         self.key = key
         self.load_filter = load_filter
+        self.lazy = lazy
+        self.cache = cache
         self.list_of_states = []
         self.current_state_index = None
 
@@ -295,8 +1084,8 @@ class StateList(object):
         try:
             self.encrypter = Encrypter(key=self.key)
         except:
-            raise InvalidKey(
-                "The supplied key is not a valid key {}".format(key))
+            raise InvalidKey("The supplied key is not a valid key")
+        self.encrypter.profile = self.profile
 
         self.read_list()
 
@@ -311,47 +1100,180 @@ class StateList(object):
 
         return self.list_of_states[self.current_state_index]
 
-    def read_list(self):
-        """Read the list of files."""
-        env_files = glob.glob('{}.{}'.format(self.load_filter,
-                                             State.FILE_EXTENSION))
-        for i in range(len(env_files)):
+    @classmethod
+    def find_variable(cls, name, key=None, load_filter='*'):
+        """Return the name of the active state and the value of a variable.
+
+        The file is found from the key fingerprints, with a single search of
+        each file for the fields of the variable, without parsing them, and
+        only the variable is decrypted.
+        """
+        if key is None:
+            key = read_env("KEY")
+        try:
+            encrypter = Encrypter(key=key)
+        except:
+            raise InvalidKey("The supplied key is not a valid key")
+
+        env_files = sorted(
+            glob.glob('{}.{}'.format(load_filter, State.FILE_EXTENSION)))
+        name = name.upper()
+        for filename in env_files:
+            fields = State.read_fields(filename, State.variable_fields(name))
+            if fields.get(State.KEY_ID) not in encrypter.fingerprints:
+                continue
             try:
-                state = State(env_files[i], key=self.key)
-                self.current_state_index = i
+                return fields[State.NAME], State.read_variable(
+                    filename, name, encrypter, fields=fields)
             except InvalidKey:
-                # still add this tate to
-                state = State(env_files[i], key=self.key, read_empty=True)
+                pass
+
+        # files without a fingerprint are only found by reading them
+        state = cls(key=key, load_filter=load_filter, lazy=True).get()
+        return state.name, State.read_variable(state.filename, name,
+                                               state.encrypter)
+
+    def map(self, function, items):
+        """Run the function for each item, using a thread pool for many items."""
+        if len(items) < 2:
+            return [function(item) for item in items]
+
+        with ThreadPoolExecutor(
+                max_workers=min(self.MAX_WORKERS, len(items))) as executor:
+            return list(executor.map(function, items))
+
+    def select(self, env_objects):
+        """Return the indexes of the env objects that the key can decrypt.
+
+        Files are matched by their key fingerprint, so usually only one signed
+        name is decrypted. Files without a fingerprint are tried with the key.
+        """
+        fingerprints = {}
+        candidates = []
+        for i in range(len(env_objects)):
+            key_id = env_objects[i].get(State.KEY_ID)
+            if key_id is None:
+                candidates.append(i)
+            else:
+                fingerprints.setdefault(key_id, []).append(i)
+
+        # the fingerprint is not a proof, so we still check the signed name
+        for fingerprint in self.encrypter.fingerprints:
+            candidates.extend(fingerprints.get(fingerprint, []))
+        with self.profile.phase(VERIFY):
+            verified = self.map(
+                lambda i: State.verify(self.encrypter, env_objects[i]),
+                candidates)
+        return set(candidates[i] for i in range(len(candidates)) if verified[i])
+
+    def read_list(self):
+        """Read the list of files.
+
+        Each file is read once and the state is selected from the key
+        fingerprints on the headers. Only the state that matches the key is
+        decrypted.
+        """
+        with self.profile.phase(GLOB):
+            env_files = sorted(
+                glob.glob('{}.{}'.format(self.load_filter,
+                                         State.FILE_EXTENSION)))
+        with self.profile.phase(READ):
+            contents = self.map(State.read_content, env_files)
+        self.profile.count(FILES_SCANNED, len(env_files))
+        self.profile.count(BYTES_READ, sum(len(c) for c in contents))
+
+        with self.profile.phase(PARSE):
+            env_objects = [
+                State.parse_file(env_files[i], content=contents[i])
+                for i in range(len(env_files))
+            ]
+        selected = self.select(env_objects)
+
+        manifests = {}
+        for i in range(len(env_files)):
+            state = None
+            if i in selected:
+                try:
+                    state = State(
+                        env_files[i],
+                        key=self.key,
+                        lazy=self.lazy,
+                        encrypter=self.encrypter,
+                        env_object=env_objects[i],
+                        content=contents[i],
+                        cache=self.cache,
+                        profile=self.profile,
+                        verified=True)
+                    self.current_state_index = i
+                except InvalidKey:
+                    pass
+
+            if state is None:
+                # still add the names of this state to the list
+                state = StateSummary(env_files[i], env_objects[i], manifests)
 
             self.list_of_states.append(state)
 
     def check_variables(self, raise_on_warning=False):
         """Check that all files have the same variables."""
-        # first create a dictionary of all variables in all states
+        with self.profile.phase(CHECK_VARIABLES):
+            self.warn_missing_variables(
+                self.find_missing_variables({
+                    state.name: state.variable_names()
+                    for state in self.list_of_states
+                }),
+                raise_on_warning=raise_on_warning)
+
+    def release(self):
+        """Forget the states that the key can't decrypt.
+
+        Only the active state is kept, so the variables can't be checked
+        against the other states anymore.
+        """
+        state = self.get()
+        self.list_of_states = [] if state is None else [state]
+        self.current_state_index = None if state is None else 0
+
+    @classmethod
+    def find_missing_variables(cls, manifests):
+        """Return the names of the states each variable is missing from.
+
+        The manifests map each state name to its set of variable names, or to
+        None when the names can't be read.
+        """
+        manifests = {
+            name: manifests[name]
+            for name in manifests if manifests[name] is not None
+        }
+        all_names = set().union(*manifests.values())
+
         missing = {}
-        for state in self.list_of_states:
-            for key, value in state:
-                if key not in missing:
-                    missing[key] = []
+        for name in manifests:
+            for key in all_names - manifests[name]:
+                missing.setdefault(key, []).append(name)
+        return {key: missing[key] for key in sorted(missing)}
 
-        # now for each state check what variables do exist there
-        for key in missing:
-            temp = []
-            for state in self.list_of_states:
-                if key not in state:
-                    temp.append(state.name)
-            missing[key] = temp
-
-        # finally output any missing variable in a state
-        # (the iteration is done again for code clarity)
+    @classmethod
+    def read_manifests(cls, load_filter='*'):
+        """Return the variable names of every file, without any key."""
+        env_files = sorted(
+            glob.glob('{}.{}'.format(load_filter, State.FILE_EXTENSION)))
+        manifests = {}
+        for env_file in env_files:
+            env_object = State.parse_file(env_file)
+            manifests[env_object[State.NAME]] = State.read_manifest(env_object)
+        return manifests
+
+    @classmethod
+    def warn_missing_variables(cls, missing, raise_on_warning=False):
+        """Log the variables that are missing from some states."""
         for key in missing:
-            if missing[key]:
-                logging.warning('Variable {} missing in states {}'.format(
-                    key, missing[key]))
-                if raise_on_warning:
-                    raise VariableMissing
+            logging.warning('Variable {} missing in states {}'.format(
+                key, missing[key]))
+            if raise_on_warning:
+                raise VariableMissing
 
     @property
     def name(self):
-        """Return the current state."""
-        return self.current_state.name
+        """Return the name of the current state."""
+        return self.get().name
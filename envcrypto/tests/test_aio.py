@@ -0,0 +1,112 @@
+"""Test the aio module."""
+import asyncio
+from unittest import mock
+
+from ..aio import AsyncStateList
+from ..exceptions import VariableNotFound
+from ..state import LazyData, StateList
+from .test_state import StateCreationTestCase
+
+
+class AsyncStateListTest(StateCreationTestCase):
+    """Test loading the states from a event loop."""
+
+    def run_async(self, coroutine):
+        """Run a coroutine on a new event loop."""
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def create_state(self, level, value):
+        """Create a level with a variable and return its key."""
+        key = self.create_levels([level])[0]
+        state = StateList(key=key, load_filter=level).get()
+        state.add(self.VARKEY, value)
+        state.save()
+        return key
+
+    def test_load(self):
+        """A lazy state should be decrypted off the loop."""
+        key = self.create_state(self.DEFAULT_LEVELS[0], self.VARVALUE)
+
+        async def load():
+            state_list = await AsyncStateList.load(
+                key=key, load_filter='unittest-*', lazy=True, cache=False)
+            state = state_list.get()
+            self.assertFalse(state.state.data.is_decrypted(self.VARKEY))
+
+            value = await state.aget(self.VARKEY.lower())
+            values = await state.aget_many()
+            with self.assertRaises(VariableNotFound):
+                await state.aget('MISSING')
+            return value, values
+
+        value, values = self.run_async(load())
+        self.assertEqual(value, self.VARVALUE)
+        self.assertEqual(values, {self.VARKEY: self.VARVALUE})
+
+    def test_concurrent_load(self):
+        """Several environments should be loaded at the same time."""
+        levels = self.DEFAULT_LEVELS[:3]
+        keys = [self.create_state(level, level) for level in levels]
+
+        async def load():
+            state_lists = await asyncio.gather(*[
+                AsyncStateList.load(key=key, load_filter='unittest-*')
+                for key in keys
+            ])
+            return [
+                await state_list.get().aget(self.VARKEY)
+                for state_list in state_lists
+            ]
+
+        self.assertEqual(self.run_async(load()), levels)
+
+    def test_add(self):
+        """A variable should be added and saved off the loop."""
+        key = self.create_state(self.DEFAULT_LEVELS[0], self.VARVALUE)
+
+        async def add():
+            state_list = await AsyncStateList.load(
+                key=key, load_filter='unittest-*')
+            await state_list.get().aadd('OTHER', 'other')
+            return await AsyncStateList.find_variable(
+                'OTHER', key=key, load_filter='unittest-*')
+
+        self.assertEqual(
+            self.run_async(add()), (self.DEFAULT_LEVELS[0], 'other'))
+
+    def test_reload(self):
+        """A reload should swap in the new state, decrypted in a batch."""
+        key = self.create_state(self.DEFAULT_LEVELS[0], self.VARVALUE)
+
+        async def reload():
+            state_list = await AsyncStateList.load(
+                key=key, load_filter='unittest-*', lazy=True, cache=False)
+            state = state_list.get()
+            other = StateList(key=key, load_filter='unittest-*').get()
+            other.add('OTHER', 'other')
+            other.save()
+
+            data = state.state.data
+            await state.areload()
+            self.assertIsNot(state.state.data, data)
+            self.assertIsInstance(state.state.data, LazyData)
+            self.assertEqual(state.state.manifest, {self.VARKEY, 'OTHER'})
+
+            data = state.state.data
+            with mock.patch.object(data, 'decrypt',
+                                   side_effect=AssertionError), \
+                    mock.patch.object(data, 'decrypt_many',
+                                      wraps=data.decrypt_many) as many:
+                values = await state.aget_many()
+            many.assert_called_once()
+            return values
+
+        self.assertEqual(
+            self.run_async(reload()), {
+                self.VARKEY: self.VARVALUE,
+                'OTHER': 'other'
+            })
@@ -0,0 +1,120 @@
+"""Test the artifact module."""
+import glob
+import io
+import os
+import shutil
+import stat
+import tempfile
+
+from ..artifact import CompiledStateList, compile_state
+from ..crypto import Encrypter
+from ..exceptions import InvalidKey, StaleArtifact
+from ..state import State
+from .test_state import StateCreationTestCase
+
+
+class CompiledStateListTest(StateCreationTestCase):
+    """Test loading the compiled state."""
+
+    ARTIFACT = 'unittest-compiled'
+
+    def test_compile(self):
+        """The compiled file should have the variables of the state."""
+        state = State.new(self.DEFAULT_LEVELS[0])
+        state.add(self.VARKEY, self.VARVALUE)
+        state.save()
+        compile_state(state, self.ARTIFACT)
+
+        compiled = CompiledStateList(self.ARTIFACT, key=state.key).get()
+        self.assertEqual(compiled.name, state.name)
+        self.assertEqual(list(compiled), list(state))
+
+        with self.assertRaises(InvalidKey):
+            CompiledStateList(self.ARTIFACT, key=Encrypter.generate_key())
+
+    def test_stale(self):
+        """A compiled file should not be loaded once its .env file changed."""
+        state = State.new(self.DEFAULT_LEVELS[0])
+        state.add(self.VARKEY, self.VARVALUE)
+        state.save()
+        compile_state(state, self.ARTIFACT)
+
+        state.add('OTHER', 'other')
+        state.save()
+        with self.assertRaises(StaleArtifact):
+            CompiledStateList(self.ARTIFACT, key=state.key)
+
+        # the source is checked before decrypting with the new key
+        state.set_key(Encrypter.generate_key())
+        state.save()
+        with self.assertRaises(StaleArtifact):
+            CompiledStateList(self.ARTIFACT, key=state.key)
+
+        # a compiled file deployed without its .env file is still loaded
+        compile_state(state, self.ARTIFACT)
+        os.remove(state.filename)
+        compiled = CompiledStateList(self.ARTIFACT, key=state.key).get()
+        self.assertEqual(compiled.data['OTHER'], 'other')
+
+    def test_touched(self):
+        """A compiled file should be loaded if its .env file is the same."""
+        state = State.new(self.DEFAULT_LEVELS[0])
+        state.add(self.VARKEY, self.VARVALUE)
+        state.save()
+        compile_state(state, self.ARTIFACT)
+
+        # a new checkout of the same file has another modification time
+        stat = os.stat(state.filename)
+        os.utime(state.filename, ns=(stat.st_atime_ns,
+                                     stat.st_mtime_ns + 10**10))
+        compiled = CompiledStateList(self.ARTIFACT, key=state.key).get()
+        self.assertEqual(compiled.data[self.VARKEY], self.VARVALUE)
+
+    def test_moved(self):
+        """The .env file next to a moved compiled file should be checked."""
+        state = State.new(self.DEFAULT_LEVELS[0])
+        state.add(self.VARKEY, self.VARVALUE)
+        state.save()
+        compile_state(state, self.ARTIFACT)
+
+        with tempfile.TemporaryDirectory() as directory:
+            artifact = os.path.join(directory, self.ARTIFACT)
+            os.rename(self.ARTIFACT, artifact)
+            env_file = os.path.join(directory, state.filename)
+            shutil.copy(state.filename, env_file)
+            os.remove(state.filename)
+            CompiledStateList(artifact, key=state.key)
+
+            moved = State(env_file, key=state.key, read_from_env=False)
+            moved.add('OTHER', 'other')
+            moved.save()
+            with self.assertRaises(StaleArtifact):
+                CompiledStateList(artifact, key=state.key)
+
+    def test_blob_directory(self):
+        """The blobs should be read from the directory of the .env file."""
+        content = b'-----BEGIN CERTIFICATE-----\n' * 100
+        state = State.new(self.DEFAULT_LEVELS[0])
+        state.add_blob(self.VARKEY, io.BytesIO(content))
+        state.save()
+
+        with tempfile.TemporaryDirectory() as directory:
+            artifact = os.path.join(directory, self.ARTIFACT)
+            compile_state(state, artifact)
+            compiled = CompiledStateList(artifact, key=state.key).get()
+            self.assertEqual(compiled.data[self.VARKEY].read(), content)
+
+    def test_permissions(self):
+        """The compiled file and the blobs should follow the umask."""
+        state = State.new(self.DEFAULT_LEVELS[0])
+        state.add_blob(self.VARKEY, io.BytesIO(b'blob'))
+        state.save()
+        compile_state(state, self.ARTIFACT)
+        with open('unittest-reference', 'w'):
+            pass
+
+        blob_files = glob.glob('{}.*.blob'.format(state.name))
+        self.assertEqual(len(blob_files), 1)
+        mode = stat.S_IMODE(os.stat('unittest-reference').st_mode)
+        for filename in [self.ARTIFACT] + blob_files:
+            self.assertEqual(stat.S_IMODE(os.stat(filename).st_mode), mode)
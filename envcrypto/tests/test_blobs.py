@@ -0,0 +1,92 @@
+"""Test the blobs module."""
+import glob
+import io
+import os
+
+from ..blobs import Blob, decrypt_stream, encrypt_stream
+from ..crypto import Encrypter
+from ..exceptions import InvalidKey
+from ..state import State, StateList
+from .test_state import StateCreationTestCase
+
+
+class BlobTest(StateCreationTestCase):
+    """Test the large variables stored on sidecar files."""
+
+    CONTENT = b'-----BEGIN CERTIFICATE-----\n' * 1000
+
+    def test_stream(self):
+        """Streams should be decrypted in chunks, whatever their size."""
+        key = os.urandom(32)
+        for size in [0, 1, 7, 8, 9, 24]:
+            content = os.urandom(size)
+            target = io.BytesIO()
+            self.assertEqual(
+                encrypt_stream(
+                    io.BytesIO(content), target, key, chunk_size=8), size)
+
+            chunks = list(decrypt_stream(io.BytesIO(target.getvalue()), key))
+            self.assertEqual(b''.join(chunks), content)
+            self.assertTrue(all(len(chunk) <= 8 for chunk in chunks))
+
+        # a file cut on a chunk boundary is not a valid stream
+        truncated = target.getvalue()[:-(8 + 16)]
+        with self.assertRaises(InvalidKey):
+            list(decrypt_stream(io.BytesIO(truncated), key))
+
+    def test_state_blob(self):
+        """A blob should be saved next to the file and read on access."""
+        state = State.new(self.DEFAULT_LEVELS[0])
+        state.add_blob(self.VARKEY, io.BytesIO(self.CONTENT))
+        state.save()
+
+        with open(state.filename, 'rb') as env_file:
+            self.assertNotIn(b'CERTIFICATE', env_file.read())
+        blob_files = glob.glob('{}.*.blob'.format(state.name))
+        self.assertEqual(len(blob_files), 1)
+
+        new_state = StateList(
+            key=state.key, load_filter='unittest-*', lazy=True).get()
+        blob = new_state.data[self.VARKEY]
+        self.assertIsInstance(blob, Blob)
+        self.assertEqual(blob.size, len(self.CONTENT))
+        self.assertEqual(blob.read(), self.CONTENT)
+        with blob.open() as blob_file:
+            self.assertEqual(blob_file.readline(), self.CONTENT[:28])
+        self.assertEqual(
+            State.read_variable(state.filename, self.VARKEY,
+                                Encrypter(state.key)).read(), self.CONTENT)
+
+        # a new key only encrypts the blob key again
+        new_state.set_key(Encrypter.generate_key())
+        new_state.save()
+        self.assertEqual(
+            StateList(key=new_state.key, load_filter='unittest-*').get()
+            .data[self.VARKEY].read(), self.CONTENT)
+
+        # replacing or removing the variable removes the blob once saved
+        new_state.add(self.VARKEY, self.VARVALUE, force=True)
+        self.assertEqual(glob.glob('{}.*.blob'.format(state.name)), blob_files)
+        new_state.save()
+        self.assertEqual(glob.glob('{}.*.blob'.format(state.name)), [])
+
+    def test_reload_unsaved_blob(self):
+        """The blobs of the changes that weren't saved are removed on reload."""
+        state = State.new(self.DEFAULT_LEVELS[0])
+        state.add_blob(self.VARKEY, io.BytesIO(self.CONTENT))
+        state.save()
+        blob_files = glob.glob('{}.*.blob'.format(state.name))
+
+        # a blob replaced by another one that wasn't saved
+        state.add_blob(self.VARKEY, io.BytesIO(b'replaced'), force=True)
+        state.add_blob('OTHER', io.BytesIO(b'other'))
+        self.assertEqual(len(glob.glob('{}.*.blob'.format(state.name))), 3)
+        state.reload()
+        self.assertEqual(glob.glob('{}.*.blob'.format(state.name)), blob_files)
+        self.assertEqual(state.data[self.VARKEY].read(), self.CONTENT)
+
+        state.add_blob('OTHER', io.BytesIO(b'other'))
+        with state.locked():
+            pass
+        self.assertEqual(glob.glob('{}.*.blob'.format(state.name)), blob_files)
+        self.assertNotIn('OTHER', state.data)
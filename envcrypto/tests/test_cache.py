@@ -0,0 +1,67 @@
+"""Test the cache module."""
+import shutil
+import tempfile
+from unittest import mock
+
+from ..cache import StateCache
+from ..state import State, StateList
+from .test_state import StateCreationTestCase
+
+
+class StateCacheTest(StateCreationTestCase):
+    """Test the cache of decrypted states."""
+
+    def read_level(self, key, cache):
+        """Read the active state with a cache."""
+        return StateList(
+            key=key, load_filter='unittest-*', cache=cache).get()
+
+    def test_cached_state_is_not_decrypted(self):
+        """An unchanged file should be read from the cache."""
+        cache = StateCache()
+        key = self.create_levels(self.DEFAULT_LEVELS[:2])[0]
+        state = self.read_level(key, cache)
+        self.assertEqual(len(cache), 1)
+
+        with mock.patch.object(State, 'load_and_decrypt_data') as decrypt:
+            cached_state = self.read_level(key, cache)
+            decrypt.assert_not_called()
+
+        self.assertEqual(cached_state.name, state.name)
+        self.assertEqual(cached_state.django_secret, state.django_secret)
+
+    def test_save_invalidates(self):
+        """Saving a state should remove it from the cache."""
+        cache = StateCache()
+        key = self.create_levels(self.DEFAULT_LEVELS[:1])[0]
+        state = self.read_level(key, cache)
+        state.add(self.VARKEY, self.VARVALUE)
+        state.save()
+        self.assertEqual(len(cache), 0)
+
+        new_state = self.read_level(key, cache)
+        self.assertEqual(new_state.data[self.VARKEY], self.VARVALUE)
+
+    def test_eviction(self):
+        """The cache should not grow over its size."""
+        cache = StateCache(max_size=2)
+        key_list = self.create_levels(self.DEFAULT_LEVELS[:3])
+        for key in key_list:
+            self.read_level(key, cache)
+
+        self.assertEqual(len(cache), 2)
+
+    def test_disk_cache(self):
+        """States should be read from the disk cache by another process."""
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+
+        key = self.create_levels(self.DEFAULT_LEVELS[:1])[0]
+        state = self.read_level(key, StateCache(cache_dir=cache_dir))
+
+        with mock.patch.object(State, 'load_and_decrypt_data') as decrypt:
+            cached_state = self.read_level(key,
+                                           StateCache(cache_dir=cache_dir))
+            decrypt.assert_not_called()
+
+        self.assertEqual(cached_state.django_secret, state.django_secret)
@@ -0,0 +1,20 @@
+"""Test the system checks."""
+from ..checks import check_variables
+from ..state import StateList
+from .test_state import StateCreationTestCase
+
+
+class ChecksTest(StateCreationTestCase):
+    """Test the system checks of the environment files."""
+
+    def test_missing_variables(self):
+        """A variable missing from an environment should be a warning."""
+        key_list = self.create_levels(self.DEFAULT_LEVELS[:2])
+        self.assertEqual(check_variables(), [])
+
+        state = StateList(key=key_list[0], load_filter='unittest-*').get()
+        state.add(self.VARKEY, self.VARVALUE)
+        state.save()
+
+        warnings = check_variables()
+        self.assertEqual([w.id for w in warnings], ['envcrypto.W001'])
@@ -0,0 +1,164 @@
+"""Test the management commands."""
+import io
+import os
+from base64 import urlsafe_b64encode
+from contextlib import redirect_stdout
+from unittest import mock
+
+from django.core.management import call_command
+
+from ..crypto import Encrypter
+from ..state import State, StateList
+from .test_state import StateCreationTestCase
+
+
+class CommandTestCase(StateCreationTestCase):
+    """Run the commands and read what they print."""
+
+    def call(self, *args, **kwargs):
+        """Call a command and return the lines it printed."""
+        output = io.StringIO()
+        with redirect_stdout(output):
+            call_command(*args, **kwargs)
+        return output.getvalue().splitlines()
+
+
+class EncryptionCommandTest(CommandTestCase):
+    """Test encrypting and decrypting single values."""
+
+    def test_file_token(self):
+        """The tokens of the .env files should be decrypted."""
+        state = State.new(self.DEFAULT_LEVELS[0])
+        state.add(self.VARKEY, self.VARVALUE)
+        state.save()
+
+        token = State.parse_file(state.filename)[self.VARKEY]
+        lines = self.call('env-encryption', token, '-d', key=state.key)
+        self.assertEqual(lines[-1], self.VARVALUE)
+
+    def test_encrypt(self):
+        """A value should be encrypted as the tokens of each cipher."""
+        key = Encrypter.generate_key()
+        for algorithm in sorted(Encrypter.CIPHERS):
+            token = self.call(
+                'env-encryption',
+                self.VARVALUE,
+                '-e',
+                key=key,
+                algorithm=algorithm)[-1]
+            self.assertEqual(
+                Encrypter(key, algorithm=algorithm).decrypt_token(token),
+                self.VARVALUE)
+            # the tokens can start with a dash, so they are passed after --
+            lines = self.call(
+                'env-encryption',
+                '-d',
+                '--',
+                token,
+                key=key,
+                algorithm=algorithm)
+            self.assertEqual(lines[-1], self.VARVALUE)
+
+    def test_dash_token(self):
+        """A token that starts with a dash should be decrypted after --."""
+        key = Encrypter.generate_key()
+        encrypter = Encrypter(key, algorithm=Encrypter.AES_GCM)
+        # only the tokens written without the version byte start with a dash
+        nonce = b'\xf8' + os.urandom(11)
+        token = urlsafe_b64encode(nonce + encrypter.ciphers[0].aead.encrypt(
+            nonce, self.VARVALUE.encode('utf-8'), None)).decode('utf-8')
+        self.assertTrue(token.startswith('-'))
+        lines = self.call(
+            'env-encryption',
+            '-d',
+            '--',
+            token,
+            key=key,
+            algorithm=Encrypter.AES_GCM)
+        self.assertEqual(lines[-1], self.VARVALUE)
+
+    def test_legacy_digest(self):
+        """The digests of the older files should still be decrypted."""
+        key = Encrypter.generate_key()
+        digest = Encrypter(key).encrypt(self.VARVALUE)
+        lines = self.call('env-encryption', digest, '-d', key=key)
+        self.assertEqual(lines[-1], self.VARVALUE)
+
+
+class AddCommandTest(CommandTestCase):
+    """Test adding variables."""
+
+    def test_force_keeps_type(self):
+        """A typed variable replaced with -f should keep its type."""
+        key = self.create_levels(self.DEFAULT_LEVELS[:1])[0]
+        self.call('env-add', 'PORT', '8080', key=key, variable_type='int')
+        self.call('env-add', 'PORT', '9090', '-f', key=key)
+
+        state = StateList(key=key).get()
+        self.assertEqual(state.data['PORT'], 9090)
+        self.assertEqual(state.types, {'PORT': 'int'})
+
+
+class ShowCommandTest(CommandTestCase):
+    """Test showing variables."""
+
+    def test_blob(self):
+        """Blobs should be described instead of read."""
+        state = State.new(self.DEFAULT_LEVELS[0])
+        state.add_blob(self.VARKEY, io.BytesIO(b'\xff\xfe' * 1024))
+        state.save()
+
+        for kwargs in [{}, {'name': self.VARKEY}]:
+            lines = self.call('env-show', key=state.key, **kwargs)
+            self.assertIn('<Blob ', lines[-1])
+            self.assertIn('(2048 bytes)', lines[-1])
+
+
+class ImportCommandTest(CommandTestCase):
+    """Test importing many variables at once."""
+
+    DOTENV = 'unittest-import.dotenv'
+
+    def setUp(self):
+        """Create a level and a file to import."""
+        super().setUp()
+        self.key = self.create_levels(self.DEFAULT_LEVELS[:1])[0]
+        with open(self.DOTENV, 'w') as dotenv_file:
+            dotenv_file.write('{}=imported\nOTHER=other\n'.format(self.VARKEY))
+
+    def read_data(self):
+        """Return the variables of the level."""
+        return dict(StateList(key=self.key).get().data.items())
+
+    def test_single_save(self):
+        """All the variables should be saved at once."""
+        with mock.patch.object(
+                State, 'save', autospec=True, side_effect=State.save) as save:
+            self.call('env-import', self.DOTENV, key=self.key)
+        save.assert_called_once()
+        self.assertEqual(self.read_data(), {
+            self.VARKEY: 'imported',
+            'OTHER': 'other'
+        })
+
+    def test_force(self):
+        """Existing variables should only be replaced with -f."""
+        state = StateList(key=self.key).get()
+        state.add(self.VARKEY, self.VARVALUE)
+        state.save()
+
+        lines = self.call('env-import', self.DOTENV, key=self.key)
+        self.assertTrue(any('-f' in line for line in lines))
+        self.assertEqual(self.read_data(), {
+            self.VARKEY: self.VARVALUE,
+            'OTHER': 'other'
+        })
+
+        self.call('env-import', self.DOTENV, '-f', key=self.key)
+        self.assertEqual(self.read_data()[self.VARKEY], 'imported')
+
+    def test_stdin(self):
+        """The variables should be read from stdin with -."""
+        with mock.patch('sys.stdin', io.StringIO('{"PORT": 80}')):
+            self.call('env-import', '-', key=self.key)
+        self.assertEqual(self.read_data(), {'PORT': '80'})
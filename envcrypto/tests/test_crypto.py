@@ -1,8 +1,21 @@
 """Test the crypto module."""
-from ..crypto import Encrypter
+import multiprocessing
+import os
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from unittest import mock
+
+from cryptography.fernet import InvalidToken
+
+from ..crypto import Encrypter, FernetCipher
+from ..exceptions import InvalidKey
 from .tests import CommonTestCase
 
 
+class RegisteredCipher(FernetCipher):
+    """A cipher added with register_cipher."""
+
+
 class CryptoEncrypter(CommonTestCase):
     """Test the encrypter module, generating and using keys."""
 
@@ -29,3 +42,99 @@ class CryptoEncrypter(CommonTestCase):
         self.assertEqual(
             encrypter.decrypt(digest), CryptoEncrypter.MESSAGE,
             "Decrypted messages are not the same")
+
+    def test_fingerprint(self):
+        """The fingerprint should identify the key without revealing it."""
+        key = Encrypter.generate_key()
+        fingerprint = Encrypter(key=key).fingerprint
+
+        self.assertEqual(len(fingerprint), Encrypter.FINGERPRINT_SIZE)
+        self.assertEqual(Encrypter(key=key.decode()).fingerprint, fingerprint)
+        self.assertNotEqual(
+            Encrypter(key=Encrypter.generate_key()).fingerprint, fingerprint)
+        self.assertNotIn(fingerprint, key.decode())
+
+    def test_algorithms(self):
+        """Every cipher should decrypt its own tokens, with any of the keys."""
+        old_key, key = Encrypter.generate_key(), Encrypter.generate_key()
+        for algorithm in Encrypter.CIPHERS:
+            old_encrypter = Encrypter(key=old_key, algorithm=algorithm)
+            encrypter = Encrypter(key=[key, old_key], algorithm=algorithm)
+
+            token = old_encrypter.encrypt_token(self.MESSAGE)
+            self.assertEqual(encrypter.decrypt_token(token), self.MESSAGE)
+            self.assertEqual(
+                encrypter.find_fingerprint(token), old_encrypter.fingerprint)
+
+            rotated = encrypter.rotate_token(token)
+            with self.assertRaises(InvalidToken):
+                old_encrypter.decrypt_token(rotated)
+            self.assertEqual(
+                Encrypter(key=key, algorithm=algorithm).decrypt_token(rotated),
+                self.MESSAGE)
+
+        # the AEAD tokens start with their version byte, never with a dash
+        for algorithm in [Encrypter.AES_GCM, Encrypter.CHACHA20_POLY1305]:
+            encrypter = Encrypter(key=key, algorithm=algorithm)
+            cipher = encrypter.ciphers[0]
+            for i in range(64):
+                self.assertEqual(
+                    urlsafe_b64decode(encrypter.encrypt_token(
+                        self.MESSAGE))[:1], cipher.VERSION)
+
+            # the tokens written before the version byte, even with its value
+            for first in [b'\x00', cipher.VERSION]:
+                nonce = first + os.urandom(cipher.NONCE_SIZE - 1)
+                token = urlsafe_b64encode(nonce + cipher.aead.encrypt(
+                    nonce, self.MESSAGE.encode('utf-8'), None))
+                self.assertEqual(
+                    encrypter.decrypt_token(token.decode('utf-8')),
+                    self.MESSAGE)
+
+        # the same key encrypts differently with each algorithm
+        token = Encrypter(key=key, algorithm=Encrypter.AES_GCM).encrypt_token(
+            self.MESSAGE)
+        with self.assertRaises(InvalidToken):
+            Encrypter(
+                key=key, algorithm=Encrypter.CHACHA20_POLY1305).decrypt_token(
+                    token)
+
+    def test_many(self):
+        """Batches should keep their order and report the failing value."""
+        encrypter = Encrypter(key=Encrypter.generate_key())
+        messages = ['{}{}'.format(self.MESSAGE, i) for i in range(10)]
+
+        with mock.patch.object(Encrypter, 'CHUNK_SIZE', 3), \
+                ThreadPoolExecutor(max_workers=2) as executor:
+            tokens = encrypter.encrypt_many(messages, executor=executor)
+            self.assertEqual(
+                encrypter.decrypt_many(tokens, executor=executor), messages)
+
+        tokens = encrypter.encrypt_many({'A': 'a', 'B': 'b'})
+        self.assertEqual(encrypter.decrypt_many(tokens), {'A': 'a', 'B': 'b'})
+
+        tokens['B'] = Encrypter(key=Encrypter.generate_key()).encrypt_token('b')
+        with self.assertRaises(InvalidKey) as context:
+            encrypter.decrypt_many(tokens)
+        self.assertEqual(context.exception.key, 'B')
+
+        # only the errors of the values are turned into InvalidKey
+        with mock.patch.object(
+                Encrypter, 'decrypt_token', side_effect=MemoryError):
+            with self.assertRaises(MemoryError):
+                encrypter.decrypt_many(tokens)
+
+    def test_many_processes(self):
+        """Registered ciphers should be found by spawned processes."""
+        Encrypter.register_cipher('unittest-cipher', RegisteredCipher)
+        self.addCleanup(Encrypter.CIPHERS.pop, 'unittest-cipher')
+        encrypter = Encrypter(
+            key=Encrypter.generate_key(), algorithm='unittest-cipher')
+        messages = ['{}{}'.format(self.MESSAGE, i) for i in range(4)]
+
+        with ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context('spawn')) as executor:
+            tokens = encrypter.encrypt_many(messages, executor=executor)
+            self.assertEqual(
+                encrypter.decrypt_many(tokens, executor=executor), messages)
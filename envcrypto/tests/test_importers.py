@@ -0,0 +1,55 @@
+"""Test the importers module."""
+from ..exceptions import InvalidEnvFile
+from ..importers import JSON, read_variables
+from .tests import CommonTestCase
+
+
+class ImportersTest(CommonTestCase):
+    """Test reading variables from documents."""
+
+    DOTENV = '''# a comment
+export DEBUG=1
+NAME = plain value # with a comment
+QUOTED="line\\nbreak"
+SINGLE='no \\n escapes'
+EMPTY=
+COMMENTED="y # kept" # note
+SINGLE_COMMENTED='x' # note
+ESCAPED="say \\"hi\\"" # note
+'''
+
+    def test_dotenv(self):
+        """Dotenv documents should be read with quotes and comments."""
+        self.assertEqual(
+            read_variables(self.DOTENV), {
+                'DEBUG': '1',
+                'NAME': 'plain value',
+                'QUOTED': 'line\nbreak',
+                'SINGLE': 'no \\n escapes',
+                'EMPTY': '',
+                'COMMENTED': 'y # kept',
+                'SINGLE_COMMENTED': 'x',
+                'ESCAPED': 'say "hi"',
+            })
+
+    def test_invalid_dotenv(self):
+        """Lines that are not assignments should raise an exception."""
+        with self.assertRaises(InvalidEnvFile):
+            read_variables('NAME')
+
+        # and so are the names that are empty or not valid
+        for line in ['=value', ' = value', 'export =value', 'A B=value']:
+            with self.assertRaises(InvalidEnvFile) as context:
+                read_variables('A=a\n' + line)
+            self.assertIn('Line 2', str(context.exception))
+
+    def test_json(self):
+        """JSON objects should be read, keeping other types as JSON."""
+        self.assertEqual(
+            read_variables('{"NAME": "value", "PORT": 80}'), {
+                'NAME': 'value',
+                'PORT': '80'
+            })
+
+        with self.assertRaises(InvalidEnvFile):
+            read_variables('["NAME"]', file_format=JSON)
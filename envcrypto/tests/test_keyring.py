@@ -0,0 +1,136 @@
+"""Test the keyring module."""
+import json
+import os
+from unittest import mock
+
+from ..cache import StateCache
+from ..crypto import Encrypter
+from ..exceptions import DeploymentLevelNotFound, InvalidKey
+from ..keyring import Keyring
+from ..state import State
+from .test_state import StateCreationTestCase
+
+
+class KeyringTest(StateCreationTestCase):
+    """Test opening the states of several keys."""
+
+    def create_keyring(self, **kwargs):
+        """Create the levels and a keyring with the keys of two of them."""
+        self.key_list = self.create_levels(self.DEFAULT_LEVELS[:3])
+        return Keyring(
+            self.key_list[:2], load_filter='unittest-*', **kwargs)
+
+    def test_get(self):
+        """Each state should be decrypted with its own key, only once."""
+        keyring = self.create_keyring()
+        self.assertEqual(keyring.names(), sorted(self.DEFAULT_LEVELS[:2]))
+
+        debug = keyring.get(self.DEFAULT_LEVELS[0])
+        staging = keyring.get(self.DEFAULT_LEVELS[1])
+        self.assertEqual(debug.name, self.DEFAULT_LEVELS[0])
+        self.assertEqual(staging.name, self.DEFAULT_LEVELS[1])
+        self.assertEqual(debug.encrypter.fingerprint,
+                         Encrypter(key=self.key_list[0]).fingerprint)
+
+        with mock.patch.object(State, 'load') as load:
+            self.assertIs(keyring.get(self.DEFAULT_LEVELS[0]), debug)
+            load.assert_not_called()
+
+        with self.assertRaises(InvalidKey):
+            keyring.get(self.DEFAULT_LEVELS[2])
+        with self.assertRaises(DeploymentLevelNotFound):
+            keyring.get('unittest-missing')
+
+        keyring.add_key(self.key_list[2])
+        self.assertEqual(
+            keyring.get(self.DEFAULT_LEVELS[2]).name, self.DEFAULT_LEVELS[2])
+
+    def test_eviction(self):
+        """States should be evicted when full, expired or their key removed."""
+        keyring = self.create_keyring(max_size=1, ttl=60)
+        debug = keyring.get(self.DEFAULT_LEVELS[0])
+        keyring.get(self.DEFAULT_LEVELS[1])
+        self.assertNotIn(self.DEFAULT_LEVELS[0], keyring)
+        self.assertEqual(len(keyring), 1)
+        self.assertIsNot(keyring.get(self.DEFAULT_LEVELS[0]), debug)
+
+        debug = keyring.get(self.DEFAULT_LEVELS[0])
+        with mock.patch('envcrypto.keyring.time.monotonic') as monotonic:
+            monotonic.return_value = 10**9
+            self.assertIsNot(keyring.get(self.DEFAULT_LEVELS[0]), debug)
+
+        keyring.remove_key(self.key_list[0])
+        self.assertEqual(len(keyring), 0)
+        with self.assertRaises(InvalidKey):
+            keyring.get(self.DEFAULT_LEVELS[0])
+
+        keyring.get(self.DEFAULT_LEVELS[1])
+        keyring.evict()
+        self.assertEqual(len(keyring), 0)
+
+    def test_state_cache(self):
+        """Evicted states should not be kept on the StateCache."""
+        cache = StateCache()
+        keyring = self.create_keyring(cache=cache, max_size=1)
+        debug = keyring.get(self.DEFAULT_LEVELS[0])
+        self.assertEqual(len(cache), 1)
+
+        # the least recently used state is evicted
+        keyring.get(self.DEFAULT_LEVELS[1])
+        self.assertEqual(len(cache), 1)
+        self.assertNotIn(os.path.abspath(debug.filename),
+                         [identity[0] for identity in cache.states])
+
+        keyring.evict()
+        self.assertEqual(len(cache), 0)
+
+        keyring.get(self.DEFAULT_LEVELS[0])
+        keyring.remove_key(self.key_list[0])
+        self.assertEqual(len(cache), 0)
+
+    def test_default_state_cache(self):
+        """Evicted states should not be kept on the default StateCache."""
+        keyring = self.create_keyring()
+        filename = keyring.get(self.DEFAULT_LEVELS[0]).filename
+        keyring.evict()
+        self.assertNotIn(os.path.abspath(filename), [
+            identity[0] for identity in StateCache.default().states
+        ])
+
+    def test_rotated_key(self):
+        """A state saved with another key of the keyring should be found."""
+        new_key = Encrypter.generate_key()
+        keyring = self.create_keyring(ttl=0)
+        keyring.add_key(new_key)
+        state = keyring.get(self.DEFAULT_LEVELS[0])
+
+        state.set_key(new_key)
+        state.save()
+        for i in range(2):
+            debug = keyring.get(self.DEFAULT_LEVELS[0])
+            self.assertEqual(debug.encrypter.fingerprint,
+                             Encrypter(key=new_key).fingerprint)
+
+    def test_legacy_files(self):
+        """Files written before the key fingerprint should be found."""
+        key = Encrypter.generate_key()
+        encrypter = Encrypter(key=key)
+        name = self.DEFAULT_LEVELS[0]
+        with open('{}.{}'.format(name, State.FILE_EXTENSION), 'w') as env_file:
+            env_file.write(
+                json.dumps({
+                    State.NAME: name,
+                    State.SIGNED_NAME: encrypter.encrypt(name),
+                    State.CRYPTO_TYPE: 'symmetric',
+                    State.CRYPTO_ALGORITHM: State.FERNET,
+                    State.VERSION: '0.8.6',
+                    State.SECRET_KEY: encrypter.encrypt('secret'),
+                    self.VARKEY: encrypter.encrypt(self.VARVALUE),
+                }, indent=4, sort_keys=True))
+
+        keyring = Keyring(
+            [Encrypter.generate_key(), key], load_filter='unittest-*')
+        self.assertEqual(keyring.names(), [name])
+        state = keyring.get(name)
+        self.assertEqual(state.django_secret, 'secret')
+        self.assertEqual(state.data[self.VARKEY], self.VARVALUE)
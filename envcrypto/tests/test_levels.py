@@ -1,8 +1,23 @@
 """Test the crypto module."""
+import os
+import subprocess
+import sys
+import tempfile
+from enum import Enum
+from types import ModuleType
+from unittest import mock
+
+from django.conf import Settings
+
+from .. import levels as levels_module
+from .. import registry
+from ..artifact import compile_state
+from ..crypto import Encrypter
 from ..exceptions import DeploymentIsNotAEnum, DeploymentIsNotAClass
-from ..levels import DeployLevel, Deployment
+from ..levels import DeployLevel, Deployment, LazySettingsModule
+from ..state import LazyData, State, StateList
+from .test_state import StateCreationTestCase
 from .tests import CommonTestCase
-from enum import Enum
 
 
 class RealDeploymentEnvironments(Enum):
@@ -38,3 +53,230 @@ class LevelsDeployLevel(CommonTestCase):
         self.assertEqual(deploy_level.levels.STAGING.value, 'staging')
         self.assertEqual(deploy_level.levels.PRODUCTION.value, 'production')
 
+    def test_lazy_package_import(self):
+        """Importing DeployLevel should not import the crypto modules."""
+        output = subprocess.check_output([
+            sys.executable, '-c',
+            'import sys; from envcrypto import DeployLevel; '
+            'print("cryptography" in sys.modules)'
+        ])
+        self.assertEqual(output.decode().strip(), 'False')
+
+
+class UnittestDeployment(Enum):
+    DEBUG = 'unittest-debug'
+
+
+class LevelsLoadGlobals(StateCreationTestCase):
+    """Test how DeployLevel sets the variables on the settings module."""
+
+    SETTINGS_MODULE = 'unittest_settings'
+
+    def create_state(self):
+        """Create a level with a variable."""
+        state = State.new(UnittestDeployment.DEBUG.value)
+        state.add(self.VARKEY, self.VARVALUE)
+        state.save()
+        return state
+
+    def load_settings(self, key, lazy=False, artifact=None,
+                      profile_hook=None):
+        """Load the level into a new settings module."""
+        settings = ModuleType(self.SETTINGS_MODULE)
+        settings.SECRET_KEY = 'DJANGO-ENVCRYPTO'
+
+        with mock.patch.dict(os.environ, {
+                'DJANGO_SETTINGS_MODULE': self.SETTINGS_MODULE
+        }), mock.patch.dict(sys.modules, {self.SETTINGS_MODULE: settings}):
+            deploy_level = DeployLevel(
+                levels=UnittestDeployment,
+                key=key,
+                lazy=lazy,
+                artifact=artifact,
+                profile_hook=profile_hook)
+
+        return deploy_level, settings
+
+    def test_eager_globals(self):
+        """All the variables should be set on the settings module."""
+        state = self.create_state()
+        deploy_level, settings = self.load_settings(state.key)
+
+        self.assertEqual(deploy_level.LEVEL, UnittestDeployment.DEBUG)
+        self.assertEqual(settings.SECRET_KEY, deploy_level.state.django_secret)
+        self.assertEqual(settings.__dict__[self.VARKEY], self.VARVALUE)
+
+    def test_typed_globals(self):
+        """The settings should get the parsed values of typed variables."""
+        state = self.create_state()
+        state.add('WORKERS', '8', variable_type='int')
+        state.save()
+        deploy_level, settings = self.load_settings(state.key)
+
+        self.assertEqual(settings.WORKERS, 8)
+        self.assertEqual(deploy_level.get('WORKERS'), 8)
+        self.assertIsNone(deploy_level.get('MISSING'))
+
+    def test_lazy_globals(self):
+        """Variables should be read from the state when they are accessed."""
+        state = self.create_state()
+        deploy_level, settings = self.load_settings(state.key, lazy=True)
+
+        self.assertIsInstance(settings, LazySettingsModule)
+        self.assertEqual(settings.SECRET_KEY, deploy_level.state.django_secret)
+        self.assertNotIn(self.VARKEY, settings.__dict__)
+        self.assertNotIn(self.VARKEY, dir(settings))
+
+        # Django doesn't copy, nor decrypt, the variables
+        with mock.patch.dict(sys.modules, {self.SETTINGS_MODULE: settings}):
+            django_settings = Settings(self.SETTINGS_MODULE)
+        self.assertFalse(hasattr(django_settings, self.VARKEY))
+        self.assertFalse(deploy_level.state.data.is_decrypted(self.VARKEY))
+
+        self.assertEqual(deploy_level.get(self.VARKEY), self.VARVALUE)
+        self.assertEqual(getattr(settings, self.VARKEY), self.VARVALUE)
+        self.assertIn(self.VARKEY, settings.__dict__)
+
+    def test_compiled_globals(self):
+        """The compiled file should be loaded without the .env files."""
+        state = self.create_state()
+        compile_state(state, 'unittest-compiled')
+
+        with mock.patch.object(StateList, 'read_list') as read_list:
+            deploy_level, settings = self.load_settings(
+                state.key, artifact='unittest-compiled')
+            read_list.assert_not_called()
+
+        self.assertEqual(deploy_level.LEVEL, UnittestDeployment.DEBUG)
+        self.assertEqual(settings.SECRET_KEY, state.django_secret)
+        self.assertEqual(settings.__dict__[self.VARKEY], self.VARVALUE)
+
+        # the .env files are read once the compiled file is stale
+        state.add(self.VARKEY, 'changed', force=True)
+        state.save()
+        with self.assertLogs(level='WARNING'):
+            deploy_level, settings = self.load_settings(
+                state.key, artifact='unittest-compiled')
+        self.assertEqual(settings.__dict__[self.VARKEY], 'changed')
+
+    def test_rotated_compiled_globals(self):
+        """The .env files should be read if the key was rotated."""
+        state = self.create_state()
+        compile_state(state, 'unittest-compiled')
+
+        state.set_key(Encrypter.generate_key())
+        state.save()
+        with self.assertLogs(level='WARNING'):
+            deploy_level, settings = self.load_settings(
+                state.key, artifact='unittest-compiled')
+        self.assertEqual(settings.__dict__[self.VARKEY], self.VARVALUE)
+
+        # a corrupt compiled file with the current key
+        compile_state(state, 'unittest-compiled')
+        with open('unittest-compiled', 'r+') as compiled_file:
+            compiled_file.truncate(os.path.getsize('unittest-compiled') // 2)
+        with self.assertLogs(level='WARNING'):
+            deploy_level, settings = self.load_settings(
+                state.key, artifact='unittest-compiled')
+        self.assertEqual(settings.__dict__[self.VARKEY], self.VARVALUE)
+
+    def test_preloaded_globals(self):
+        """The preloaded states should be shared, but not released."""
+        state = self.create_state()
+        self.create_levels(self.DEFAULT_LEVELS[1:3])
+        state_list = registry.preload(key=state.key)
+        self.addCleanup(registry.clear)
+        states = list(state_list.list_of_states)
+
+        hook = mock.Mock()
+        for i in range(2):
+            with mock.patch.object(StateList, 'read_list') as read_list:
+                deploy_level, settings = self.load_settings(
+                    state.key, profile_hook=hook)
+                read_list.assert_not_called()
+            self.assertEqual(settings.__dict__[self.VARKEY], self.VARVALUE)
+            self.assertEqual(deploy_level.state_list.list_of_states,
+                             [deploy_level.state])
+            self.assertEqual(state_list.list_of_states, states)
+        self.assertTrue(hook.called)
+
+    def test_unreadable_compiled_globals(self):
+        """The .env files should be read if the compiled file can't be."""
+        state = self.create_state()
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertLogs(level='WARNING'):
+                deploy_level, settings = self.load_settings(
+                    state.key, artifact=directory)
+        self.assertEqual(settings.__dict__[self.VARKEY], self.VARVALUE)
+
+    def test_reload_globals(self):
+        """Only the variables that changed should be updated on reload."""
+        for lazy in [False, True]:
+            state = self.create_state()
+            state.add('KEPT', 'kept')
+            state.save()
+            deploy_level, settings = self.load_settings(state.key, lazy=lazy)
+            kept = getattr(settings, 'KEPT')
+
+            state.add(self.VARKEY, 'changed', force=True)
+            state.add('ADDED', 'added')
+            state.save()
+            self.assertEqual(deploy_level.reload(), {self.VARKEY, 'ADDED'})
+            self.assertEqual(getattr(settings, self.VARKEY), 'changed')
+            self.assertEqual(getattr(settings, 'ADDED'), 'added')
+            self.assertIs(getattr(settings, 'KEPT'), kept)
+
+            state.remove('ADDED')
+            state.save()
+            self.assertEqual(deploy_level.reload(), {'ADDED'})
+            self.assertFalse(hasattr(settings, 'ADDED'))
+
+    def test_lazy_reload(self):
+        """A lazy reload should only decrypt the variables that changed."""
+        state = self.create_state()
+        state.add('KEPT', 'kept')
+        state.save()
+        deploy_level, settings = self.load_settings(state.key, lazy=True)
+
+        state.add(self.VARKEY, 'changed', force=True)
+        state.save()
+        self.assertEqual(deploy_level.reload(), {self.VARKEY})
+        self.assertIsInstance(settings, LazySettingsModule)
+        self.assertFalse(deploy_level.state.data.is_decrypted('KEPT'))
+        self.assertEqual(getattr(settings, 'KEPT'), 'kept')
+
+    def test_lazy_read_during_reload(self):
+        """A value read while the state is reloaded should not be kept."""
+        state = self.create_state()
+        deploy_level, settings = self.load_settings(state.key, lazy=True)
+        old_data = deploy_level.state.data
+        getitem = LazyData.__getitem__
+        reloads = []
+
+        def reload_while_reading(data, key):
+            # the file changes while the old value is decrypted
+            if data is old_data and not reloads:
+                state.add(self.VARKEY, 'changed', force=True)
+                state.save()
+                reloads.append(deploy_level.reload())
+            return getitem(data, key)
+
+        with mock.patch.object(LazyData, '__getitem__',
+                               reload_while_reading):
+            self.assertEqual(getattr(settings, self.VARKEY), 'changed')
+        self.assertEqual(reloads, [{self.VARKEY}])
+        self.assertEqual(settings.__dict__[self.VARKEY], 'changed')
+
+    def test_after_fork_in_child(self):
+        """The child should not share the reload lock of the parent."""
+        state = self.create_state()
+        deploy_level, settings = self.load_settings(state.key, lazy=True)
+        lock = deploy_level.reload_lock
+
+        lock.acquire()
+        self.addCleanup(lock.release)
+        levels_module.after_fork_in_child()
+        self.assertIsNot(deploy_level.reload_lock, lock)
+        self.assertIs(settings.__dict__[LazySettingsModule.LOCK_ATTRIBUTE],
+                      deploy_level.reload_lock)
+        self.assertEqual(deploy_level.reload(), set())
@@ -0,0 +1,62 @@
+"""Test the profiling module."""
+from ..profiling import (BYTES_READ, DECRYPT_CALLS, FILES_SCANNED, GLOB, PHASES,
+                         LoadProfile, set_profile_hook)
+from ..state import StateList
+from .test_state import StateCreationTestCase
+
+
+class LoadProfileTest(StateCreationTestCase):
+    """Test the timings and counters of loading the states."""
+
+    def test_counters(self):
+        """Loading should count the files, bytes and decryptions."""
+        key = self.create_levels(self.DEFAULT_LEVELS[:2])[0]
+        state = StateList(key=key, load_filter='unittest-*').get()
+        state.add(self.VARKEY, self.VARVALUE)
+        state.save()
+
+        state_list = StateList(
+            key=key, load_filter='unittest-*', lazy=True, cache=False)
+        profile = state_list.profile
+        self.assertEqual(profile.counters[FILES_SCANNED], 2)
+        self.assertGreater(profile.counters[BYTES_READ], 0)
+        self.assertEqual(list(profile.timings), PHASES)
+
+        # reading a variable of a lazy state decrypts it once
+        decrypt_calls = profile.counters[DECRYPT_CALLS]
+        state_list.get().data[self.VARKEY]
+        state_list.get().data[self.VARKEY]
+        self.assertEqual(profile.counters[DECRYPT_CALLS], decrypt_calls + 1)
+
+    def test_hook(self):
+        """The hook should be called after each phase."""
+        key = self.create_levels(self.DEFAULT_LEVELS[:1])[0]
+        calls = []
+        state_list = StateList(
+            key=key,
+            load_filter='unittest-*',
+            cache=False,
+            profile_hook=lambda *args: calls.append(args))
+
+        self.assertIn(GLOB, [phase for phase, _, _ in calls])
+        self.assertTrue(all(p is state_list.profile for _, _, p in calls))
+
+        calls = []
+        set_profile_hook(lambda *args: calls.append(args))
+        try:
+            StateList(key=key, load_filter='unittest-*', cache=False)
+        finally:
+            set_profile_hook(None)
+        self.assertIn(GLOB, [phase for phase, _, _ in calls])
+
+    def test_report(self):
+        """The report should list all phases and counters."""
+        profile = LoadProfile()
+        with profile.phase(GLOB):
+            pass
+        profile.count(FILES_SCANNED, 3)
+
+        report = profile.report()
+        for name in PHASES + [FILES_SCANNED, 'total']:
+            self.assertIn(name, report)
+        self.assertEqual(profile.as_dict()['counters'][FILES_SCANNED], 3)
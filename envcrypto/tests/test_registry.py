@@ -0,0 +1,55 @@
+"""Test the registry module."""
+import os
+import time
+from unittest import mock
+
+from .. import files, registry
+from ..state import StateList
+from .test_state import StateCreationTestCase
+
+
+class RegistryTest(StateCreationTestCase):
+    """Test sharing the preloaded states."""
+
+    def tearDown(self):
+        """Forget the preloaded states."""
+        registry.clear()
+        super().tearDown()
+
+    def test_preload(self):
+        """A preloaded StateList should be reused until its files change."""
+        key = self.create_levels(self.DEFAULT_LEVELS[:2])[0]
+        self.assertIsNone(registry.get(key=key, load_filter='unittest-*'))
+
+        state_list = registry.preload(key=key, load_filter='unittest-*')
+        with mock.patch.object(StateList, 'read_list') as read_list:
+            self.assertIs(
+                registry.get(key=key, load_filter='unittest-*'), state_list)
+            read_list.assert_not_called()
+
+        # another key has its own states
+        other_key = self.create_levels(self.DEFAULT_LEVELS[2:3])[0]
+        self.assertIsNone(registry.get(key=other_key, load_filter='unittest-*'))
+
+        # a changed file is read again
+        state = state_list.get()
+        state.add(self.VARKEY, self.VARVALUE)
+        state.save()
+        mtime = time.time() + 1
+        os.utime(state.filename, (mtime, mtime))
+
+        reloaded = registry.get(key=key, load_filter='unittest-*')
+        self.assertIsNot(reloaded, state_list)
+        self.assertEqual(reloaded.get().data[self.VARKEY], self.VARVALUE)
+
+    def test_after_fork_in_child(self):
+        """The child should not share the locks of the parent."""
+        key = self.create_levels(self.DEFAULT_LEVELS[:1])[0]
+        registry.preload(key=key, load_filter='unittest-*')
+        lock = files.file_lock(self.DEFAULT_LEVELS[0])
+
+        registry.before_fork()
+        registry.after_fork_in_child()
+
+        self.assertIsNot(files.file_lock(self.DEFAULT_LEVELS[0]), lock)
+        self.assertIsNotNone(registry.get(key=key, load_filter='unittest-*'))
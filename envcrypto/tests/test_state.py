@@ -1,9 +1,15 @@
 """Test the crypto module."""
 import glob
+import json
 import os
-
-from ..exceptions import InvalidKey, VariableExists, VariableMissing
-from ..state import State, StateList
+import stat
+import threading
+from unittest import mock
+
+from ..crypto import Encrypter
+from ..exceptions import (InvalidKey, InvalidVariableValue, VariableExists,
+                          VariableMissing, VariableNotFound)
+from ..state import State, StateList, StateSummary
 from .tests import CommonTestCase
 
 
@@ -31,7 +37,7 @@ class StateCreationTestCase(CommonTestCase):
 
     def tearDown(self):
         """Delete all unittest files."""
-        env_files = glob.glob("unittest-*.env")
+        env_files = glob.glob("unittest-*")
         for unit_test_file in env_files:
             os.remove(unit_test_file)
 
@@ -101,6 +107,277 @@ class StateTest(StateCreationTestCase):
         final_state = StateList(key=state.key).get()
         self.assertNotIn(self.VARKEY, final_state.data)
 
+    def test_incremental_save(self):
+        """Saving should only encrypt the variables that changed."""
+        state = self.create_and_read_level()
+        state.add(self.VARKEY, self.VARVALUE)
+        state.save()
+
+        with open(state.filename) as env_file:
+            before = json.loads(env_file.read())
+
+        new_state = self.read_level(state.key)
+        new_state.add('OTHER', self.VARVALUE)
+        new_state.save()
+
+        with open(state.filename) as env_file:
+            after = json.loads(env_file.read())
+
+        for key in (State.SIGNED_NAME, State.SECRET_KEY, self.VARKEY):
+            self.assertEqual(before[key], after[key])
+        self.assertEqual(self.read_level(state.key).data['OTHER'],
+                         self.VARVALUE)
+
+        # a new key encrypts everything again
+        new_state.set_key(Encrypter.generate_key())
+        new_state.save()
+        with open(state.filename) as env_file:
+            rotated = json.loads(env_file.read())
+        self.assertNotEqual(after[self.VARKEY], rotated[self.VARKEY])
+        self.assertEqual(
+            self.read_level(new_state.key).data[self.VARKEY], self.VARVALUE)
+
+    def test_locked_save(self):
+        """Concurrent changes should not overwrite each other."""
+        state = self.create_and_read_level()
+        names = ['{}_{}'.format(self.VARKEY, i) for i in range(8)]
+
+        def add_variable(name):
+            thread_state = self.read_level(state.key)
+            with thread_state.locked():
+                thread_state.add(name, self.VARVALUE)
+                thread_state.save()
+
+        threads = [
+            threading.Thread(target=add_variable, args=(name, ))
+            for name in names
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        final_state = self.read_level(state.key)
+        for name in names:
+            self.assertEqual(final_state.data[name], self.VARVALUE)
+        self.assertEqual(glob.glob('.unittest-*.tmp'), [])
+        self.assertEqual(glob.glob('unittest-*.lock'), [])
+
+    def test_save_permissions(self):
+        """New files should follow the umask and saved files keep their mode."""
+        state = self.create_and_read_level()
+        with open('unittest-reference', 'w'):
+            pass
+        self.assertEqual(
+            stat.S_IMODE(os.stat(state.filename).st_mode),
+            stat.S_IMODE(os.stat('unittest-reference').st_mode))
+
+        os.chmod(state.filename, 0o640)
+        state.add(self.VARKEY, self.VARVALUE)
+        state.save()
+        self.assertEqual(stat.S_IMODE(os.stat(state.filename).st_mode), 0o640)
+
+    def test_read_variable(self):
+        """A single variable should be read without loading the state."""
+        key_list = self.create_levels(self.DEFAULT_LEVELS[:3])
+        state = self.read_level(key_list[1])
+        state.add(self.VARKEY, self.VARVALUE)
+        state.save()
+
+        read_fields = State.read_fields
+        with mock.patch.object(State, 'load') as load, mock.patch.object(
+                State, 'read_fields', side_effect=read_fields) as searches:
+            name, value = StateList.find_variable(
+                self.VARKEY.lower(), key=key_list[1], load_filter='unittest-*')
+            load.assert_not_called()
+            # each file is searched once, the staging one is the last
+            self.assertEqual(searches.call_count, 3)
+
+        self.assertEqual(name, self.DEFAULT_LEVELS[1])
+        self.assertEqual(value, self.VARVALUE)
+        self.assertEqual(
+            StateList.find_variable(
+                State.SECRET_KEY, key=key_list[1],
+                load_filter='unittest-*')[1], state.django_secret)
+
+        with self.assertRaises(VariableNotFound):
+            StateList.find_variable(
+                'MISSING', key=key_list[1], load_filter='unittest-*')
+
+        with self.assertRaises(InvalidKey):
+            State.read_variable(state.filename, self.VARKEY,
+                                Encrypter(key=key_list[0]))
+
+    def test_dual_key_rotation(self):
+        """A state should be read with either key while a key is rotated."""
+        old_key = self.create_levels(self.DEFAULT_LEVELS[:2])[0]
+        new_key = Encrypter.generate_key()
+        dual_key = b','.join([new_key, old_key])
+
+        state = self.read_level(old_key)
+        state.add(self.VARKEY, self.VARVALUE)
+        state.save()
+
+        with open(state.filename) as env_file:
+            before = env_file.read()
+        dual_state = self.read_level(dual_key)
+        with open(state.filename) as env_file:
+            self.assertEqual(env_file.read(), before)
+        self.assertEqual(dual_state.data[self.VARKEY], self.VARVALUE)
+
+        # re-encrypt the state with the new key, keeping the secret
+        dual_state.set_key(new_key, regenerate_secret=False)
+        dual_state.save()
+
+        for key in (new_key, dual_key):
+            new_state = self.read_level(key)
+            self.assertEqual(new_state.data[self.VARKEY], self.VARVALUE)
+            self.assertEqual(new_state.django_secret, state.django_secret)
+
+        with self.assertRaises(InvalidKey):
+            State.read_variable(state.filename, self.VARKEY,
+                                Encrypter(key=old_key))
+
+    def test_dual_key_save(self):
+        """Saving with a second key should encrypt everything with the first."""
+        old_key = self.create_levels(self.DEFAULT_LEVELS[:1])[0]
+        new_key = Encrypter.generate_key()
+
+        state = self.read_level(','.join([new_key.decode(), old_key.decode()]))
+        state.add(self.VARKEY, self.VARVALUE)
+        state.save()
+
+        new_state = self.read_level(new_key)
+        self.assertEqual(new_state.data[self.VARKEY], self.VARVALUE)
+        self.assertEqual(new_state.django_secret, state.django_secret)
+
+    def test_dual_key_envelope_save(self):
+        """An envelope saved with a second key should keep its changes."""
+        for algorithm in [State.FERNET_ENVELOPE, State.AES_GCM_ENVELOPE,
+                          State.CHACHA20_POLY1305_ENVELOPE]:
+            old_state = State.new(
+                self.DEFAULT_LEVELS[0], crypto_algorithm=algorithm)
+            old_state.add(self.VARKEY, self.VARVALUE)
+            old_state.add('REMOVED', 'removed')
+            old_state.save()
+            new_key = Encrypter.generate_key()
+
+            state = self.read_level(','.join(
+                [new_key.decode(), old_state.key.decode()]))
+            state.add('ADDED', 'added')
+            state.remove('REMOVED')
+            state.save()
+
+            new_state = self.read_level(new_key)
+            self.assertEqual(
+                dict(new_state.data.items()), {
+                    self.VARKEY: self.VARVALUE,
+                    'ADDED': 'added'
+                })
+            self.assertEqual(new_state.django_secret, old_state.django_secret)
+
+    def test_envelope_algorithm(self):
+        """An envelope state should keep all variables in one token."""
+        state = State.new(
+            self.DEFAULT_LEVELS[0], crypto_algorithm=State.FERNET_ENVELOPE)
+        state.add(self.VARKEY, self.VARVALUE)
+        state.save()
+
+        with open(state.filename) as env_file:
+            env_object = json.loads(env_file.read())
+        self.assertIn(State.PAYLOAD, env_object)
+        self.assertNotIn(self.VARKEY, env_object)
+        self.assertNotIn(State.SECRET_KEY, env_object)
+
+        new_state = self.read_level(state.key)
+        self.assertTrue(new_state.is_envelope)
+        self.assertEqual(new_state.django_secret, state.django_secret)
+        self.assertEqual(new_state.data[self.VARKEY], self.VARVALUE)
+
+    def test_aead_algorithms(self):
+        """The states should be saved and read with the AEAD ciphers."""
+        for algorithm in [State.AES_GCM, State.CHACHA20_POLY1305_ENVELOPE]:
+            state = State.new(self.DEFAULT_LEVELS[0], crypto_algorithm=algorithm)
+            state.add(self.VARKEY, self.VARVALUE)
+            state.save()
+
+            new_state = self.read_level(state.key)
+            self.assertEqual(new_state.crypto_algorithm, algorithm)
+            self.assertEqual(new_state.django_secret, state.django_secret)
+            self.assertEqual(new_state.data[self.VARKEY], self.VARVALUE)
+            self.assertEqual(
+                State.read_variable(state.filename, self.VARKEY,
+                                    Encrypter(state.key)), self.VARVALUE)
+
+    def test_unknown_algorithm(self):
+        """An unknown algorithm should not be reported as an invalid key."""
+        state = State.new(self.DEFAULT_LEVELS[0])
+        state.crypto_algorithm = 'unknown'
+        with self.assertRaises(ValueError) as context:
+            state.set_key(state.key)
+        self.assertNotIsInstance(context.exception, InvalidKey)
+        self.assertNotIn(state.key.decode(), str(context.exception))
+
+    def test_typed_variables(self):
+        """Typed variables should be saved as text and read parsed."""
+        for algorithm in [State.FERNET, State.AES_GCM_ENVELOPE]:
+            state = State.new(self.DEFAULT_LEVELS[0], crypto_algorithm=algorithm)
+            state.add('WORKERS', '8', variable_type='int')
+            state.add('DEBUG', True)
+            state.add('HOSTS', 'a.com, b.com', variable_type='list')
+            state.add(self.VARKEY, self.VARVALUE)
+            with self.assertRaises(InvalidVariableValue):
+                state.add('TIMEOUT', 'soon', variable_type='duration')
+            self.assertNotIn('TIMEOUT', state.data)
+            state.save()
+
+            new_state = self.read_level(state.key)
+            self.assertEqual(new_state.data['WORKERS'], 8)
+            self.assertIs(new_state.data['DEBUG'], True)
+            self.assertEqual(new_state.data['HOSTS'], ['a.com', 'b.com'])
+            self.assertEqual(
+                State.read_variable(state.filename, 'WORKERS',
+                                    Encrypter(state.key)), 8)
+
+            # the variables without a type are read without the whole state
+            if algorithm == State.FERNET:
+                self.assertEqual(
+                    State.read_type(state.filename, 'HOSTS'), 'list')
+                self.assertIsNone(State.read_type(state.filename, self.VARKEY))
+                with mock.patch.object(
+                        State, 'load', side_effect=AssertionError):
+                    self.assertEqual(
+                        State.read_variable(state.filename, self.VARKEY,
+                                            Encrypter(state.key)),
+                        self.VARVALUE)
+
+            # a variable replaced by text keeps its type
+            new_state.add('WORKERS', '9', force=True)
+            new_state.save()
+            self.assertEqual(self.read_level(state.key).data['WORKERS'], 9)
+            with self.assertRaises(InvalidVariableValue):
+                new_state.add('WORKERS', 'many', force=True)
+
+            # it is only text again once it is removed
+            new_state.remove('WORKERS')
+            new_state.add('WORKERS', '8')
+            new_state.save()
+            self.assertEqual(self.read_level(state.key).data['WORKERS'], '8')
+            self.assertNotIn('WORKERS', new_state.types)
+
+    def test_lazy_decryption(self):
+        """A lazy state should only decrypt variables when they are read."""
+        state = self.create_and_read_level()
+        state.add(self.VARKEY, self.VARVALUE)
+        state.save()
+
+        lazy_state = StateList(key=state.key, lazy=True).get()
+        self.assertIn(self.VARKEY, lazy_state.data)
+        self.assertFalse(lazy_state.data.is_decrypted(self.VARKEY))
+
+        self.assertEqual(lazy_state.data[self.VARKEY], self.VARVALUE)
+        self.assertTrue(lazy_state.data.is_decrypted(self.VARKEY))
+
 
 class StateListTest(StateCreationTestCase):
     """Test the state list module."""
@@ -112,6 +389,10 @@ class StateListTest(StateCreationTestCase):
         with self.assertRaises(
                 InvalidKey, msg="An invalid key should raise a exception."):
             StateList(key=self.INVALID_KEY)
+        # the key is kept out of the logs
+        with self.assertRaises(InvalidKey) as context:
+            StateList(key=self.INVALID_KEY)
+        self.assertNotIn(self.INVALID_KEY, str(context.exception))
 
         self.assertTrue(
             StateList().get() is None,
@@ -129,6 +410,94 @@ class StateListTest(StateCreationTestCase):
             self.assertEqual(state.name, self.DEFAULT_LEVELS[i],
                              'Could not read an environment from a key')
 
+    def test_read_state_list_single_pass(self):
+        """Only the state that matches the key should be decrypted."""
+        key_list = self.create_levels(self.DEFAULT_LEVELS)
+
+        state_list = StateList(key=key_list[2], load_filter='unittest-*')
+        self.assertEqual(state_list.get().name, self.DEFAULT_LEVELS[2])
+        self.assertIs(state_list.get().encrypter, state_list.encrypter)
+        for state in state_list.list_of_states:
+            self.assertEqual(state.decrypted, state is state_list.get())
+
+        # the signed name checked to select the state isn't checked again
+        with mock.patch.object(
+                State, 'verify', wraps=State.verify) as verify:
+            StateList(
+                key=key_list[2], load_filter='unittest-*', cache=False)
+        verify.assert_called_once()
+
+    def test_release_states(self):
+        """Other states should only keep a shared manifest until released."""
+        key_list = self.create_levels(self.DEFAULT_LEVELS)
+
+        state_list = StateList(key=key_list[0], load_filter='unittest-*')
+        summaries = state_list.list_of_states[1:]
+        for summary in summaries:
+            self.assertIsInstance(summary, StateSummary)
+            self.assertFalse(hasattr(summary, '__dict__'))
+            self.assertIs(summary.manifest, summaries[0].manifest)
+        self.assertFalse(hasattr(state_list.get(), '__dict__'))
+
+        state_list.release()
+        self.assertEqual(state_list.list_of_states, [state_list.get()])
+        self.assertEqual(state_list.name, self.DEFAULT_LEVELS[0])
+
+    def test_key_fingerprint_update(self):
+        """Files without a key fingerprint should be updated when saved."""
+        key_list = self.create_levels(self.DEFAULT_LEVELS[:2])
+        filename = '{}.{}'.format(self.DEFAULT_LEVELS[1], State.FILE_EXTENSION)
+
+        with open(filename) as env_file:
+            env_object = json.loads(env_file.read())
+        del env_object[State.KEY_ID]
+        with open(filename, 'w') as env_file:
+            env_file.write(json.dumps(env_object))
+
+        state = StateList(key=key_list[1], load_filter='unittest-*').get()
+        self.assertEqual(state.name, self.DEFAULT_LEVELS[1])
+        self.assertTrue(state.outdated)
+        with open(filename) as env_file:
+            self.assertNotIn(State.KEY_ID, json.loads(env_file.read()))
+
+        self.assertTrue(state.update())
+        self.assertFalse(state.update())
+        with open(filename) as env_file:
+            env_object = json.loads(env_file.read())
+        self.assertEqual(env_object[State.KEY_ID], state.encrypter.fingerprint)
+
+    def test_legacy_version_update(self):
+        """Files with base64 digests should be read, and saved as tokens."""
+        key = Encrypter.generate_key()
+        encrypter = Encrypter(key=key)
+        name = self.DEFAULT_LEVELS[0]
+        filename = '{}.{}'.format(name, State.FILE_EXTENSION)
+        with open(filename, 'w') as env_file:
+            env_file.write(
+                json.dumps({
+                    State.NAME: name,
+                    State.SIGNED_NAME: encrypter.encrypt(name),
+                    State.SECRET_KEY: encrypter.encrypt('secret'),
+                    State.VERSION: '0.8.6',
+                    self.VARKEY: encrypter.encrypt(self.VARVALUE),
+                }))
+
+        # the file is read on a read-only file system
+        with mock.patch('envcrypto.state.atomic_write',
+                        side_effect=PermissionError):
+            state = StateList(key=key, load_filter='unittest-*').get()
+        self.assertEqual(state.django_secret, 'secret')
+        self.assertEqual(state.data[self.VARKEY], self.VARVALUE)
+        self.assertTrue(state.outdated)
+
+        state.save()
+        self.assertFalse(state.outdated)
+        with open(filename) as env_file:
+            env_object = json.loads(env_file.read())
+        self.assertEqual(env_object[State.VERSION], State.CURRENT_VERSION)
+        self.assertEqual(
+            encrypter.decrypt_token(env_object[self.VARKEY]), self.VARVALUE)
+
     def test_transcode_variables(self):
         """Transcode an environment."""
         key_list = self.create_levels(self.DEFAULT_LEVELS[:2])
@@ -179,3 +548,24 @@ class StateListTest(StateCreationTestCase):
                 msg="A missing variable on a state did not raise an exception"
         ):
             state_list.check_variables(raise_on_warning=True)
+
+    def test_variables_manifest(self):
+        """The variable names should be compared without any key."""
+        key_list = self.create_levels(self.DEFAULT_LEVELS[:2])
+
+        state = StateList(key=key_list[0], load_filter='unittest-*').get()
+        state.add(self.VARKEY, self.VARVALUE)
+        state.save()
+
+        with open(state.filename) as env_file:
+            self.assertEqual(
+                json.load(env_file)[State.VARIABLES], [self.VARKEY])
+
+        manifests = StateList.read_manifests(load_filter='unittest-*')
+        self.assertEqual(manifests, {
+            self.DEFAULT_LEVELS[0]: {self.VARKEY},
+            self.DEFAULT_LEVELS[1]: set()
+        })
+        self.assertEqual(
+            StateList.find_missing_variables(manifests),
+            {self.VARKEY: [self.DEFAULT_LEVELS[1]]})
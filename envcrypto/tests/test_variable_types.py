@@ -0,0 +1,63 @@
+"""Test the variable_types module."""
+from datetime import timedelta
+
+from .. import variable_types
+from ..exceptions import InvalidVariableValue
+from .tests import CommonTestCase
+
+
+class VariableTypesTest(CommonTestCase):
+    """Test parsing the text of the typed variables."""
+
+    def test_loads(self):
+        """Each type should parse its text."""
+        cases = [
+            (variable_types.INT, '8', 8),
+            (variable_types.BOOL, 'Yes', True),
+            (variable_types.BOOL, 'off', False),
+            (variable_types.FLOAT, '0.5', 0.5),
+            (variable_types.JSON, '{"a": [1]}', {'a': [1]}),
+            (variable_types.LIST, 'a, b,,c', ['a', 'b', 'c']),
+            (variable_types.LIST, '["a,b"]', ['a,b']),
+            (variable_types.DURATION, '90', timedelta(seconds=90)),
+            (variable_types.DURATION, '1d2h30m',
+             timedelta(days=1, hours=2, minutes=30)),
+        ]
+        for variable_type, text, value in cases:
+            self.assertEqual(variable_types.loads(variable_type, text), value)
+            self.assertEqual(
+                variable_types.loads(
+                    variable_type, variable_types.dumps(variable_type, value)),
+                value)
+
+        # the types of later versions are kept as text
+        self.assertEqual(variable_types.loads('unknown', '8'), '8')
+
+    def test_invalid_values(self):
+        """Values that don't match their type should raise an exception."""
+        cases = [
+            (variable_types.INT, 'eight'),
+            (variable_types.INT, True),
+            (variable_types.BOOL, 'maybe'),
+            (variable_types.JSON, '{'),
+            (variable_types.LIST, '["a"'),
+            (variable_types.DURATION, '1w'),
+            (variable_types.DURATION, ''),
+            (variable_types.DURATION, 'inf'),
+            (variable_types.DURATION, '1e400'),
+            (variable_types.DURATION, float('inf')),
+            (variable_types.DURATION, '999999999999d'),
+            ('unknown', '8'),
+        ]
+        for variable_type, value in cases:
+            with self.assertRaises(InvalidVariableValue):
+                variable_types.convert(variable_type, value)
+
+    def test_infer_type(self):
+        """Values should get the type of their python type."""
+        self.assertIsNone(variable_types.infer_type('8'))
+        self.assertEqual(variable_types.infer_type(True), variable_types.BOOL)
+        self.assertEqual(variable_types.infer_type(8), variable_types.INT)
+        self.assertEqual(
+            variable_types.infer_type(('a', )), variable_types.LIST)
+        self.assertEqual(variable_types.infer_type({}), variable_types.JSON)
@@ -0,0 +1,59 @@
+"""Test the watcher module."""
+import threading
+
+from ..files import atomic_write
+from ..state import State
+from ..watcher import StateWatcher, diff_states
+from .test_state import StateCreationTestCase
+
+
+class WatcherTest(StateCreationTestCase):
+    """Test watching the .env files."""
+
+    FILENAME = 'unittest-watched.env'
+
+    def test_check(self):
+        """The function should only be called when the file changes."""
+        atomic_write(self.FILENAME, 'first')
+        calls = []
+        watcher = StateWatcher(self.FILENAME, lambda: calls.append(1))
+
+        self.assertFalse(watcher.check())
+        atomic_write(self.FILENAME, 'second')
+        self.assertTrue(watcher.check())
+        self.assertFalse(watcher.check())
+        self.assertEqual(len(calls), 1)
+
+    def test_thread(self):
+        """The watcher thread should call the function on a change."""
+        atomic_write(self.FILENAME, 'first')
+        changed = threading.Event()
+        watcher = StateWatcher(self.FILENAME, changed.set, interval=0.01)
+        watcher.start()
+        try:
+            atomic_write(self.FILENAME, 'second')
+            self.assertTrue(changed.wait(5))
+        finally:
+            watcher.stop()
+        self.assertFalse(watcher.running)
+
+    def test_diff_states(self):
+        """The diff should have the changed values and the removed names."""
+        old = State.new(self.DEFAULT_LEVELS[0])
+        for k in ['A', 'B', 'C']:
+            old.add(k, k.lower())
+        old.save()
+        new = State(old.filename, key=old.key, read_from_env=False, lazy=True)
+        new.add('B', 'changed', force=True)
+        new.remove('C')
+        new.add('D', 'd')
+        new.save()
+
+        new = State(old.filename, key=old.key, read_from_env=False, lazy=True)
+        self.assertEqual(
+            diff_states(old, new), ({
+                'B': 'changed',
+                'D': 'd'
+            }, {'C'}))
+        # the variables that kept their token are not decrypted
+        self.assertFalse(new.data.is_decrypted('A'))
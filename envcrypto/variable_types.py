@@ -0,0 +1,172 @@
+"""Parse the typed variables once, when they are decrypted.
+
+The .env files keep every value as text, together with the name of the type
+of the typed variables. The text is parsed, and checked, when the variable is
+decrypted, so the settings get an int, a bool or a list instead of converting
+the text themselves every time they use it.
+"""
+import re
+from datetime import timedelta
+
+from . import serializers
+from .exceptions import InvalidVariableValue
+
+INT = 'int'
+BOOL = 'bool'
+FLOAT = 'float'
+JSON = 'json'
+LIST = 'list'
+DURATION = 'duration'
+
+TRUE = ('true', 'yes', 'on', '1')
+FALSE = ('false', 'no', 'off', '0')
+LIST_SEPARATOR = ','
+DURATION_PATTERN = re.compile(r'^(?:(?P<days>\d+(?:\.\d+)?)d)?'
+                              r'(?:(?P<hours>\d+(?:\.\d+)?)h)?'
+                              r'(?:(?P<minutes>\d+(?:\.\d+)?)m)?'
+                              r'(?:(?P<seconds>\d+(?:\.\d+)?)s)?$')
+
+
+def loads_bool(text):
+    """Parse true/false, yes/no, on/off or 1/0."""
+    value = text.strip().lower()
+    if value in TRUE:
+        return True
+    if value in FALSE:
+        return False
+    raise ValueError(text)
+
+
+def dumps_bool(value):
+    """Return true or false."""
+    if not isinstance(value, bool):
+        raise TypeError(value)
+    return TRUE[0] if value else FALSE[0]
+
+
+def dumps_number(value):
+    """Return the text of a number, but not of a bool."""
+    if isinstance(value, bool):
+        raise TypeError(value)
+    return str(value)
+
+
+def loads_list(text):
+    """Parse a JSON list, or a list of comma separated values."""
+    text = text.strip()
+    if text.startswith('['):
+        value = serializers.loads(text)
+        if not isinstance(value, list):
+            raise ValueError(text)
+        return value
+    return [v.strip() for v in text.split(LIST_SEPARATOR) if v.strip()]
+
+
+def dumps_list(value):
+    """Return a list as JSON."""
+    if not isinstance(value, (list, tuple)):
+        raise TypeError(value)
+    return serializers.dumps(list(value), compact=True)
+
+
+def loads_duration(text):
+    """Parse a number of seconds, or a duration like 1d2h30m10s."""
+    text = text.strip()
+    try:
+        return timedelta(seconds=float(text))
+    except ValueError:
+        pass
+
+    match = DURATION_PATTERN.match(text)
+    if not text or match is None:
+        raise ValueError(text)
+    return timedelta(
+        **{k: float(v)
+           for k, v in match.groupdict().items() if v is not None})
+
+
+def dumps_duration(value):
+    """Return the number of seconds of a duration."""
+    seconds = value.total_seconds()
+    return str(int(seconds)) if seconds.is_integer() else str(seconds)
+
+
+def loads_json(text):
+    """Parse a JSON document."""
+    return serializers.loads(text)
+
+
+def dumps_json(value):
+    """Return the value as compact JSON."""
+    return serializers.dumps(value, compact=True)
+
+
+# the name of each type and the functions that read and write its text
+TYPES = {
+    INT: (int, dumps_number),
+    BOOL: (loads_bool, dumps_bool),
+    FLOAT: (float, dumps_number),
+    JSON: (loads_json, dumps_json),
+    LIST: (loads_list, dumps_list),
+    DURATION: (loads_duration, dumps_duration),
+}
+
+
+def register_type(name, loads, dumps=str):
+    """Add a type, with the functions that parse and return its text."""
+    TYPES[name] = (loads, dumps)
+
+
+def infer_type(value):
+    """Return the type of a value, or None for text."""
+    # a bool is also an int, so it is checked first
+    for python_type, variable_type in ((str, None), (bool, BOOL), (int, INT),
+                                       (float, FLOAT), (timedelta, DURATION),
+                                       ((list, tuple), LIST)):
+        if isinstance(value, python_type):
+            return variable_type
+    return JSON
+
+
+def check_type(variable_type):
+    """Raise an exception if the type is not known."""
+    if variable_type not in TYPES:
+        raise InvalidVariableValue("Unknown type {}".format(variable_type))
+
+
+def loads(variable_type, text):
+    """Parse the text of a variable.
+
+    The text of a type that is not known, maybe from a later version, is
+    kept as it is.
+    """
+    if variable_type not in TYPES:
+        return text
+    try:
+        return TYPES[variable_type][0](text)
+    except (OverflowError, TypeError, ValueError):
+        raise InvalidVariableValue("{!r} is not a valid {}".format(
+            text, variable_type))
+
+
+def dumps(variable_type, value):
+    """Return the text of a variable."""
+    if variable_type not in TYPES:
+        return value
+    try:
+        return TYPES[variable_type][1](value)
+    except (AttributeError, OverflowError, TypeError, ValueError):
+        raise InvalidVariableValue("{!r} is not a valid {}".format(
+            value, variable_type))
+
+
+def convert(variable_type, value):
+    """Return the value of a type, from its text or from a value.
+
+    A value that isn't text is written and parsed again, so it is checked
+    the same way as when it is read from the file.
+    """
+    check_type(variable_type)
+    if not isinstance(value, str):
+        value = dumps(variable_type, value)
+    return loads(variable_type, value)
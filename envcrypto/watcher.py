@@ -0,0 +1,124 @@
+"""Watch the active .env file and reload it when it changes.
+
+A thread checks the file every few seconds, from its inode, modification
+time and size, which is much faster than reading it. When the file changed
+the callback reads it again on that thread, so the requests being handled
+are never blocked, and only the variables that changed are updated.
+"""
+import logging
+import os
+import threading
+import weakref
+
+DEFAULT_INTERVAL = 2
+
+# the running watchers, started again in the processes forked from this one
+WATCHERS = weakref.WeakSet()
+
+
+def file_signature(filename):
+    """Return the inode, modification time and size of a file, or None."""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def diff_states(old, new):
+    """Return the variables changed and the names removed between states.
+
+    The variables that kept their token are the same, so they are not
+    decrypted, and only the new values of the others are. The values without
+    tokens are compared.
+    """
+    old_tokens = getattr(old.data, 'tokens', {})
+    new_tokens = getattr(new.data, 'tokens', {})
+
+    changed = {}
+    if old.django_secret != new.django_secret:
+        changed[new.SECRET_KEY] = new.django_secret
+    for k in new.data:
+        if k not in old.data:
+            changed[k] = new.data[k]
+        elif k in old_tokens and k in new_tokens:
+            if old_tokens[k] != new_tokens[k]:
+                changed[k] = new.data[k]
+        elif old.data[k] != new.data[k]:
+            changed[k] = new.data[k]
+    removed = set(old.data) - set(new.data)
+    return changed, removed
+
+
+class StateWatcher(object):
+    """Call a function, on a thread, whenever a file changes."""
+
+    def __init__(self, filename, callback, interval=DEFAULT_INTERVAL):
+        """Keep the file and the function to call when it changes."""
+        self.filename = filename
+        self.callback = callback
+        self.interval = interval
+        self.signature = file_signature(filename)
+        self.stopped = threading.Event()
+        self.thread = None
+
+    @property
+    def running(self):
+        """Check if the watcher thread is running."""
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        """Start checking the file on a daemon thread."""
+        if self.running:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(
+            target=self.run, name='envcrypto-watcher', daemon=True)
+        self.thread.start()
+        WATCHERS.add(self)
+
+    def stop(self):
+        """Stop checking the file."""
+        WATCHERS.discard(self)
+        self.stopped.set()
+        if self.running and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def run(self):
+        """Check the file until the watcher is stopped."""
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def check(self):
+        """Call the function if the file changed, returning if it did.
+
+        A function that fails is called again on the next change.
+        """
+        signature = file_signature(self.filename)
+        if signature is None or signature == self.signature:
+            return False
+
+        try:
+            self.callback()
+        except Exception:
+            logging.warning(
+                "Could not reload {}".format(self.filename), exc_info=True)
+        self.signature = signature
+        return True
+
+    def after_fork_in_child(self):
+        """Start a thread on the child, as only the forking thread is copied."""
+        self.thread = None
+        self.stopped = threading.Event()
+        self.start()
+
+
+def after_fork_in_child():
+    """Start the watchers again on a forked process."""
+    for watcher in list(WATCHERS):
+        watcher.after_fork_in_child()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=after_fork_in_child)
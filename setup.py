@@ -24,4 +24,5 @@ setup(
     tests_require=[
         'django>=2.1.4', 'mock', 'nose', 'coverage', 'urllib3[secure]'
     ],
-    install_requires=['cryptography>=2.1.4'])
+    install_requires=['cryptography>=2.1.4'],
+    extras_require={'fast': ['orjson']})